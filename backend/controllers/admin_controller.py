@@ -0,0 +1,38 @@
+import hmac
+
+from litestar import Controller, get
+from litestar.connection import ASGIConnection
+from litestar.exceptions import HTTPException, NotAuthorizedException, PermissionDeniedException
+from litestar.handlers import BaseRouteHandler
+from litestar.response import Response
+
+from services.cluster_service import WORKER_ID
+from services.config_service import settings
+from services.profiling_service import PROFILE_MAX_HZ, PROFILE_MAX_SECONDS, ProfileInProgressError, profile
+
+
+def admin_guard(connection: ASGIConnection, _: BaseRouteHandler) -> None:
+    token = settings.get().admin_token
+    if not token:
+        raise PermissionDeniedException("Admin endpoints are disabled; set ADMIN_TOKEN in the secrets file")
+    supplied = connection.headers.get("authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        raise NotAuthorizedException("Invalid admin token")
+
+
+class AdminController(Controller):
+    path = "/admin"
+    tags = ["admin"]
+    guards = [admin_guard]
+
+    @get("/profile")
+    async def profile(self, seconds: float = 10, hz: int = 100) -> Response[str]:
+        """Samples the worker that serves the request and returns collapsed
+        stacks for flamegraph.pl or speedscope."""
+        seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+        hz = min(max(hz, 1), PROFILE_MAX_HZ)
+        try:
+            stacks = await profile(seconds, hz)
+        except ProfileInProgressError:
+            raise HTTPException(status_code=409, detail="A profile is already running")
+        return Response(stacks, media_type="text/plain", headers={"X-Birdstream-Worker": str(WORKER_ID)})
@@ -0,0 +1,77 @@
+import logging
+from typing import Annotated
+
+from litestar import Controller, Response, get
+from litestar.datastructures import State
+from litestar.exceptions import ClientException, NotFoundException, ServiceUnavailableException
+from litestar.params import PathParameter, QueryParameter
+
+from services.hls_service import (
+    HLS_REQUESTS,
+    HLS_SEGMENT_TARGET,
+    HLS_WINDOW,
+    HlsRequestError,
+    HlsUnavailableError,
+)
+
+logger = logging.getLogger("hls_controller")
+
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+# Segment, part and init names are never reused, so caches may keep them.
+IMMUTABLE = "public, max-age=31536000, immutable"
+# A live playlist changes with every part.
+LIVE_PLAYLIST = "public, max-age=1"
+# A blocking reload for a given msn/part always contains that part, so the
+# same URL can be answered from cache for as long as the window lasts.
+BLOCKING_PLAYLIST = f"public, max-age={int(HLS_SEGMENT_TARGET * HLS_WINDOW)}"
+NO_CACHE = {"Cache-Control": "no-cache"}
+
+
+class HlsController(Controller):
+    path = "/hls"
+    tags = ["hls"]
+
+    @get("/stream.m3u8")
+    async def playlist(
+        self,
+        state: State,
+        msn: Annotated[int | None, QueryParameter(name="_HLS_msn", ge=0)] = None,
+        part: Annotated[int | None, QueryParameter(name="_HLS_part", ge=0)] = None,
+    ) -> Response[str]:
+        if part is not None and msn is None:
+            raise ClientException("_HLS_part requires _HLS_msn", headers=NO_CACHE)
+        try:
+            playlist = await state.hls.playlist(msn, part)
+        except HlsRequestError as e:
+            HLS_REQUESTS.inc(kind="playlist", status="400")
+            raise ClientException(str(e), headers=NO_CACHE) from e
+        except HlsUnavailableError as e:
+            HLS_REQUESTS.inc(kind="playlist", status="503")
+            raise ServiceUnavailableException(
+                "LL-HLS stream is not available", headers={**NO_CACHE, "Retry-After": "1"}
+            ) from e
+        HLS_REQUESTS.inc(kind="playlist", status="200")
+        return Response(
+            playlist,
+            media_type=PLAYLIST_MEDIA_TYPE,
+            headers={"Cache-Control": BLOCKING_PLAYLIST if msn is not None else LIVE_PLAYLIST},
+        )
+
+    @get("/{name:str}")
+    async def media(self, name: Annotated[str, PathParameter()], state: State) -> Response[bytes]:
+        kind = name.split("-", 1)[0]
+        if kind not in ("init", "seg", "part"):
+            kind = "other"
+        try:
+            data = await state.hls.media(name)
+        except HlsUnavailableError as e:
+            HLS_REQUESTS.inc(kind=kind, status="503")
+            raise ServiceUnavailableException(
+                "LL-HLS stream is not available", headers={**NO_CACHE, "Retry-After": "1"}
+            ) from e
+        if data is None:
+            HLS_REQUESTS.inc(kind=kind, status="404")
+            raise NotFoundException(headers=NO_CACHE)
+        HLS_REQUESTS.inc(kind=kind, status="200")
+        media_type = "video/mp4" if name.endswith(".mp4") else "video/iso.segment"
+        return Response(data, media_type=media_type, headers={"Cache-Control": IMMUTABLE})
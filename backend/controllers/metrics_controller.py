@@ -0,0 +1,11 @@
+from litestar import get
+from litestar.response import Response
+
+from services.metrics_service import registry
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+@get("/metrics", tags=["metrics"], sync_to_thread=False)
+def metrics_endpoint() -> Response[str]:
+    return Response(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
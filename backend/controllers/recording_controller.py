@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+
+from litestar import Controller, get
+from litestar.background_tasks import BackgroundTask
+from litestar.datastructures import State
+from litestar.exceptions import NotFoundException, ValidationException
+from litestar.response import File
+
+from services.recording_service import RECORDING_MAX_CLIP_SECONDS
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds")
+
+
+def _utc(moment: datetime) -> datetime:
+    # The index is listed in UTC, so times without a zone are read as UTC
+    # rather than as the server's local time.
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+class RecordingController(Controller):
+    path = "/recordings"
+    tags = ["recordings"]
+
+    @get("/")
+    async def index(
+        self, state: State, start: datetime | None = None, end: datetime | None = None
+    ) -> list[dict]:
+        recorder = state.recorder
+        if not recorder.enabled:
+            raise NotFoundException("Recording is disabled")
+        segments = recorder.segments_between(
+            _utc(start).timestamp() if start else 0.0,
+            _utc(end).timestamp() if end else float("inf"),
+        )
+        return [
+            {"start": _iso(s.start), "end": _iso(s.end), "duration": round(s.duration, 3), "size": s.size}
+            for s in segments
+        ]
+
+    @get("/clip.mp4")
+    async def clip(self, state: State, start: datetime, end: datetime) -> File:
+        recorder = state.recorder
+        if not recorder.enabled:
+            raise NotFoundException("Recording is disabled")
+        start, end = _utc(start), _utc(end)
+        duration = (end - start).total_seconds()
+        if duration <= 0:
+            raise ValidationException("end must be after start")
+        if duration > RECORDING_MAX_CLIP_SECONDS:
+            raise ValidationException(f"Clips are limited to {RECORDING_MAX_CLIP_SECONDS} seconds")
+
+        path = await recorder.export_clip(start.timestamp(), end.timestamp())
+        if path is None:
+            raise NotFoundException("Nothing was recorded in that range")
+        return File(
+            path,
+            filename=f"clip-{start.strftime('%Y%m%dT%H%M%S')}.mp4",
+            media_type="video/mp4",
+            background=BackgroundTask(path.unlink, missing_ok=True),
+        )
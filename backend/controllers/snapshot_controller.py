@@ -0,0 +1,56 @@
+from email.utils import formatdate, parsedate_to_datetime
+
+from litestar import Request, Response, get
+from litestar.datastructures import State
+from litestar.exceptions import ServiceUnavailableException, ValidationException
+from litestar.params import Parameter
+
+from services.snapshot_service import (
+    SNAPSHOT_MAX_FPS,
+    SNAPSHOT_QUALITY,
+    SNAPSHOT_WIDTHS,
+    SnapshotUnavailableError,
+    quantize_quality,
+)
+
+# A snapshot is replaced at most SNAPSHOT_MAX_FPS times a second.
+SNAPSHOT_CACHE_CONTROL = f"public, max-age={max(1, round(1 / SNAPSHOT_MAX_FPS))}"
+
+
+def _not_modified(request: Request, etag: str, modified: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@get("/snapshot.jpg", tags=["snapshot"])
+async def snapshot_endpoint(
+    request: Request,
+    state: State,
+    width: int | None = Parameter(default=None, gt=0),
+    quality: int = Parameter(default=SNAPSHOT_QUALITY, ge=1, le=100),
+) -> Response[bytes]:
+    if width is not None and width not in SNAPSHOT_WIDTHS:
+        raise ValidationException(f"width must be one of {', '.join(map(str, SNAPSHOT_WIDTHS))}")
+    try:
+        snapshot = await state.snapshots.snapshot(width, quantize_quality(quality))
+    except SnapshotUnavailableError as e:
+        raise ServiceUnavailableException(
+            "No video frame available", headers={"Cache-Control": "no-cache", "Retry-After": "1"}
+        ) from e
+
+    headers = {
+        "ETag": snapshot.etag,
+        "Last-Modified": formatdate(snapshot.modified, usegmt=True),
+        "Cache-Control": SNAPSHOT_CACHE_CONTROL,
+    }
+    if _not_modified(request, snapshot.etag, snapshot.modified):
+        return Response(b"", status_code=304, headers=headers)
+    return Response(snapshot.data, media_type="image/jpeg", headers=headers)
@@ -1,28 +1,128 @@
 import logging
 
-from litestar import Controller, get, post
+import msgspec
+from litestar import Controller, Request, get, post
 from litestar.datastructures import State
-from litestar.exceptions import ValidationException
+from litestar.exceptions import NotFoundException, ServiceUnavailableException, ValidationException
+from litestar.response import Response
 
-from models.datastructures import ClientModel
-from services.webrtc_service import handle_offer, pcs_manager, get_webrtc_config
+from models.datastructures import ClientModel, IceCandidateModel
+from services.admission_service import OfferRejectedError
+from services.cluster_service import CLUSTERED, PeerLimitError
+from services.webrtc_service import add_ice_candidate, get_webrtc_config, handle_offer, restart_ice
 
 logger = logging.getLogger("webrtc_controller")
 
+PEER_LIMIT_RETRY_AFTER = 10  # seconds
+PEERS_MAX_LIMIT = 1000  # largest page of /getpeers
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
 
 class WebRTCController(Controller):
     path = "/webrtc"
     tags = ["webrtc"]
 
     @post("/offer")
-    async def offer(self, data: ClientModel, state: State) -> dict:
+    async def offer(self, data: ClientModel, state: State, camera: str | None = None) -> dict:
+        if not data.offer.sdp:
+            raise ValidationException("offer.sdp cannot be empty")
+        selected = state.cameras.get(camera)
+        if selected is None:
+            raise NotFoundException(f"Unknown camera {camera!r}")
+        try:
+            async with state.offers.slot(), state.viewers.admission():
+                audio, video = await selected.source.acquire()
+                try:
+                    return await handle_offer(data, audio, video, camera=selected.id)
+                finally:
+                    # Re-arm the idle timer if the offer failed before adding a peer.
+                    selected.source.check_idle()
+        except OfferRejectedError as e:
+            raise ServiceUnavailableException(
+                "Server busy, retry later", headers={"Retry-After": str(e.retry_after)}
+            )
+        except PeerLimitError:
+            raise ServiceUnavailableException(
+                "Viewer limit reached", headers={"Retry-After": str(PEER_LIMIT_RETRY_AFTER)}
+            )
+
+    @post("/candidate", status_code=204)
+    async def candidate(self, data: IceCandidateModel, state: State) -> None:
+        """Trickled client ICE candidates for an offer that was already answered."""
+        try:
+            if await add_ice_candidate(data):
+                return
+        except ValueError as e:
+            raise ValidationException(f"Invalid ICE candidate: {e}")
+        if not CLUSTERED:
+            raise NotFoundException(f"Unknown peer {data.id!r}")
+        # The offer may have been answered by another worker.
+        state.viewers.publish("candidate", msgspec.to_builtins(data))
+
+    @post("/ice-restart")
+    async def ice_restart(self, data: ClientModel) -> dict:
+        """Answers an ICE restart offer (after a network change) on the peer's
+        existing session. 404 means the session is gone: send a new offer."""
         if not data.offer.sdp:
             raise ValidationException("offer.sdp cannot be empty")
-        return await handle_offer(data, state.audio, state.video)
+        try:
+            answer = await restart_ice(data)
+        except ValueError as e:
+            raise ValidationException(f"Invalid ICE restart: {e}")
+        if answer is None:
+            # Also when the session lives on another worker.
+            raise NotFoundException(f"No session to restart for peer {data.id!r}")
+        return answer
+
+    @get("/cameras", sync_to_thread=False)
+    def cameras(self, state: State) -> list[dict]:
+        return state.cameras.describe()
 
     @get("/getpeers")
-    async def get_peers(self, verbose: bool = False) -> dict | list[str]:
-        return pcs_manager.get_peers(verbose=verbose)
+    async def get_peers(
+        self,
+        request: Request,
+        state: State,
+        verbose: bool = False,
+        sdp: bool = False,
+        connection_state: str | None = None,
+        ice_state: str | None = None,
+        camera: str | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> Response[bytes]:
+        """Peer ids, or details with `verbose` (SDP bodies only with `sdp`).
+
+        The total before `offset`/`limit` is in X-Total-Count; the ETag lets
+        pollers revalidate with If-None-Match instead of refetching.
+        """
+        if offset < 0 or (limit is not None and not 0 < limit <= PEERS_MAX_LIMIT):
+            raise ValidationException(f"offset must be >= 0 and limit between 1 and {PEERS_MAX_LIMIT}")
+        snapshot = state.viewers.snapshot(
+            verbose=verbose,
+            sdp=verbose and sdp,
+            connection_state=connection_state,
+            ice_state=ice_state,
+            camera=camera,
+            offset=offset,
+            limit=limit,
+        )
+        headers = {"ETag": snapshot.etag, "X-Total-Count": str(snapshot.total), "Cache-Control": "no-cache"}
+        if _etag_matches(request, snapshot.etag):
+            return Response(b"", status_code=304, headers=headers)
+        return Response(snapshot.body, media_type="application/json", headers=headers)
+
+    @get("/peer-states", sync_to_thread=False)
+    def peer_states(self, state: State) -> dict:
+        """Peers of this worker by connection and ICE state."""
+        return state.viewers.manager.state_counts()
 
     @get("/config", sync_to_thread=False)
     def webrtc_config(self) -> dict:
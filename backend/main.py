@@ -2,19 +2,46 @@ import asyncio
 import logging
 from contextlib import asynccontextmanager
 
+import msgspec
 from aiortc.rtcrtpsender import RTCRtpSender
 from litestar import Litestar
 from litestar.config.cors import CORSConfig
 
-from controllers.chat_controller import chat_endpoint
+from controllers.admin_controller import AdminController
+from controllers.chat_controller import chat_endpoint, chat_service
 from controllers.health_controller import health_check
+from controllers.hls_controller import HlsController
+from controllers.metrics_controller import metrics_endpoint
 from controllers.peer_count_controller import peer_count_endpoint
+from controllers.recording_controller import RecordingController
+from controllers.snapshot_controller import snapshot_endpoint
 from controllers.weather_controller import weather_endpoint
 from controllers.webrtc_controller import WebRTCController
 from db.session import SessionLocal
-from services.video_service import create_local_tracks
-from services.weather_service import fetch_weather_periodically
-from services.webrtc_service import pcs_manager
+from models.datastructures import IceCandidateModel
+from services.admission_service import OfferGate
+from services.broadcast_service import Broadcaster
+from services.camera_service import CameraRegistry, load_cameras
+from services.cluster_service import (
+    CLUSTERED,
+    PRIMARY,
+    WORKER_ID,
+    ClusterClient,
+    LocalViewers,
+    primary_proxy,
+)
+from services.detection_service import DetectionService
+from services.hls_service import HlsPackager
+from services.packet_relay_service import PacketRelayServer, open_remote_media
+from services.profiling_service import LoopMonitor
+from services.reaper_service import PeerReaper
+from services.recording_service import Recorder
+from services.snapshot_service import SnapshotService
+from services.source_service import VIDEO_SUSPEND_GRACE
+from services.stats_service import PeerStatsCollector
+from services.udp_mux_service import udp_mux
+from services.weather_service import apply_weather, fetch_weather_periodically
+from services.webrtc_service import add_ice_candidate, pcs_manager, warm_pool
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,23 +53,100 @@ logger = logging.getLogger("main")
 @asynccontextmanager
 async def lifespan(app: Litestar):
     logger.info("Application is starting up...")
+    app.state.loop_monitor = LoopMonitor()
+    await app.state.loop_monitor.start()
     app.state.db = SessionLocal
-    audio, video = create_local_tracks(enable_audio=False)
-    app.state.audio = audio
-    app.state.video = video
+    if CLUSTERED:
+        logger.info(f"Worker {WORKER_ID} starting ({'primary' if PRIMARY else 'secondary'})")
+        app.state.viewers = ClusterClient(pcs_manager)
+        await app.state.viewers.start()
+        chat_service.relay = lambda message: app.state.viewers.publish("chat", message)
+        app.state.viewers.subscribe("chat", chat_service.deliver)
+        app.state.viewers.subscribe("weather", apply_weather)
+        app.state.viewers.subscribe(
+            "candidate", lambda data: add_ice_candidate(msgspec.convert(data, IceCandidateModel))
+        )
+    else:
+        app.state.viewers = LocalViewers(pcs_manager)
 
-    app.state.weather_task = asyncio.create_task(
-        fetch_weather_periodically(cache_expiration=3600)
-    )
+    app.state.relays = []
+    if PRIMARY:
+        # Cameras are opened on demand; the default one is opened now so a broken
+        # source shows up at startup, and suspended again if nobody connects.
+        app.state.cameras = CameraRegistry(load_cameras(), pcs_manager, viewers=app.state.viewers)
+        await app.state.cameras.start()
+        if CLUSTERED:
+            app.state.relays = [PacketRelayServer(camera) for camera in app.state.cameras.cameras.values()]
+            for relay in app.state.relays:
+                await relay.start()
+    else:
+        # Secondary workers only packetize the primary's encoded streams.
+        app.state.cameras = CameraRegistry(
+            load_cameras(),
+            pcs_manager,
+            factory=open_remote_media,
+            grace=lambda config: VIDEO_SUSPEND_GRACE,
+            viewers=app.state.viewers,
+        )
+    # HLS, snapshots, detection and recording follow the default camera; in
+    # multi-worker mode they only run on the primary (see primary_proxy).
+    app.state.media = app.state.cameras.default.source
+    app.state.hls = HlsPackager(app.state.media)
+    app.state.snapshots = SnapshotService(app.state.media)
+    app.state.detections = DetectionService(app.state.media, SessionLocal)
+    app.state.recorder = Recorder(app.state.media)
+    app.state.weather_task = None
+    if PRIMARY:
+        await app.state.detections.start()
+        await app.state.recorder.start()
+        share_weather = None
+        if CLUSTERED:
+            def share_weather(data: dict) -> None:
+                app.state.viewers.publish("weather", data, retain=True)
+        app.state.weather_task = asyncio.create_task(
+            fetch_weather_periodically(cache_expiration=3600, on_update=share_weather)
+        )
 
     RTCRtpSender.TRANSPORT_POOL_SIZE = 1000
     RTCRtpSender.TRANSPORT_PORT_MIN = 49152
     RTCRtpSender.TRANSPORT_PORT_MAX = 65535
+    # Offers queue here before the peer limit; spreads out reconnect storms.
+    app.state.offers = OfferGate()
+    await app.state.offers.start()
+    # Before anything gathers ICE candidates.
+    await udp_mux.start()
+    await warm_pool.start()
+    app.state.peer_count = Broadcaster(
+        "peer_count",
+        lambda: {"count": app.state.viewers.count(), "cameras": app.state.cameras.viewer_counts()},
+    )
+    app.state.viewers.on_change(app.state.peer_count.notify)
+    await app.state.peer_count.start()
+    app.state.peer_stats = PeerStatsCollector(pcs_manager)
+    await app.state.peer_stats.start()
+    app.state.peer_reaper = PeerReaper(pcs_manager)
+    await app.state.peer_reaper.start()
 
     try:
         yield
     finally:
+        await app.state.peer_reaper.stop()
+        await app.state.peer_stats.stop()
+        await app.state.peer_count.stop()
+        await warm_pool.stop()
+        await app.state.offers.stop()
         await pcs_manager.clean_up()
+        await udp_mux.stop()
+        await app.state.hls.stop()
+        await app.state.snapshots.stop()
+        await app.state.detections.stop()
+        await app.state.recorder.stop()
+        for relay in app.state.relays:
+            await relay.stop()
+        await app.state.cameras.stop()
+        if CLUSTERED:
+            await app.state.viewers.stop()
+        await app.state.loop_monitor.stop()
         logger.info("Application is shutting down...")
 
 
@@ -59,7 +163,13 @@ app = Litestar(
         WebRTCController,
         chat_endpoint,
         peer_count_endpoint,
+        metrics_endpoint,
+        HlsController,
+        snapshot_endpoint,
+        RecordingController,
+        AdminController,
     ],
     lifespan=[lifespan],
     cors_config=cors_config,
+    middleware=[primary_proxy] if CLUSTERED and not PRIMARY else [],
 )
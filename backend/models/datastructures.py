@@ -12,6 +12,13 @@ class ClientModel(msgspec.Struct):
     offer: OfferModel
 
 
+class IceCandidateModel(msgspec.Struct):
+    id: str  # peer id the offer was sent with
+    candidate: str  # "candidate:..." attribute; empty for end-of-candidates
+    sdpMid: str | None = None
+    sdpMLineIndex: int | None = None
+
+
 # Chat WebSocket messages
 class ChatMessageData(msgspec.Struct):
     type: str  # "message" | "system" | "history"
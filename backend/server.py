@@ -1,16 +1,92 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
 import socket
+
 from uvicorn import Config, Server
 
-# Create an IPv6 socket and allow dual-stack (IPv4 & IPv6)
-sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, False)
-sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
-sock.bind(("::", 8051))
-sock.listen(100)
+from services.cluster_service import PRIMARY_HTTP_SOCKET, WEB_WORKERS, Coordinator, prepare_socket_path
+
+PORT = 8051
+RESTART_DELAY = 1.0  # seconds before a crashed worker is restarted
+STOP_TIMEOUT = 10.0  # seconds workers get to shut down before being killed
+
+logger = logging.getLogger("server")
+
+
+def create_socket(reuse_port: bool = False) -> socket.socket:
+    # Create an IPv6 socket and allow dual-stack (IPv4 & IPv6)
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, False)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+    if reuse_port:
+        # Every worker binds its own listener; the kernel spreads connections.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, True)
+    sock.bind(("::", PORT))
+    sock.listen(100)
+    return sock
+
+
+def run_worker(worker: int) -> None:
+    sockets = [create_socket(reuse_port=True)]
+    if worker == 0:
+        # The other workers forward HLS, snapshot and recording requests here.
+        prepare_socket_path(PRIMARY_HTTP_SOCKET)
+        primary = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        primary.bind(PRIMARY_HTTP_SOCKET)
+        primary.listen(100)
+        sockets.append(primary)
+    Server(Config("main:app", log_level="info")).run(sockets=sockets)
+
+
+def start_worker(worker: int) -> multiprocessing.Process:
+    # Read by services.cluster_service when the spawned worker imports the app.
+    os.environ["BIRDSTREAM_WORKER"] = str(worker)
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_worker, args=(worker,), name=f"worker-{worker}"
+    )
+    process.start()
+    logger.info(f"Started worker {worker} (pid {process.pid})")
+    return process
+
+
+async def supervise(workers: int) -> None:
+    """Runs the cluster coordinator and keeps `workers` worker processes alive."""
+    coordinator = Coordinator()
+    await coordinator.start()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    processes = {worker: start_worker(worker) for worker in range(workers)}
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), RESTART_DELAY)
+        except asyncio.TimeoutError:
+            pass
+        for worker, process in processes.items():
+            if not process.is_alive() and not stopping.is_set():
+                logger.warning(f"Worker {worker} exited with {process.exitcode}, restarting")
+                processes[worker] = start_worker(worker)
+
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        await loop.run_in_executor(None, process.join, STOP_TIMEOUT)
+        if process.is_alive():
+            process.kill()
+    await coordinator.stop()
 
-# Configure and run Uvicorn using the existing ASGI app
-config = Config("main:app", log_level="info", workers=1)
-server = Server(config)
 
 if __name__ == "__main__":
-    server.run(sockets=[sock]) 
\ No newline at end of file
+    if WEB_WORKERS > 1:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        asyncio.run(supervise(WEB_WORKERS))
+    else:
+        # Configure and run Uvicorn using the existing ASGI app
+        config = Config("main:app", log_level="info", workers=1)
+        server = Server(config)
+        server.run(sockets=[create_socket()])
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+from services.encoder_service import encoder_load
+from services.metrics_service import registry
+
+logger = logging.getLogger("admission_service")
+
+# Offers negotiated at once; the rest wait in the offer queue.
+WEBRTC_OFFER_CONCURRENCY = int(os.environ.get("WEBRTC_OFFER_CONCURRENCY", "4"))
+# Offers allowed to wait; beyond that they are refused straight away.
+WEBRTC_OFFER_QUEUE = int(os.environ.get("WEBRTC_OFFER_QUEUE", "32"))
+# Seconds an offer may wait for a slot or for load to drop before it is refused.
+WEBRTC_OFFER_QUEUE_TIMEOUT = float(os.environ.get("WEBRTC_OFFER_QUEUE_TIMEOUT", "10"))
+# CPU a new viewer is expected to cost (packetization, SRTP, DTLS), in cores.
+WEBRTC_PEER_CPU_BUDGET = float(os.environ.get("WEBRTC_PEER_CPU_BUDGET", "0.05"))
+# Fraction of the machine's CPU viewers may bring it to; 0 disables the check.
+WEBRTC_CPU_TARGET = float(os.environ.get("WEBRTC_CPU_TARGET", "0.85"))
+# Shared encoder load (encode time per frame interval) above which offers wait.
+WEBRTC_ENCODER_LOAD_LIMIT = float(os.environ.get("WEBRTC_ENCODER_LOAD_LIMIT", "0.9"))
+# Refused offers are told to retry after this many seconds, plus up to
+# WEBRTC_RETRY_JITTER times as much again so reconnect storms spread out.
+WEBRTC_RETRY_AFTER = float(os.environ.get("WEBRTC_RETRY_AFTER", "5"))
+WEBRTC_RETRY_JITTER = float(os.environ.get("WEBRTC_RETRY_JITTER", "1.0"))
+
+LOAD_SAMPLE_INTERVAL = 1.0  # seconds between CPU samples
+PROC_STAT = "/proc/stat"
+
+OFFERS_REJECTED = registry.counter(
+    "birdstream_offers_rejected_total", "WebRTC offers refused by admission control", ("reason",)
+)
+OFFER_QUEUE_DEPTH = registry.gauge("birdstream_offer_queue_depth", "WebRTC offers waiting to be negotiated")
+OFFERS_IN_PROGRESS = registry.gauge("birdstream_offers_in_progress", "WebRTC offers being negotiated")
+OFFER_QUEUE_WAIT_SECONDS = registry.histogram(
+    "birdstream_offer_queue_wait_seconds",
+    "Time admitted offers waited in the offer queue",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+CPU_LOAD = registry.gauge("birdstream_cpu_load", "Busy fraction of the machine's CPU, as admission control sees it")
+ENCODER_LOAD = registry.gauge(
+    "birdstream_encoder_load", "Busiest shared encoder's encode time per frame interval"
+)
+
+
+class OfferRejectedError(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def retry_after() -> int:
+    """Jittered Retry-After, in whole seconds as the header requires."""
+    return math.ceil(WEBRTC_RETRY_AFTER * (1 + random.uniform(0, WEBRTC_RETRY_JITTER)))
+
+
+def _busy_cpu_seconds() -> float | None:
+    """CPU time spent by all processes, or None where /proc is unavailable."""
+    try:
+        with open(PROC_STAT) as file:
+            fields = [float(value) for value in file.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # user, nice, system, irq, softirq, steal; guest time is already in user/nice.
+    busy = fields[0] + fields[1] + fields[2] + sum(fields[5:8])
+    return busy / os.sysconf("SC_CLK_TCK")
+
+
+class LoadMonitor:
+    """Samples the machine's CPU load and the shared encoders' load.
+
+    CPU comes from /proc/stat, so it covers every worker process and the
+    encoder threads; elsewhere this process's CPU time is used instead.
+    """
+
+    def __init__(self, interval: float = LOAD_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.cores = os.cpu_count() or 1
+        self.cpu = 0.0  # busy fraction of all cores
+        self.encoder = 0.0
+        self.listeners: list[Callable[[], None]] = []
+        self._previous: tuple[float, float] | None = None
+        self._task: asyncio.Task | None = None
+
+    def _cpu_times(self) -> tuple[float, float]:
+        """(busy CPU seconds, wall seconds). Idle time is derived from the wall
+        clock, since some kernels and sandboxes do not account it."""
+        busy = _busy_cpu_seconds()
+        return (time.process_time() if busy is None else busy), time.monotonic()
+
+    def sample(self) -> None:
+        current = self._cpu_times()
+        if self._previous is not None:
+            busy, elapsed = (now - before for now, before in zip(current, self._previous))
+            if elapsed > 0:
+                self.cpu = min(max(busy / (elapsed * self.cores), 0.0), 1.0)
+        self._previous = current
+        self.encoder = encoder_load()
+        CPU_LOAD.set(self.cpu)
+        ENCODER_LOAD.set(self.encoder)
+        for callback in self.listeners[:]:
+            callback()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self.sample()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Load sample failed")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class OfferGate:
+    """Bounded, load-aware queue in front of offer negotiation.
+
+    At most `concurrency` offers are negotiated at once. Others wait, first
+    come first served, for a free slot and for CPU headroom: the last CPU
+    sample plus `peer_budget` cores for each viewer admitted since then must
+    stay under `cpu_target`, and the shared encoder must keep up with its
+    source. With nothing in flight one offer is always let through, so a
+    machine loaded by something else still serves viewers, one at a time.
+    Offers are refused with OfferRejectedError when the queue is full or
+    they waited `queue_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        monitor: LoadMonitor | None = None,
+        concurrency: int = WEBRTC_OFFER_CONCURRENCY,
+        queue_size: int = WEBRTC_OFFER_QUEUE,
+        queue_timeout: float = WEBRTC_OFFER_QUEUE_TIMEOUT,
+        peer_budget: float = WEBRTC_PEER_CPU_BUDGET,
+        cpu_target: float = WEBRTC_CPU_TARGET,
+        encoder_limit: float = WEBRTC_ENCODER_LOAD_LIMIT,
+    ):
+        self.monitor = monitor or LoadMonitor()
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.peer_budget = peer_budget
+        self.cpu_target = cpu_target
+        self.encoder_limit = encoder_limit
+        self.active = 0
+        self.waiting = 0
+        # Viewers admitted since the last load sample, whose cost it misses.
+        self._unsampled = 0
+        self._changed = asyncio.Condition()
+        self.monitor.listeners.append(self._load_sampled)
+
+    def _load_sampled(self) -> None:
+        self._unsampled = 0
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    def has_headroom(self) -> bool:
+        if self.active == 0 and self._unsampled == 0:
+            return True
+        if self.encoder_limit and self.monitor.encoder > self.encoder_limit:
+            return False
+        if not self.cpu_target:
+            return True
+        expected = (self._unsampled + 1) * self.peer_budget / self.monitor.cores
+        return self.monitor.cpu + expected <= self.cpu_target
+
+    def _can_start(self) -> bool:
+        return self.active < self.concurrency and self.has_headroom()
+
+    def _reject(self, reason: str) -> OfferRejectedError:
+        OFFERS_REJECTED.inc(reason=reason)
+        return OfferRejectedError(reason, retry_after())
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Holds a negotiation slot; OfferRejectedError if none comes up."""
+        started = time.monotonic()
+        async with self._changed:
+            if not (self.waiting == 0 and self._can_start()):
+                if self.waiting >= self.queue_size:
+                    raise self._reject("queue_full")
+                self.waiting += 1
+                OFFER_QUEUE_DEPTH.set(self.waiting)
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(self._can_start), self.queue_timeout)
+                except asyncio.TimeoutError:
+                    raise self._reject("overloaded") from None
+                finally:
+                    self.waiting -= 1
+                    OFFER_QUEUE_DEPTH.set(self.waiting)
+            self.active += 1
+            self._unsampled += 1
+            OFFERS_IN_PROGRESS.set(self.active)
+        OFFER_QUEUE_WAIT_SECONDS.observe(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.active -= 1
+                OFFERS_IN_PROGRESS.set(self.active)
+                self._changed.notify_all()
+
+    async def start(self) -> None:
+        await self.monitor.start()
+
+    async def stop(self) -> None:
+        await self.monitor.stop()
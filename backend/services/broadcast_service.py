@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Callable
+
+from litestar import WebSocket
+
+from services.metrics_service import registry
+
+logger = logging.getLogger("broadcast_service")
+
+# Most /peer-count updates per second; changes in between are coalesced.
+PEER_COUNT_MAX_RATE = float(os.environ.get("PEER_COUNT_MAX_RATE", "2"))
+PEER_COUNT_REFRESH = 5.0  # seconds; resend even without changes
+# Seconds one send may block before the subscriber is dropped as too slow.
+BROADCAST_SEND_TIMEOUT = float(os.environ.get("BROADCAST_SEND_TIMEOUT", "10"))
+
+BROADCAST_SUBSCRIBERS = registry.gauge(
+    "birdstream_broadcast_subscribers", "WebSocket subscribers per broadcast channel", ("channel",)
+)
+BROADCAST_MESSAGES = registry.counter(
+    "birdstream_broadcast_messages_total", "Payloads serialized per broadcast channel", ("channel",)
+)
+BROADCAST_COALESCED = registry.counter(
+    "birdstream_broadcast_coalesced_total",
+    "Updates replaced by a newer one because the subscriber was still busy with the previous send",
+    ("channel",),
+)
+BROADCAST_DROPPED = registry.counter(
+    "birdstream_broadcast_dropped_total", "Subscribers disconnected for blocking too long", ("channel",)
+)
+
+
+class _Subscriber:
+    __slots__ = ("socket", "sending", "pending")
+
+    def __init__(self, socket: WebSocket):
+        self.socket = socket
+        self.sending = False
+        self.pending: str | None = None  # newest payload not yet sent
+
+
+class Broadcaster:
+    """One task pushing the same state snapshot to many WebSockets.
+
+    `notify()` marks the state changed; the hub renders and serializes it at
+    most `max_rate` times a second (and every `refresh` seconds regardless)
+    and starts the sends to all subscribers at once. A subscriber whose
+    previous send has not completed only keeps the newest payload, so a slow
+    socket never queues stale updates or holds up the others, and one
+    blocked for `send_timeout` seconds is closed.
+    """
+
+    def __init__(
+        self,
+        channel: str,
+        render: Callable[[], Any],
+        max_rate: float = PEER_COUNT_MAX_RATE,
+        refresh: float = PEER_COUNT_REFRESH,
+        send_timeout: float = BROADCAST_SEND_TIMEOUT,
+    ):
+        self.channel = channel
+        self.render = render
+        self.max_rate = max_rate
+        self.refresh = refresh
+        self.send_timeout = send_timeout
+        self._subscribers: dict[WebSocket, _Subscriber] = {}
+        self._changed = asyncio.Event()
+        self._payload: str | None = None
+        self._sends: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def notify(self) -> None:
+        self._changed.set()
+
+    def _serialize(self) -> str:
+        BROADCAST_MESSAGES.inc(channel=self.channel)
+        self._payload = json.dumps(self.render(), separators=(",", ":"))
+        return self._payload
+
+    def subscribe(self, socket: WebSocket) -> None:
+        subscriber = self._subscribers[socket] = _Subscriber(socket)
+        BROADCAST_SUBSCRIBERS.set(len(self._subscribers), channel=self.channel)
+        payload = self._payload if self._payload is not None and not self._changed.is_set() else self._serialize()
+        self._send(subscriber, payload)
+
+    def unsubscribe(self, socket: WebSocket) -> None:
+        if self._subscribers.pop(socket, None) is not None:
+            BROADCAST_SUBSCRIBERS.set(len(self._subscribers), channel=self.channel)
+
+    def publish(self) -> None:
+        payload = self._serialize()
+        for subscriber in self._subscribers.values():
+            self._send(subscriber, payload)
+
+    def _send(self, subscriber: _Subscriber, payload: str) -> None:
+        if subscriber.sending:
+            if subscriber.pending is not None:
+                BROADCAST_COALESCED.inc(channel=self.channel)
+            subscriber.pending = payload
+            return
+        subscriber.sending = True
+        task = asyncio.create_task(self._deliver(subscriber, payload))
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
+
+    async def _deliver(self, subscriber: _Subscriber, payload: str) -> None:
+        try:
+            while payload is not None and subscriber.socket in self._subscribers:
+                await asyncio.wait_for(subscriber.socket.send_text(payload), self.send_timeout)
+                payload, subscriber.pending = subscriber.pending, None
+        except asyncio.TimeoutError:
+            logger.info(f"Dropping slow {self.channel} subscriber")
+            BROADCAST_DROPPED.inc(channel=self.channel)
+            self.unsubscribe(subscriber.socket)
+            try:
+                await subscriber.socket.close(code=1008, reason="too slow")
+            except Exception:
+                pass
+        except Exception:
+            # The socket went away; the endpoint unsubscribes it.
+            self.unsubscribe(subscriber.socket)
+        finally:
+            subscriber.sending = False
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.refresh)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            try:
+                self.publish()
+            except Exception:
+                logger.exception(f"Broadcasting {self.channel} failed")
+            # Changes during this pause go out together in the next update.
+            await asyncio.sleep(1 / self.max_rate)
+
+    async def stop(self) -> None:
+        tasks = list(self._sends)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import yaml
+
+from services.connection_manager import ConnectionManager
+from services.encoder_service import VIDEO_ENCODER_MODE
+from services.rendition_service import create_fanout
+from services.source_service import VIDEO_SUSPEND_GRACE, Media, MediaSource
+from services.video_service import (
+    INGEST_SCHEMES,
+    VIDEO_CAPTURE,
+    VIDEO_PASSTHROUGH,
+    create_local_tracks,
+)
+
+logger = logging.getLogger("camera_service")
+
+# Optional YAML camera registry; without it VIDEO_SOURCE is the only camera.
+CAMERAS_FILE = os.environ.get("CAMERAS_FILE", str(Path(__file__).parent.parent / "cameras.yaml"))
+DEFAULT_CAMERA = "default"
+
+_CAMERA_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+
+
+class CameraConfig(NamedTuple):
+    id: str
+    source: str
+    name: str
+    capture: str = VIDEO_CAPTURE
+    passthrough: bool = VIDEO_PASSTHROUGH
+
+
+def load_cameras(path: str = CAMERAS_FILE) -> list[CameraConfig]:
+    """Cameras in registry order (the first is the default), e.g.
+
+        cameras:
+          feeder: {source: /dev/video0, name: Feeder, capture: opencv}
+          nestbox: {source: "srt://0.0.0.0:9000", name: Nest box}
+    """
+    if not Path(path).exists():
+        source = os.environ.get("VIDEO_SOURCE", "/dev/video0")
+        return [CameraConfig(DEFAULT_CAMERA, source, "Camera")]
+
+    with open(path) as file:
+        entries = (yaml.safe_load(file) or {}).get("cameras") or {}
+    cameras = []
+    for camera_id, entry in entries.items():
+        camera_id = str(camera_id)
+        if not _CAMERA_ID.match(camera_id):
+            raise ValueError(f"Invalid camera id {camera_id!r} in {path}")
+        if not isinstance(entry, dict) or not entry.get("source"):
+            raise ValueError(f"Camera {camera_id!r} in {path} needs a source")
+        capture = entry.get("capture", VIDEO_CAPTURE)
+        if capture not in ("ffmpeg", "opencv"):
+            raise ValueError(f"Camera {camera_id!r}: capture must be ffmpeg or opencv")
+        cameras.append(
+            CameraConfig(
+                camera_id,
+                str(entry["source"]),
+                str(entry.get("name", camera_id)),
+                capture,
+                bool(entry.get("passthrough", VIDEO_PASSTHROUGH)),
+            )
+        )
+    if not cameras:
+        raise ValueError(f"No cameras configured in {path}")
+    return cameras
+
+
+def suspend_grace(config: CameraConfig) -> float:
+    # Closing a network ingest listener drops the remote sender (pi-agent),
+    # which does not reconnect on its own, so ingest is never suspended.
+    if config.source.startswith(INGEST_SCHEMES):
+        return -1
+    return VIDEO_SUSPEND_GRACE
+
+
+def open_camera_media(config: CameraConfig) -> Media:
+    audio, video = create_local_tracks(
+        decode=not config.passthrough,
+        enable_audio=False,
+        video_source=config.source,
+        capture=config.capture,
+        camera=config.id,
+    )
+    if video is not None and VIDEO_ENCODER_MODE == "shared":
+        video = create_fanout(video)
+    return audio, video
+
+
+class Camera:
+    def __init__(self, config: CameraConfig, source: MediaSource):
+        self.config = config
+        self.source = source
+
+    @property
+    def id(self) -> str:
+        return self.config.id
+
+
+class CameraRegistry:
+    """One lazily opened capture pipeline (MediaSource) per configured camera.
+
+    A camera's tracks, relay and encoders only exist while it has viewers or
+    other holders, and are suspended `suspend_grace` seconds after the last
+    one leaves. Viewer counts are reported from `viewers` (anything with a
+    `camera_counts()`, the cluster-wide ViewerDirectory in multi-worker mode).
+    """
+
+    def __init__(
+        self,
+        configs: list[CameraConfig],
+        manager: ConnectionManager,
+        factory: Callable[[CameraConfig], Media] = open_camera_media,
+        grace: Callable[[CameraConfig], float] = suspend_grace,
+        viewers=None,
+    ):
+        self.manager = manager
+        self.viewers = viewers or manager
+        self.cameras: dict[str, Camera] = {}
+        for config in configs:
+            if config.id in self.cameras:
+                raise ValueError(f"Duplicate camera id {config.id!r}")
+            source = MediaSource(
+                lambda config=config: factory(config),
+                manager,
+                grace=grace(config),
+                camera=config.id,
+            )
+            self.cameras[config.id] = Camera(config, source)
+
+    @property
+    def default(self) -> Camera:
+        return next(iter(self.cameras.values()))
+
+    def get(self, camera_id: str | None = None) -> Camera | None:
+        if camera_id is None:
+            return self.default
+        return self.cameras.get(camera_id)
+
+    def viewer_counts(self) -> dict[str, int]:
+        counts = self.viewers.camera_counts()
+        return {camera_id: counts.get(camera_id, 0) for camera_id in self.cameras}
+
+    def describe(self) -> list[dict]:
+        counts = self.viewer_counts()
+        return [
+            {
+                "id": camera.id,
+                "name": camera.config.name,
+                "active": camera.source.active,
+                "viewers": counts[camera.id],
+            }
+            for camera in self.cameras.values()
+        ]
+
+    async def start(self) -> None:
+        # The default camera is opened now so a broken source shows up at
+        # startup; ingest listeners must be up before their sender connects.
+        for camera in self.cameras.values():
+            if camera is self.default or camera.source.grace < 0:
+                await camera.source.start()
+
+    async def stop(self) -> None:
+        for camera in self.cameras.values():
+            await camera.source.stop()
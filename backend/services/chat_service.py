@@ -1,6 +1,6 @@
 import logging
 from datetime import datetime
-from typing import Any
+from typing import Any, Callable
 
 from litestar import WebSocket
 from sqlalchemy import select
@@ -13,6 +13,8 @@ logger = logging.getLogger("chat_service")
 class ChatService:
     def __init__(self):
         self.active_connections: list[WebSocket] = []
+        # Forwards broadcasts to the other worker processes in multi-worker mode.
+        self.relay: Callable[[dict[str, Any]], None] | None = None
 
     async def connect(self, websocket: WebSocket, db_factory) -> None:
         await websocket.accept()
@@ -55,6 +57,12 @@ class ChatService:
                 ))
                 session.commit()
 
+        if self.relay is not None:
+            self.relay(message)
+        await self.deliver(message)
+
+    async def deliver(self, message: dict[str, Any]) -> None:
+        """Send a message to this process's connections only."""
         connections_to_remove = []
         for connection in self.active_connections:
             try:
@@ -0,0 +1,587 @@
+import abc
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import os
+from contextlib import asynccontextmanager, suppress
+from typing import Any, AsyncIterator, Callable, NamedTuple
+
+from litestar.types import ASGIApp, Receive, Scope, Send
+
+from services.connection_manager import ConnectionManager
+from services.metrics_service import registry
+
+logger = logging.getLogger("cluster_service")
+
+# Worker processes sharing the HTTP port through SO_REUSEPORT (see server.py).
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+# Index of this worker, set by server.py. Worker 0 is the primary: it owns the
+# cameras and the HLS, snapshot, recording and detection pipelines.
+WORKER_ID = int(os.environ.get("BIRDSTREAM_WORKER", "0"))
+# Directory for the coordinator, camera relay and primary HTTP Unix sockets.
+CLUSTER_DIR = os.environ.get("CLUSTER_DIR", "/tmp/birdstream")
+# WebRTC peers allowed across all workers; 0 means no limit.
+WEBRTC_MAX_PEERS = int(os.environ.get("WEBRTC_MAX_PEERS", "0"))
+
+CLUSTERED = WEB_WORKERS > 1
+PRIMARY = WORKER_ID == 0
+COORDINATOR_SOCKET = os.path.join(CLUSTER_DIR, "coordinator.sock")
+PRIMARY_HTTP_SOCKET = os.path.join(CLUSTER_DIR, "primary-http.sock")
+# Only the primary serves these; the other workers forward them to it.
+PRIMARY_PATHS = ("/hls", "/snapshot.jpg", "/recordings")
+
+MESSAGE_LIMIT = 16 * 2**20  # bytes per coordinator message (peer listings)
+STATE_COALESCE = 0.05  # seconds; peer changes within this window share one broadcast
+RECONNECT_DELAY = 1.0  # seconds between attempts to reach the coordinator
+ADMIT_TIMEOUT = 2.0  # seconds to wait for the coordinator to grant a slot
+PROXY_CHUNK = 64 * 1024
+SNAPSHOT_CACHE_SIZE = 64  # distinct peer listings kept per version
+
+PEERS_REJECTED = registry.counter(
+    "birdstream_peers_rejected_total", "WebRTC offers refused because of WEBRTC_MAX_PEERS"
+)
+
+
+class PeerLimitError(Exception):
+    pass
+
+
+def camera_socket(camera_id: str) -> str:
+    return os.path.join(CLUSTER_DIR, f"camera-{camera_id}.sock")
+
+
+def prepare_socket_path(path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with suppress(FileNotFoundError):
+        os.unlink(path)
+
+
+class PeerSnapshot(NamedTuple):
+    etag: str
+    body: bytes  # serialized JSON
+    total: int  # matching peers before pagination
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":"), default=str).encode() + b"\n"
+
+
+class ViewerDirectory(abc.ABC):
+    """Viewer counts and peer listings as the API reports them, plus the peer
+    limit enforced on offers. Peers are `{peer id: {"camera", "worker"}}`."""
+
+    def __init__(self, manager: ConnectionManager, max_peers: int = WEBRTC_MAX_PEERS):
+        self.manager = manager
+        self.max_peers = max_peers
+        self._change_listeners: list[Callable[[], None]] = []
+        self._snapshots: dict[tuple, PeerSnapshot] = {}
+        self._snapshot_version: tuple | None = None
+
+    def on_change(self, callback: Callable[[], None]) -> None:
+        self._change_listeners.append(callback)
+
+    def remove_change_listener(self, callback: Callable[[], None]) -> None:
+        try:
+            self._change_listeners.remove(callback)
+        except ValueError:
+            pass
+
+    def _notify_change(self) -> None:
+        for cb in self._change_listeners[:]:
+            cb()
+
+    def _local_peers(self) -> dict[str, dict]:
+        return {
+            peer_id: {"camera": self.manager.cameras.get(peer_id), "worker": WORKER_ID}
+            for peer_id in self.manager.pcs
+        }
+
+    def peers(self) -> dict[str, dict]:
+        return self._local_peers()
+
+    def count(self, camera: str | None = None) -> int:
+        peers = self.peers()
+        if camera is None:
+            return len(peers)
+        return sum(1 for peer in peers.values() if peer["camera"] == camera)
+
+    def camera_counts(self) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        for peer in self.peers().values():
+            if peer["camera"] is not None:
+                counts[peer["camera"]] = counts.get(peer["camera"], 0) + 1
+        return counts
+
+    @property
+    def version(self) -> tuple:
+        """Changes whenever anything `peers()` or a snapshot shows changes."""
+        return (self.manager.version,)
+
+    def get_peers(self, verbose: bool = False) -> dict | list[str]:
+        peers = self.peers()
+        if not verbose:
+            return list(peers)
+        # Connection details only exist in the worker that owns the peer.
+        return {peer_id: {**peer, **(self.manager.describe(peer_id) or {})} for peer_id, peer in peers.items()}
+
+    def snapshot(
+        self,
+        verbose: bool = False,
+        sdp: bool = False,
+        connection_state: str | None = None,
+        ice_state: str | None = None,
+        camera: str | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> PeerSnapshot:
+        """The serialized peer listing for these filters, built once per version.
+
+        Connection and ICE states are only known for this worker's own peers,
+        so filtering on them lists only those.
+        """
+        version = self.version
+        if version != self._snapshot_version:
+            self._snapshots.clear()
+            self._snapshot_version = version
+        key = (verbose, sdp, connection_state, ice_state, camera, offset, limit)
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            if len(self._snapshots) >= SNAPSHOT_CACHE_SIZE:
+                self._snapshots.clear()
+            snapshot = self._snapshots[key] = self._build_snapshot(*key)
+        return snapshot
+
+    def _build_snapshot(
+        self,
+        verbose: bool,
+        sdp: bool,
+        connection_state: str | None,
+        ice_state: str | None,
+        camera: str | None,
+        offset: int,
+        limit: int | None,
+    ) -> PeerSnapshot:
+        peers = self.peers()
+        ids: list[str] = list(peers)
+        if connection_state is not None or ice_state is not None:
+            in_state = self.manager.peers_in_state(connection_state, ice_state)
+            ids = [peer_id for peer_id in ids if peer_id in in_state]
+        if camera is not None:
+            ids = [peer_id for peer_id in ids if peers[peer_id]["camera"] == camera]
+        page = ids[offset:] if limit is None else ids[offset:offset + limit]
+        if verbose:
+            listing: dict | list = {
+                peer_id: {**peers[peer_id], **(self.manager.describe(peer_id, sdp=sdp) or {})} for peer_id in page
+            }
+        else:
+            listing = page
+        body = json.dumps(listing, separators=(",", ":"), default=str).encode()
+        # Derived from the content, so equal listings match across versions and workers.
+        etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        return PeerSnapshot(etag, body, len(ids))
+
+    @asynccontextmanager
+    async def admission(self) -> AsyncIterator[None]:
+        """Holds a slot under the peer limit while an offer is negotiated;
+        PeerLimitError if there is none."""
+        ticket = await self._reserve()
+        if ticket is None:
+            PEERS_REJECTED.inc()
+            raise PeerLimitError()
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    @abc.abstractmethod
+    async def _reserve(self) -> int | None:
+        """A ticket for a free slot under the peer limit, or None."""
+
+    @abc.abstractmethod
+    def _release(self, ticket: int) -> None:
+        """Give back the slot held by `ticket`."""
+
+
+class LocalViewers(ViewerDirectory):
+    """Single-process mode: everything comes from this process's ConnectionManager."""
+
+    def __init__(self, manager: ConnectionManager, max_peers: int = WEBRTC_MAX_PEERS):
+        super().__init__(manager, max_peers)
+        self._pending = 0
+        manager.on_change(self._notify_change)
+
+    def count(self, camera: str | None = None) -> int:
+        return self.manager.count(camera)
+
+    def camera_counts(self) -> dict[str, int]:
+        return self.manager.camera_counts()
+
+    async def _reserve(self) -> int | None:
+        if self.max_peers and self.manager.count() + self._pending >= self.max_peers:
+            return None
+        self._pending += 1
+        return 0
+
+    def _release(self, ticket: int) -> None:
+        self._pending -= 1
+
+
+class ClusterClient(ViewerDirectory):
+    """A worker's connection to the Coordinator.
+
+    Reports this worker's peers whenever they change and mirrors the merged
+    listing the coordinator broadcasts back. Offers reserve their slot under
+    the cluster-wide peer limit with the coordinator, and topics carry small
+    messages (chat, weather) to the other workers. While the coordinator is
+    unreachable only this worker's own peers are known.
+    """
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        worker: int = WORKER_ID,
+        path: str = COORDINATOR_SOCKET,
+        max_peers: int = WEBRTC_MAX_PEERS,
+    ):
+        super().__init__(manager, max_peers)
+        self.worker = worker
+        self.path = path
+        self._cluster: dict[str, dict] | None = None
+        self._cluster_version = 0
+        self._writer: asyncio.StreamWriter | None = None
+        self._task: asyncio.Task | None = None
+        self._dirty = False
+        self._requests: dict[int, asyncio.Future] = {}
+        self._next_request = 0
+        self._handlers: dict[str, list[Callable[[Any], Any]]] = {}
+        manager.on_change(self._peers_changed)
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def peers(self) -> dict[str, dict]:
+        return self._local_peers() if self._cluster is None else self._cluster
+
+    @property
+    def version(self) -> tuple:
+        return (self.manager.version, self._cluster_version)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MESSAGE_LIMIT)
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self._writer = writer
+            self._dirty = False
+            self._send({"op": "hello", "worker": self.worker, "peers": self._reported_peers()})
+            logger.info(f"Worker {self.worker} joined the cluster coordinator")
+            try:
+                while line := await reader.readline():
+                    self._dispatch(json.loads(line))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Cluster coordinator connection failed: {e}")
+            finally:
+                self._writer = None
+                self._cluster = None
+                self._cluster_version += 1
+                writer.close()
+                for future in self._requests.values():
+                    if not future.done():
+                        future.set_result(None)
+                self._requests.clear()
+                self._notify_change()
+            logger.warning("Lost the cluster coordinator, reconnecting")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _dispatch(self, message: dict) -> None:
+        op = message.get("op")
+        if op == "state":
+            self._cluster = message["peers"]
+            self._cluster_version += 1
+            self._notify_change()
+        elif op == "admitted":
+            future = self._requests.pop(message["id"], None)
+            if future is not None and not future.done():
+                future.set_result(message["ok"])
+        elif op == "message":
+            for handler in self._handlers.get(message["topic"], []):
+                try:
+                    result = handler(message["data"])
+                    if inspect.isawaitable(result):
+                        asyncio.ensure_future(result)
+                except Exception:
+                    logger.exception(f"Handler for cluster topic {message['topic']} failed")
+        elif op == "evict":
+            # The viewer reconnected through another worker.
+            peer_id = message["peer"]
+            pc = self.manager.get_peer(peer_id)
+            if pc is not None:
+                logger.info(f"Peer {peer_id} moved to another worker, closing it here")
+                asyncio.ensure_future(self.manager.remove_peer(peer_id, pc))
+
+    def _send(self, message: dict) -> bool:
+        if self._writer is None or self._writer.is_closing():
+            return False
+        self._writer.write(_encode(message))
+        return True
+
+    def _reported_peers(self) -> dict[str, str | None]:
+        return {peer_id: self.manager.cameras.get(peer_id) for peer_id in self.manager.pcs}
+
+    def _peers_changed(self) -> None:
+        if self._cluster is None:
+            self._notify_change()
+        if not self._dirty:
+            self._dirty = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self) -> None:
+        if self._dirty:
+            self._dirty = False
+            self._send({"op": "peers", "peers": self._reported_peers()})
+
+    async def _reserve(self) -> int | None:
+        if not self.max_peers:
+            return 0
+        ok = None
+        if self.connected:
+            self._next_request += 1
+            request = self._next_request
+            future = asyncio.get_running_loop().create_future()
+            self._requests[request] = future
+            self._send({"op": "admit", "id": request})
+            try:
+                ok = await asyncio.wait_for(future, ADMIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                self._requests.pop(request, None)
+            if ok:
+                return request
+        if ok is None:
+            # Without the coordinator only this worker's peers can be counted.
+            return 0 if self.manager.count() < self.max_peers else None
+        return None
+
+    def _release(self, ticket: int) -> None:
+        if ticket:
+            # Report a peer added by this offer before its reservation lapses.
+            self._flush()
+            self._send({"op": "release", "id": ticket})
+
+    def publish(self, topic: str, data: Any, retain: bool = False) -> None:
+        """Send `data` to the other workers' `topic` handlers; a retained
+        message is also replayed to workers that join later."""
+        self._send({"op": "publish", "topic": topic, "data": data, "retain": retain})
+
+    def subscribe(self, topic: str, handler: Callable[[Any], Any]) -> None:
+        self._handlers.setdefault(topic, []).append(handler)
+
+    async def stop(self) -> None:
+        self.manager.remove_change_listener(self._peers_changed)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class _Worker:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.peers: dict[str, str | None] = {}  # peer id -> camera id
+        self.reservations: set[int] = set()
+
+    def send(self, message: dict | bytes) -> None:
+        if not self.writer.is_closing():
+            self.writer.write(message if isinstance(message, bytes) else _encode(message))
+
+
+class Coordinator:
+    """Cluster-wide peer state, kept by the supervisor process (server.py).
+
+    Every worker reports its full peer listing whenever it changes and gets
+    the merged listing back (batched over STATE_COALESCE). A peer id that
+    shows up in a second worker, a viewer reloading the page and landing on
+    another process, is evicted from the first. Offers are admitted while
+    the connected peers plus the outstanding reservations stay below
+    `max_peers`.
+    """
+
+    def __init__(self, path: str = COORDINATOR_SOCKET, max_peers: int = WEBRTC_MAX_PEERS):
+        self.path = path
+        self.max_peers = max_peers
+        self.workers: dict[int, _Worker] = {}
+        self._retained: dict[str, Any] = {}
+        self._server: asyncio.Server | None = None
+        self._broadcast_handle: asyncio.TimerHandle | None = None
+
+    async def start(self) -> None:
+        prepare_socket_path(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, self.path, limit=MESSAGE_LIMIT)
+        logger.info(f"Cluster coordinator listening on {self.path}")
+
+    def peers(self) -> dict[str, dict]:
+        return {
+            peer_id: {"camera": camera, "worker": worker_id}
+            for worker_id, worker in sorted(self.workers.items())
+            for peer_id, camera in worker.peers.items()
+        }
+
+    def _admit(self) -> bool:
+        if not self.max_peers:
+            return True
+        reserved = sum(len(worker.reservations) for worker in self.workers.values())
+        return len(self.peers()) + reserved < self.max_peers
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        worker_id: int | None = None
+        worker: _Worker | None = None
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                op = message.get("op")
+                if op == "hello":
+                    worker_id, worker = message["worker"], _Worker(writer)
+                    previous = self.workers.get(worker_id)
+                    if previous is not None:
+                        previous.writer.close()
+                    self.workers[worker_id] = worker
+                    for topic, data in self._retained.items():
+                        worker.send({"op": "message", "topic": topic, "data": data})
+                    self._update_peers(worker_id, message.get("peers", {}))
+                elif worker is None:
+                    continue
+                elif op == "peers":
+                    self._update_peers(worker_id, message["peers"])
+                elif op == "admit":
+                    ok = self._admit()
+                    if ok:
+                        worker.reservations.add(message["id"])
+                    worker.send({"op": "admitted", "id": message["id"], "ok": ok})
+                elif op == "release":
+                    worker.reservations.discard(message["id"])
+                elif op == "publish":
+                    if message.get("retain"):
+                        self._retained[message["topic"]] = message["data"]
+                    relayed = _encode({"op": "message", "topic": message["topic"], "data": message["data"]})
+                    for other in self.workers.values():
+                        if other is not worker:
+                            other.send(relayed)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Worker {worker_id} connection failed: {e}")
+        finally:
+            if worker_id is not None and self.workers.get(worker_id) is worker:
+                del self.workers[worker_id]
+                logger.info(f"Worker {worker_id} left the cluster")
+                self._schedule_broadcast()
+            writer.close()
+
+    def _update_peers(self, worker_id: int, peers: dict[str, str | None]) -> None:
+        worker = self.workers[worker_id]
+        added = peers.keys() - worker.peers.keys()
+        worker.peers = peers
+        for peer_id in added:
+            for other_id, other in self.workers.items():
+                if other_id != worker_id and peer_id in other.peers:
+                    other.send({"op": "evict", "peer": peer_id})
+        self._schedule_broadcast()
+
+    def _schedule_broadcast(self) -> None:
+        if self._broadcast_handle is None:
+            self._broadcast_handle = asyncio.get_running_loop().call_later(
+                STATE_COALESCE, self._broadcast
+            )
+
+    def _broadcast(self) -> None:
+        self._broadcast_handle = None
+        message = _encode({"op": "state", "peers": self.peers()})
+        for worker in self.workers.values():
+            worker.send(message)
+
+    async def stop(self) -> None:
+        if self._broadcast_handle is not None:
+            self._broadcast_handle.cancel()
+            self._broadcast_handle = None
+        if self._server is not None:
+            self._server.close()
+            for worker in self.workers.values():
+                worker.writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        with suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+
+_HOP_HEADERS = {b"connection", b"keep-alive", b"transfer-encoding", b"upgrade"}
+
+
+async def forward_to_primary(scope: Scope, receive: Receive, send: Send, path: str = PRIMARY_HTTP_SOCKET) -> None:
+    """Replay an HTTP request on the primary worker's Unix socket and stream
+    the response back."""
+    body = bytearray()
+    while True:
+        event = await receive()
+        body += event.get("body", b"")
+        if not event.get("more_body"):
+            break
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+    except OSError as e:
+        logger.warning(f"Primary worker unreachable: {e}")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [(b"retry-after", b"1"), (b"content-length", b"0")],
+        })
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    try:
+        target = scope.get("raw_path") or scope["path"].encode()
+        if scope.get("query_string"):
+            target += b"?" + scope["query_string"]
+        # HTTP/1.0 without keep-alive: the response body simply runs until
+        # the primary closes the connection, never chunked.
+        head = [scope["method"].encode() + b" " + target + b" HTTP/1.0"]
+        for name, value in scope["headers"]:
+            if name not in _HOP_HEADERS and name != b"content-length":
+                head.append(name + b": " + value)
+        head.append(b"content-length: " + str(len(body)).encode())
+        writer.write(b"\r\n".join(head) + b"\r\n\r\n" + bytes(body))
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        headers = []
+        while (line := await reader.readline()).strip():
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name not in _HOP_HEADERS:
+                headers.append((name, value.strip()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        while chunk := await reader.read(PROXY_CHUNK):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        writer.close()
+
+
+def primary_proxy(app: ASGIApp) -> ASGIApp:
+    """Middleware for the non-primary workers: PRIMARY_PATHS go to the primary."""
+
+    async def middleware(scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope["path"]
+        if scope["type"] == "http" and any(
+            path == prefix or path.startswith(prefix + "/") for prefix in PRIMARY_PATHS
+        ):
+            await forward_to_primary(scope, receive, send)
+        else:
+            await app(scope, receive, send)
+
+    return middleware
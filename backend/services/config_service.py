@@ -1,30 +1,109 @@
+import logging
+import os
+import threading
+import time
 from pathlib import Path
+from typing import Any, Callable, NamedTuple
 
 import yaml
 
+logger = logging.getLogger("config_service")
+
+# Seconds between checks of the secrets file's mtime; edits are picked up
+# without a restart.
+SETTINGS_RELOAD_INTERVAL = float(os.environ.get("SETTINGS_RELOAD_INTERVAL", "5"))
+
 
 def get_secrets_path() -> Path:
     return Path(__file__).parent.parent / ".secrets.yaml"
 
 
-def load_api_key(key: str) -> str | None:
-    try:
-        with open(get_secrets_path()) as file:
-            secrets = yaml.safe_load(file)
-            return secrets.get(key)
-    except Exception as e:
-        print(f"Error loading API key: {e}")
-        return None
-
-
-def load_turn_credentials() -> tuple[str | None, str | None]:
-    try:
-        with open(get_secrets_path()) as file:
-            secrets = yaml.safe_load(file)
-            return (
-                secrets.get("OPENRELAY_TURN_USERNAME"),
-                secrets.get("OPENRELAY_TURN_CREDENTIAL"),
-            )
-    except Exception as e:
-        print(f"Error loading TURN credentials: {e}")
-        return None, None
+class Settings(NamedTuple):
+    weather_api_key: str | None = None
+    turn_username: str | None = None
+    turn_credential: str | None = None
+    mqtt_host: str = "localhost"
+    mqtt_port: int = 1883
+    mqtt_username: str | None = None
+    mqtt_password: str | None = None
+    admin_token: str | None = None  # unset disables the /admin endpoints
+
+    @classmethod
+    def from_secrets(cls, secrets: dict[str, Any]) -> "Settings":
+        defaults = cls()
+        return cls(
+            weather_api_key=secrets.get("WEATHER_API_KEY"),
+            turn_username=secrets.get("OPENRELAY_TURN_USERNAME"),
+            turn_credential=secrets.get("OPENRELAY_TURN_CREDENTIAL"),
+            mqtt_host=secrets.get("MQTT_HOST", defaults.mqtt_host),
+            mqtt_port=int(secrets.get("MQTT_PORT", defaults.mqtt_port)),
+            mqtt_username=secrets.get("MQTT_USERNAME"),
+            mqtt_password=secrets.get("MQTT_PASSWORD"),
+            admin_token=secrets.get("ADMIN_TOKEN"),
+        )
+
+
+class SettingsStore:
+    """The parsed secrets file, shared by every subsystem.
+
+    `get()` is cheap enough for hot paths: the file is only stat'ed once
+    `interval` seconds have passed since the last check, and only parsed
+    again when its mtime or size changed. A file that fails to parse keeps
+    the previous settings. Listeners registered with `on_change` run after
+    a reload that changed anything.
+    """
+
+    def __init__(self, path: Path, interval: float = SETTINGS_RELOAD_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._settings = Settings()
+        self._signature: tuple[int, int] | None = None
+        self._loaded = False
+        self._checked = float("-inf")
+        # The MQTT client reads settings from its own thread.
+        self._lock = threading.Lock()
+        self._change_listeners: list[Callable[[Settings], None]] = []
+
+    def get(self) -> Settings:
+        if time.monotonic() - self._checked >= self.interval:
+            self.reload()
+        return self._settings
+
+    def on_change(self, callback: Callable[[Settings], None]) -> None:
+        self._change_listeners.append(callback)
+
+    def reload(self) -> bool:
+        """Re-read the file if it changed on disk; whether the settings changed."""
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                signature = None
+            if self._loaded and signature == self._signature:
+                return False
+            self._loaded = True
+            self._signature = signature
+
+            if signature is None:
+                logger.warning(f"No secrets file at {self.path}, using default settings")
+                settings = Settings()
+            else:
+                try:
+                    with open(self.path) as file:
+                        settings = Settings.from_secrets(yaml.safe_load(file) or {})
+                except Exception as e:
+                    logger.error(f"Error loading {self.path}, keeping previous settings: {e}")
+                    return False
+            if settings == self._settings:
+                return False
+            self._settings = settings
+            logger.info(f"Settings loaded from {self.path}")
+
+        for callback in self._change_listeners[:]:
+            callback(settings)
+        return True
+
+
+settings = SettingsStore(get_secrets_path())
@@ -1,15 +1,32 @@
 import asyncio
 import logging
+import time
 from typing import Callable, List
 
-from aiortc import RTCPeerConnection
+from aiortc import MediaStreamTrack, RTCPeerConnection
 
 logger = logging.getLogger("connection_manager")
 
 
 class ConnectionManager:
+    """The peers of this process.
+
+    Besides the connections it indexes peers by connection and ICE state as
+    they transition, so state counts and filtered listings never walk every
+    connection, and keeps a `version` that increases with every change for
+    callers caching what they derive from it.
+    """
+
     def __init__(self):
         self.pcs: dict[str, RTCPeerConnection] = {}
+        self.cameras: dict[str, str] = {}  # peer id -> camera id
+        self.stats: dict[str, dict] = {}  # peer id -> latest RTP stats, see PeerStatsCollector
+        self.version = 0
+        # peer id -> (connection state, ICE connection state), and the reverse indexes
+        self._states: dict[str, tuple[str, str]] = {}
+        self._state_since: dict[str, float] = {}  # peer id -> when its connection state last changed
+        self._by_state: dict[str, set[str]] = {}
+        self._by_ice_state: dict[str, set[str]] = {}
         self._change_listeners: list[Callable[[], None]] = []
 
     def on_change(self, callback: Callable[[], None]) -> None:
@@ -22,38 +39,160 @@ class ConnectionManager:
             pass
 
     def _notify_change(self) -> None:
+        self.version += 1
         for cb in self._change_listeners[:]:  # copy: a callback may mutate the list
             cb()
 
-    async def add_peer(self, peer_id: str, pc: RTCPeerConnection) -> None:
+    def _index(self, peer_id: str, pc: RTCPeerConnection) -> None:
+        previous = self._states.get(peer_id)
+        self._unindex(peer_id)
+        states = (pc.connectionState, pc.iceConnectionState)
+        if previous is None or previous[0] != states[0]:
+            self._state_since[peer_id] = time.monotonic()
+        self._states[peer_id] = states
+        self._by_state.setdefault(states[0], set()).add(peer_id)
+        self._by_ice_state.setdefault(states[1], set()).add(peer_id)
+
+    def _unindex(self, peer_id: str) -> None:
+        states = self._states.pop(peer_id, None)
+        if states is None:
+            return
+        if peer_id not in self.pcs:
+            self._state_since.pop(peer_id, None)
+        for index, state in ((self._by_state, states[0]), (self._by_ice_state, states[1])):
+            peers = index[state]
+            peers.discard(peer_id)
+            if not peers:
+                del index[state]
+
+    def _changed(self, peer_id: str, pc: RTCPeerConnection) -> None:
+        if self.pcs.get(peer_id) is pc:
+            self._index(peer_id, pc)
+            self.version += 1
+
+    def _watch_states(self, peer_id: str, pc: RTCPeerConnection) -> None:
+        # Every state describe() reports, so cached listings never go stale.
+        for event in (
+            "connectionstatechange",
+            "iceconnectionstatechange",
+            "icegatheringstatechange",
+            "signalingstatechange",
+        ):
+            pc.on(event, lambda: self._changed(peer_id, pc))
+
+    def watch_track(self, peer_id: str, pc: RTCPeerConnection, track: MediaStreamTrack) -> None:
+        """Bump the version when a peer's track switches rendition."""
+        track.on("renditionchange", lambda: self._changed(peer_id, pc))
+
+    def set_stats(self, peer_id: str, stats: dict) -> None:
+        if peer_id in self.pcs:
+            self.stats[peer_id] = stats
+            self.version += 1
+
+    @staticmethod
+    def _stop_tracks(pc: RTCPeerConnection) -> None:
+        # pc.close() stops senders but not their tracks; shared sources (relay
+        # proxies, encoder fan-out subscriptions) only release a peer here.
+        for transceiver in pc.getTransceivers():
+            if transceiver.receiver and transceiver.receiver.track:
+                transceiver.receiver.track.stop()
+            if transceiver.sender and transceiver.sender.track:
+                transceiver.sender.track.stop()
+
+    async def add_peer(self, peer_id: str, pc: RTCPeerConnection, camera: str | None = None) -> None:
         if peer_id in self.pcs:
             old_pc = self.pcs.pop(peer_id)
+            self.cameras.pop(peer_id, None)
+            self.stats.pop(peer_id, None)
+            self._unindex(peer_id)
             if old_pc.connectionState != "closed":
                 logger.info(f"Closing stale connection for peer {peer_id} before replacing")
+                self._stop_tracks(old_pc)
                 await old_pc.close()
         self.pcs[peer_id] = pc
-        logger.info(f"Added peer {peer_id} ({pc.connectionState})")
+        if camera is not None:
+            self.cameras[peer_id] = camera
+        self._index(peer_id, pc)
+        self._watch_states(peer_id, pc)
+        logger.info(f"Added peer {peer_id} ({pc.connectionState}, camera={camera})")
         self._notify_change()
 
     def get_peer(self, peer_id: str) -> RTCPeerConnection | None:
         return self.pcs.get(peer_id)
 
-    def get_peers(self, verbose: bool = False) -> dict | List[str]:
+    def count(self, camera: str | None = None) -> int:
+        """Connected peers, optionally only those watching `camera`."""
+        if camera is None:
+            return len(self.pcs)
+        return sum(1 for peer_id in self.pcs if self.cameras.get(peer_id) == camera)
+
+    def camera_counts(self) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        for peer_id in self.pcs:
+            camera = self.cameras.get(peer_id)
+            if camera is not None:
+                counts[camera] = counts.get(camera, 0) + 1
+        return counts
+
+    def state_counts(self) -> dict[str, dict[str, int]]:
+        return {
+            "connection": {state: len(peers) for state, peers in self._by_state.items()},
+            "ice": {state: len(peers) for state, peers in self._by_ice_state.items()},
+        }
+
+    def peers_in_state(self, connection_state: str | None = None, ice_state: str | None = None) -> set[str]:
+        """Peers in both given states, from the indexes."""
+        matches = None
+        for index, state in ((self._by_state, connection_state), (self._by_ice_state, ice_state)):
+            if state is not None:
+                peers = index.get(state, set())
+                matches = peers if matches is None else matches & peers
+        return set(self.pcs) if matches is None else set(matches)
+
+    def overdue(self, deadlines: dict[str, float]) -> list[tuple[str, RTCPeerConnection, str]]:
+        """Peers that have been in a connection state longer than its deadline
+        (seconds), as (peer id, pc, state)."""
+        now = time.monotonic()
+        return [
+            (peer_id, self.pcs[peer_id], state)
+            for state, deadline in deadlines.items()
+            for peer_id in self._by_state.get(state, ())
+            if now - self._state_since[peer_id] > deadline
+        ]
+
+    def describe(self, peer_id: str, sdp: bool = False) -> dict | None:
+        """Details of a peer; the SDP bodies are large and only included on request."""
+        pc = self.pcs.get(peer_id)
+        if pc is None:
+            return None
+        details = {
+            "connection_state": pc.connectionState,
+            "ice_connection_state": pc.iceConnectionState,
+            "ice_gathering_state": pc.iceGatheringState,
+            "sctp": str(pc.sctp) if pc.sctp else None,
+            "signalingState": pc.signalingState,
+            "rendition": self._rendition(pc),
+            "camera": self.cameras.get(peer_id),
+            "stats": self.stats.get(peer_id),
+        }
+        if sdp:
+            details["local_description"] = str(pc.localDescription) if pc.localDescription else None
+            details["remote_description"] = str(pc.remoteDescription) if pc.remoteDescription else None
+        return details
+
+    def get_peers(self, verbose: bool = False, sdp: bool = False) -> dict | List[str]:
         if verbose:
-            return {
-                key: {
-                    "connection_state": value.connectionState,
-                    "ice_connection_state": value.iceConnectionState,
-                    "ice_gathering_state": value.iceGatheringState,
-                    "local_description": str(value.localDescription) if value.localDescription else None,
-                    "remote_description": str(value.remoteDescription) if value.remoteDescription else None,
-                    "sctp": str(value.sctp) if value.sctp else None,
-                    "signalingState": value.signalingState,
-                }
-                for key, value in self.pcs.items()
-            }
+            return {peer_id: self.describe(peer_id, sdp=sdp) for peer_id in self.pcs}
         return list(self.pcs.keys())
 
+    @staticmethod
+    def _rendition(pc: RTCPeerConnection) -> str | None:
+        for sender in pc.getSenders():
+            rendition = getattr(sender.track, "rendition", None)
+            if rendition is not None:
+                return rendition.name
+        return None
+
     def get_pcs(self):
         return self.pcs.values()
 
@@ -63,16 +202,19 @@ class ConnectionManager:
         if self.pcs.get(peer_id) is not pc:
             logger.info(f"Skipping remove for {peer_id}: stored PC has already been replaced")
             return
-        for transceiver in pc.getTransceivers():
-            if transceiver.receiver and transceiver.receiver.track:
-                transceiver.receiver.track.stop()
+        self._stop_tracks(pc)
         await pc.close()
         self.pcs.pop(peer_id, None)
+        self.cameras.pop(peer_id, None)
+        self.stats.pop(peer_id, None)
+        self._unindex(peer_id)
         logger.info(f"Removed peer {peer_id} ({pc.connectionState})")
         self._notify_change()
 
     async def clean_up(self) -> None:
         try:
+            for pc in self.pcs.values():
+                self._stop_tracks(pc)
             close_coros = [
                 pc.close()
                 for pc in self.pcs.values()
@@ -81,6 +223,12 @@ class ConnectionManager:
             if close_coros:
                 await asyncio.gather(*close_coros, return_exceptions=True)
             self.pcs.clear()
+            self.cameras.clear()
+            self.stats.clear()
+            self._states.clear()
+            self._state_since.clear()
+            self._by_state.clear()
+            self._by_ice_state.clear()
             self._notify_change()
             logger.info("All peer connections cleaned up")
         except Exception:
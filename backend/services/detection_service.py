@@ -0,0 +1,480 @@
+import asyncio
+import importlib
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, NamedTuple
+
+import av
+import cv2
+import numpy as np
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import VIDEO_CLOCK_RATE, MediaStreamError
+from sqlalchemy import insert
+
+from models.orm import BirdDetection
+from services.frame_bus_service import BusFrame, FrameBus, FrameBusReader
+from services.metrics_service import registry
+from services.rendition_service import shared_fanout
+from services.source_service import MediaSource
+from services.video_service import VIDEO_FRAME_BUS, VIDEO_FRAME_BUS_NAME
+from services.webrtc_service import relay
+
+logger = logging.getLogger("detection_service")
+
+# "module:callable" taking a BGR crop and returning (species, confidence)
+# pairs; empty disables analysis. While enabled, capture is never suspended.
+DETECTION_DETECTOR = os.environ.get("DETECTION_DETECTOR", "")
+DETECTION_WORKERS = int(os.environ.get("DETECTION_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+DETECTION_MIN_CONFIDENCE = float(os.environ.get("DETECTION_MIN_CONFIDENCE", "0.5"))
+DETECTION_MIN_INTERVAL = float(os.environ.get("DETECTION_MIN_INTERVAL", "0.2"))  # seconds between samples
+DETECTION_MAX_INTERVAL = float(os.environ.get("DETECTION_MAX_INTERVAL", "5"))
+# Shared-memory frame bus the sampled frames are handed to the workers on.
+DETECTION_FRAME_BUS_NAME = os.environ.get("DETECTION_FRAME_BUS_NAME", "birdstream-detection")
+DETECTION_MAX_DELAY = 2.0  # seconds a sampled frame may wait for a worker
+# Seconds without a new frame before the capture frame bus counts as gone.
+CAPTURE_BUS_STALE = 1.0
+DETECTION_QUEUE_MAX = 16
+DETECTION_BATCH_SIZE = 50  # rows per INSERT
+DETECTION_FLUSH_INTERVAL = 5.0  # seconds before a partial batch is written
+SAMPLER_HEADROOM = 1.25  # sample this much slower than the pool can keep up with
+SAMPLER_SMOOTHING = 0.2  # weight of the newest job duration in the moving average
+
+MOTION_WIDTH = 160  # analysis width of the grey copy
+MOTION_THRESHOLD = 25  # grey-level change that counts as motion
+MOTION_MIN_AREA = 0.002  # fraction of the frame a region must cover
+MOTION_MAX_REGIONS = 4
+MOTION_BACKGROUND_RATE = 0.1  # how quickly the background absorbs changes
+MOTION_PADDING = 0.25  # context added around each region, relative to its size
+
+DETECTION_SAMPLES = registry.counter(
+    "birdstream_detection_samples_total", "Frames checked for motion"
+)
+DETECTION_MOTION = registry.counter(
+    "birdstream_detection_motion_total", "Sampled frames with motion handed to the detector"
+)
+DETECTION_DROPPED = registry.counter(
+    "birdstream_detection_dropped_total", "Motion frames dropped because the detector fell behind"
+)
+DETECTION_DECODE_ERRORS = registry.counter(
+    "birdstream_detection_decode_errors_total", "Packets of the shared stream the detection decoder rejected"
+)
+DETECTION_RESULTS = registry.counter(
+    "birdstream_detections_total", "Detections stored", ("species",)
+)
+DETECTION_JOB_SECONDS = registry.histogram(
+    "birdstream_detection_job_seconds",
+    "Detector time per motion frame, including the hop to the worker process",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+DETECTION_INTERVAL = registry.gauge(
+    "birdstream_detection_sample_interval_seconds", "Current time between sampled frames"
+)
+DETECTION_QUEUE = registry.gauge(
+    "birdstream_detection_queue_depth", "Motion frames waiting for a worker"
+)
+
+Box = tuple[int, int, int, int]  # x, y, width, height in full-frame pixels
+Detector = Callable[[np.ndarray], Iterable[tuple[str, float]]]
+
+
+class MotionDetector:
+    """Frame differencing against a slowly adapting background on a small grey copy."""
+
+    def __init__(
+        self,
+        width: int = MOTION_WIDTH,
+        threshold: int = MOTION_THRESHOLD,
+        min_area: float = MOTION_MIN_AREA,
+        max_regions: int = MOTION_MAX_REGIONS,
+    ):
+        self.width = width
+        self.threshold = threshold
+        self.min_area = min_area
+        self.max_regions = max_regions
+        self._background: np.ndarray | None = None
+
+    def regions(self, frame: np.ndarray) -> list[Box]:
+        """Bounding boxes of the largest moving regions, largest first."""
+        height, width = frame.shape[:2]
+        scale = self.width / width
+        small = cv2.resize(frame, (self.width, max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            return []
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        cv2.accumulateWeighted(gray, self._background, MOTION_BACKGROUND_RATE)
+        _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        mask = cv2.dilate(mask, None, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        min_area = self.min_area * gray.size
+        boxes = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) >= min_area]
+        boxes.sort(key=lambda b: b[2] * b[3], reverse=True)
+        return [
+            (int(x / scale), int(y / scale), math.ceil(w / scale), math.ceil(h / scale))
+            for x, y, w, h in boxes[: self.max_regions]
+        ]
+
+
+def crop(frame: np.ndarray, box: Box, padding: float = MOTION_PADDING) -> np.ndarray:
+    x, y, w, h = box
+    pad_x, pad_y = int(w * padding), int(h * padding)
+    height, width = frame.shape[:2]
+    return frame[
+        max(0, y - pad_y) : min(height, y + h + pad_y),
+        max(0, x - pad_x) : min(width, x + w + pad_x),
+    ].copy()
+
+
+class AdaptiveSampler:
+    """Paces frame sampling to what the worker pool can actually analyse.
+
+    The interval follows a moving average of job durations divided over the
+    workers; the queue is only as deep as the pool can clear within
+    `max_delay`, so queued frames never go stale.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        min_interval: float = DETECTION_MIN_INTERVAL,
+        max_interval: float = DETECTION_MAX_INTERVAL,
+        max_delay: float = DETECTION_MAX_DELAY,
+        max_depth: int = DETECTION_QUEUE_MAX,
+    ):
+        self.workers = workers
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_delay = max_delay
+        self.max_depth = max_depth
+        self.interval = min_interval
+        self._job_seconds: float | None = None
+        self._last_sample = float("-inf")
+        DETECTION_INTERVAL.set(self.interval)
+
+    @property
+    def depth(self) -> int:
+        return min(self.max_depth, max(1, int(self.max_delay / self.interval)))
+
+    def due(self, now: float) -> bool:
+        if now - self._last_sample < self.interval:
+            return False
+        self._last_sample = now
+        return True
+
+    def _set_interval(self, interval: float) -> None:
+        self.interval = min(self.max_interval, max(self.min_interval, interval))
+        DETECTION_INTERVAL.set(self.interval)
+
+    def observe(self, seconds: float) -> None:
+        if self._job_seconds is None:
+            self._job_seconds = seconds
+        else:
+            self._job_seconds += SAMPLER_SMOOTHING * (seconds - self._job_seconds)
+        self._set_interval(self._job_seconds / self.workers * SAMPLER_HEADROOM)
+
+    def backoff(self) -> None:
+        """The queue overflowed: slow down until the next measurement."""
+        self._set_interval(self.interval * 2)
+
+
+# --- worker process ----------------------------------------------------------
+
+_detector: Detector | None = None
+_frames: FrameBusReader | None = None
+
+
+def load_detector(spec: str) -> Detector:
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def _init_worker(spec: str) -> None:
+    global _detector
+    _detector = load_detector(spec)
+
+
+def run_detector(bus: str, sequence: int, boxes: list[Box]) -> list[tuple[str, float]] | None:
+    """Detect in the moving regions of a frame on the frame bus; None if the
+    frame was overwritten before it could be cropped."""
+    global _frames
+    if _frames is None:
+        # The bus only exists once the first frame was sampled.
+        _frames = FrameBusReader(bus)
+    frame = _frames.get(sequence)
+    if frame is None:
+        return None
+    crops = [crop(frame.image, box) for box in boxes]
+    if not _frames.intact(frame):
+        return None
+    results = []
+    for image in crops:
+        results.extend((str(species), float(confidence)) for species, confidence in _detector(image))
+    return results
+
+
+# --- service -----------------------------------------------------------------
+
+
+class Job(NamedTuple):
+    captured_at: float  # wall clock
+    sequence: int  # frame on the detection frame bus
+    boxes: list[Box]
+
+
+class DetectionService:
+    """Motion-gated bird detection on the camera feed.
+
+    A background task follows the video the way SnapshotService does: the
+    shared H.264 stream, decoded here, or raw frames in per-peer mode. While
+    the capture publishes raw frames to its own frame bus (VIDEO_FRAME_BUS),
+    samples are read from there instead and nothing is decoded. Sampled
+    frames are checked for motion (a small grey copy, well under a
+    millisecond) in an executor; frames with motion go onto a shared-memory
+    frame bus and only their sequence number and moving regions are sent to
+    the detector in a process pool, which crops straight from the bus.
+    Results are written to `bird_detections` in batches from a thread, so
+    the event loop never waits on analysis.
+    """
+
+    def __init__(
+        self,
+        source: MediaSource,
+        db_factory: Callable[[], Any],
+        detector: str = DETECTION_DETECTOR,
+        workers: int = DETECTION_WORKERS,
+        min_confidence: float = DETECTION_MIN_CONFIDENCE,
+        bus_name: str = DETECTION_FRAME_BUS_NAME,
+        capture_bus: str | None = VIDEO_FRAME_BUS_NAME if VIDEO_FRAME_BUS else None,
+    ):
+        self.source = source
+        self.db_factory = db_factory
+        self.detector = detector
+        self.workers = workers
+        self.min_confidence = min_confidence
+        self.bus_name = bus_name
+        self.capture_bus = capture_bus
+        self.motion = MotionDetector()
+        self.sampler = AdaptiveSampler(workers)
+        self._queue: asyncio.Queue[Job] = asyncio.Queue()
+        self._pool: ProcessPoolExecutor | None = None
+        # Created on the first sampled frame, once the frame size is known.
+        self._bus: FrameBus | None = None
+        self._decoder: av.CodecContext | None = None
+        self._capture: FrameBusReader | None = None
+        self._capture_retry = 0.0
+        self._feed: asyncio.Task | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._rows: list[dict[str, Any]] = []
+
+    @property
+    def running(self) -> bool:
+        return self._feed is not None
+
+    async def start(self) -> None:
+        if not self.detector:
+            logger.info("Bird detection disabled (DETECTION_DETECTOR is not set)")
+            return
+        # Analysis runs whether or not anyone is watching.
+        self.source.retain()
+        _, video = await self.source.acquire()
+        fanout = shared_fanout(video)
+        if fanout is not None:
+            track = fanout.subscribe()
+        elif isinstance(video, MediaStreamTrack):
+            track = relay.subscribe(video, buffered=False)
+        else:
+            logger.warning("Bird detection has no video to follow; analysis disabled")
+            self.source.release()
+            return
+
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.detector,)
+        )
+        self._tasks = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._flush_periodically()))
+        self._feed = asyncio.create_task(self._follow(track))
+        logger.info(f"Bird detection started with {self.detector} on {self.workers} worker(s)")
+
+    async def _follow(self, track: MediaStreamTrack) -> None:
+        loop = asyncio.get_running_loop()
+        analysis: asyncio.Future | None = None
+        try:
+            while True:
+                item = await track.recv()
+                analysis = loop.run_in_executor(None, self._analyse, item)
+                job = await asyncio.shield(analysis)
+                if job is not None:
+                    self._enqueue(job)
+        except MediaStreamError:
+            logger.warning("Detection source ended")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Detection feed crashed")
+        finally:
+            track.stop()
+            if analysis is not None:
+                # stop() closes the frame bus next; let a running analysis finish with it.
+                await asyncio.wait([analysis])
+
+    def _decode(self, packet: av.Packet) -> av.VideoFrame | None:
+        # Every packet is decoded (later frames reference earlier ones), but
+        # only sampled frames are converted for OpenCV.
+        if self._decoder is None:
+            self._decoder = av.CodecContext.create("h264", "r")
+        frame = None
+        try:
+            for frame in self._decoder.decode(packet):
+                pass
+        except av.FFmpegError:
+            DETECTION_DECODE_ERRORS.inc()
+        return frame
+
+    def _capture_frame(self) -> BusFrame | None:
+        """The newest frame on the capture frame bus; None while the capture
+        publishes none."""
+        if self.capture_bus is None:
+            return None
+        if self._capture is None:
+            if time.monotonic() < self._capture_retry:
+                return None
+            self._capture_retry = time.monotonic() + CAPTURE_BUS_STALE
+            try:
+                self._capture = FrameBusReader(self.capture_bus)
+            except (FileNotFoundError, ValueError):
+                return None
+            logger.info(f"Bird detection reading frames from the capture frame bus {self.capture_bus}")
+        frame = self._capture.read_latest()
+        if frame is None or time.time() - frame.captured_at > CAPTURE_BUS_STALE:
+            # Not publishing yet, or replaced by a restarted capture.
+            del frame
+            self._capture.close()
+            self._capture = None
+            return None
+        return frame
+
+    def _analyse(self, item: av.Packet | av.VideoFrame | None) -> Job | None:
+        """Samples one item of the feed and checks it for motion; runs in an executor."""
+        captured = self._capture_frame()
+        if captured is None:
+            frame = self._decode(item) if isinstance(item, av.Packet) else item
+            if frame is None:
+                return None
+        if not self.sampler.due(time.monotonic()):
+            return None
+        DETECTION_SAMPLES.inc()
+
+        width, height = (captured.width, captured.height) if captured else (frame.width, frame.height)
+        if self._bus is None:
+            # Room for a full queue plus a frame in flight per worker.
+            slots = DETECTION_QUEUE_MAX + self.workers + 2
+            self._bus = FrameBus(slots, width * height * 3, name=self.bus_name)
+        if width * height * 3 > self._bus.slot_size:
+            # The source grew (a new ingest sender): analyse it scaled down.
+            scale = math.sqrt(self._bus.slot_size / (width * height * 3))
+            width, height = int(width * scale) // 2 * 2, int(height * scale) // 2 * 2
+        if captured is None:
+            image = frame.reformat(width=width, height=height, format="bgr24").to_ndarray()
+        elif (width, height) != (captured.width, captured.height):
+            image = cv2.resize(captured.image, (width, height), interpolation=cv2.INTER_AREA)
+        else:
+            image = captured.image  # a view: publish() below copies it out of the capture bus
+
+        boxes = self.motion.regions(image)
+        if not boxes:
+            return None
+        DETECTION_MOTION.inc()
+        captured_at = captured.captured_at if captured is not None else time.time()
+        # The monotonic clock is system-wide, so pts compare across processes.
+        sequence = self._bus.publish(image, int(time.monotonic() * VIDEO_CLOCK_RATE), captured_at)
+        if captured is not None and not self._capture.intact(captured):
+            return None  # the capture overwrote the frame while it was copied
+        return Job(captured_at, sequence, boxes)
+
+    def _enqueue(self, job: Job) -> None:
+        # Drop the oldest frames: a fresh frame is worth more than a late one.
+        while self._queue.qsize() >= self.sampler.depth:
+            self._queue.get_nowait()
+            DETECTION_DROPPED.inc()
+            self.sampler.backoff()
+        self._queue.put_nowait(job)
+        DETECTION_QUEUE.set(self._queue.qsize())
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            DETECTION_QUEUE.set(self._queue.qsize())
+            started = time.monotonic()
+            try:
+                results = await loop.run_in_executor(
+                    self._pool, run_detector, self.bus_name, job.sequence, job.boxes
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Detector failed")
+                continue
+            if results is None:
+                DETECTION_DROPPED.inc()  # overwritten on the bus while queued
+                continue
+            elapsed = time.monotonic() - started
+            DETECTION_JOB_SECONDS.observe(elapsed)
+            self.sampler.observe(elapsed)
+
+            detected_at = datetime.fromtimestamp(job.captured_at, timezone.utc)
+            for species, confidence in results:
+                if confidence >= self.min_confidence:
+                    self._rows.append(
+                        {"species": species, "confidence": confidence, "detected_at": detected_at}
+                    )
+            if len(self._rows) >= DETECTION_BATCH_SIZE:
+                await self.flush()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(DETECTION_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self) -> None:
+        rows, self._rows = self._rows, []
+        if rows:
+            await asyncio.get_running_loop().run_in_executor(None, self._insert, rows)
+
+    def _insert(self, rows: list[dict[str, Any]]) -> None:
+        try:
+            with self.db_factory() as session:
+                session.execute(insert(BirdDetection), rows)
+                session.commit()
+        except Exception:
+            logger.exception(f"Failed to store {len(rows)} detections")
+            return
+        for row in rows:
+            DETECTION_RESULTS.inc(species=row["species"])
+
+    async def stop(self) -> None:
+        if self._feed is None:
+            return
+        for task in [self._feed, *self._tasks]:
+            task.cancel()
+        await asyncio.gather(self._feed, *self._tasks, return_exceptions=True)
+        self._feed = None
+        self._tasks = []
+        await self.flush()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        if self._bus is not None:
+            self._bus.close()
+            self._bus = None
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+        self._decoder = None
+        self.source.release()
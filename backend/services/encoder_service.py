@@ -0,0 +1,419 @@
+import abc
+import asyncio
+import fractions
+import logging
+import os
+import time
+import weakref
+from collections import deque
+from typing import Any, Callable
+
+import av
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE, MediaStreamError
+from aiortc.rtcrtpsender import RTCRtpSender
+
+from services.metrics_service import registry
+
+logger = logging.getLogger("encoder_service")
+
+# "shared" encodes each source once for all viewers, "per-peer" keeps aiortc's
+# default of one encoder per RTCRtpSender (via MediaRelay).
+VIDEO_ENCODER_MODE = os.environ.get("VIDEO_ENCODER_MODE", "shared")
+
+DEFAULT_BITRATE = 1_200_000
+DEFAULT_FRAMERATE = 30
+KEYFRAME_INTERVAL = 2  # seconds between periodic IDRs
+KEYFRAME_MIN_GAP = 0.5  # seconds; rate-limits IDRs forced by joins and PLI/FIR
+SUBSCRIBER_QUEUE_SIZE = 30
+# Packets kept from the latest keyframe onwards so a joining peer can start
+# decoding at once; a longer GOP invalidates the cache until the next keyframe.
+KEYFRAME_CACHE_SIZE = int(os.environ.get("VIDEO_KEYFRAME_CACHE_SIZE", "90"))
+# A GOP longer than this is not replayed by encoders that can force an IDR;
+# the joiner gets the cached keyframe and then a fresh IDR instead.
+KEYFRAME_CACHE_BURST = int(DEFAULT_FRAMERATE * KEYFRAME_MIN_GAP)
+
+TIME_TO_FIRST_FRAME = registry.histogram(
+    "birdstream_time_to_first_frame_seconds",
+    "Time from a peer joining to its first video packet being sent",
+    ("source",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0),
+)
+FRAMES_ENCODED = registry.counter(
+    "birdstream_frames_encoded_total", "Frames encoded by the shared encoders", ("height",)
+)
+
+ENCODER_LOAD_SMOOTHING = 0.1  # weight of the newest frame in EncodingFanout.load
+
+# Every EncodingFanout stamps pts from this origin, so a peer moved between
+# encoders (rendition switches) sees one continuous RTP timeline.
+_CLOCK_ORIGIN = time.monotonic()
+
+
+class SenderHooks:
+    """The single wrapper around an RTCRtpSender's private RTCP entry points.
+
+    aiortc reports neither the RTCP feedback a sender receives nor its
+    keyframe requests, so `_handle_rtcp_packet` is wrapped once here and
+    every observer (feedback counters, rendition selection) registers on it.
+    """
+
+    def __init__(self, sender: RTCRtpSender):
+        self._sender = sender
+        self._observers: list[Callable[[Any], None]] = []
+        handle = sender._handle_rtcp_packet
+
+        async def handle_rtcp_packet(packet) -> None:
+            for observer in self._observers:
+                observer(packet)
+            await handle(packet)
+
+        sender._handle_rtcp_packet = handle_rtcp_packet
+
+    def on_rtcp(self, observer: Callable[[Any], None]) -> None:
+        """Call `observer` with each RTCP packet before aiortc handles it."""
+        self._observers.append(observer)
+
+    def route_keyframes(self, request_keyframe: Callable[[], None]) -> None:
+        """Send the peer's PLI/FIR to `request_keyframe` instead of the sender's encoder."""
+        self._sender._send_keyframe = request_keyframe
+
+
+def sender_hooks(sender: RTCRtpSender) -> SenderHooks:
+    if not hasattr(sender, "hooks"):
+        sender.hooks = SenderHooks(sender)
+    return sender.hooks
+
+
+class EncodedVideoTrack(MediaStreamTrack):
+    """A single peer's view of a shared H.264 stream.
+
+    Yields `av.Packet`s, so the peer's RTCRtpSender only packetizes them
+    (sequence numbers, RTP timestamps and SRTP stay per-peer) instead of
+    running its own encoder.
+    """
+
+    kind = "video"
+
+    def __init__(self, fanout: "VideoFanout", prime: bool = False):
+        super().__init__()
+        self._fanout: VideoFanout | None = fanout
+        self._queue: asyncio.Queue[av.Packet | None] = asyncio.Queue(
+            maxsize=SUBSCRIBER_QUEUE_SIZE
+        )
+        # A decoder cannot start mid-GOP, so nothing is queued until a keyframe.
+        self._synced = False
+        # A primed track queues nothing until its sender first reads (i.e. once
+        # DTLS is up) and then starts from the fan-out's keyframe cache.
+        self._primed = not prime
+        self._backlog: deque[av.Packet] = deque()
+        self._joined_at = time.monotonic() if prime else None
+
+    def _prime(self) -> None:
+        self._primed = True
+        if self._fanout is not None:
+            packets, self._synced = self._fanout._join_packets()
+            self._backlog.extend(packets)
+
+    def _push(self, packet: av.Packet | None) -> None:
+        if packet is not None and not self._primed:
+            return
+        if packet is not None and not self._synced:
+            if not packet.is_keyframe:
+                return
+            self._synced = True
+
+        if self._queue.full():
+            # Slow consumer: drop the backlog and resync on the next keyframe
+            # rather than letting latency grow without bound.
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._synced = False
+            self.request_keyframe()
+            if packet is not None:
+                return
+
+        self._queue.put_nowait(packet)
+
+    @property
+    def ready(self) -> bool:
+        """True once a keyframe (and what follows it) is waiting to be read."""
+        return bool(self._backlog) or not self._queue.empty()
+
+    def request_keyframe(self) -> None:
+        if self._fanout is not None:
+            self._fanout.request_keyframe()
+
+    async def recv(self) -> av.Packet:
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        if not self._primed:
+            self._prime()
+        if self._backlog:
+            packet, source = self._backlog.popleft(), "cache"
+        else:
+            packet, source = await self._queue.get(), "live"
+        if packet is None:
+            self.stop()
+            raise MediaStreamError
+
+        if self._joined_at is not None:
+            elapsed = time.monotonic() - self._joined_at
+            self._joined_at = None
+            TIME_TO_FIRST_FRAME.observe(elapsed, source=source)
+            logger.info(f"First video packet after {elapsed * 1000:.0f} ms (from {source})")
+        return packet
+
+    def stop(self) -> None:
+        super().stop()
+        if self._fanout is not None:
+            self._fanout._unsubscribe(self)
+            self._fanout = None
+
+
+class VideoFanout(abc.ABC):
+    """Produces one H.264 packet stream and hands the same packets to every subscriber.
+
+    Subclasses implement `_next_packets`; the fan-out task only runs while
+    there is at least one subscriber. The latest keyframe and the packets that
+    depend on it are cached so a joining peer has something to decode at once.
+    """
+
+    kind = "video"
+
+    def __init__(self):
+        self._subscribers: set[EncodedVideoTrack] = set()
+        self._task: asyncio.Task | None = None
+        self._force_keyframe = False
+        self._last_forced_keyframe = 0.0
+        self._gop: list[av.Packet] = []
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, prime: bool = True) -> EncodedVideoTrack:
+        """Add a subscriber.
+
+        A primed subscriber is a joining peer: it starts from the keyframe
+        cache. Unprimed ones (rendition switches) must not jump back in time,
+        so they wait for the next keyframe instead.
+        """
+        track = EncodedVideoTrack(self, prime=prime)
+        self._subscribers.add(track)
+        logger.info(f"{type(self).__name__}: subscriber added ({len(self._subscribers)} total)")
+        if not prime:
+            self.request_keyframe()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return track
+
+    def attach_sender(self, sender: RTCRtpSender) -> None:
+        # Route the peer's PLI/FIR feedback to the shared encoder; the sender's
+        # own encoder only packetizes and never sees a raw frame.
+        sender_hooks(sender).route_keyframes(self.request_keyframe)
+
+    def request_keyframe(self) -> None:
+        now = time.monotonic()
+        if now - self._last_forced_keyframe >= KEYFRAME_MIN_GAP:
+            self._last_forced_keyframe = now
+            self._force_keyframe = True
+
+    def _unsubscribe(self, track: EncodedVideoTrack) -> None:
+        self._subscribers.discard(track)
+        logger.info(f"{type(self).__name__}: subscriber removed ({len(self._subscribers)} total)")
+
+    def _cache(self, packet: av.Packet) -> None:
+        if packet.is_keyframe:
+            self._gop = [packet]
+        elif self._gop:
+            if len(self._gop) < KEYFRAME_CACHE_SIZE:
+                self._gop.append(packet)
+            else:
+                self._gop = []
+
+    def _join_packets(self) -> tuple[list[av.Packet], bool]:
+        """Packets to replay to a joining subscriber, and whether the live
+        stream may follow them directly."""
+        if not self._gop:
+            self.request_keyframe()
+        return list(self._gop), bool(self._gop)
+
+    @abc.abstractmethod
+    async def _next_packets(self) -> list[av.Packet]:
+        """The next packets of the stream; MediaStreamError once the source ends."""
+
+    async def _run(self) -> None:
+        try:
+            while self._subscribers:
+                try:
+                    packets = await self._next_packets()
+                except MediaStreamError:
+                    logger.warning(f"{type(self).__name__}: source ended")
+                    for track in list(self._subscribers):
+                        track._push(None)
+                    break
+                for packet in packets:
+                    self._cache(packet)
+                    for track in list(self._subscribers):
+                        track._push(packet)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"{type(self).__name__}: fan-out task crashed")
+        finally:
+            # The cache goes stale while nobody is watching.
+            self._gop = []
+            self._task = None
+
+    async def stop(self) -> None:
+        for track in list(self._subscribers):
+            track.stop()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class EncodingFanout(VideoFanout):
+    """Encodes a raw video track once with libx264 for all subscribers.
+
+    With `height` set, larger frames are downscaled (aspect preserved) before
+    encoding; smaller frames are never upscaled.
+    """
+
+    def __init__(
+        self,
+        source: MediaStreamTrack,
+        bitrate: int = DEFAULT_BITRATE,
+        framerate: int = DEFAULT_FRAMERATE,
+        height: int | None = None,
+        driver: VideoFanout | None = None,
+    ):
+        super().__init__()
+        self.source = source
+        # The fan-out whose task calls encode(): this one, unless another
+        # fan-out encodes through it (PassthroughFanout transcoding).
+        self.driver = driver or self
+        self.bitrate = bitrate
+        self.framerate = framerate
+        self.height = height
+        self.source_height: int | None = None
+        self._codec: av.CodecContext | None = None
+        self._last_pts = -1
+        # Smoothed encode time as a fraction of the frame interval; above 1
+        # the encoder cannot keep up with the source.
+        self.load = 0.0
+        _encoders.add(self)
+
+    def _open_codec(self, width: int, height: int) -> av.CodecContext:
+        # Same constraints as aiortc's H264Encoder so the SDP it negotiates
+        # (constrained baseline, level 3.1, packetization-mode 1) still holds.
+        codec = av.CodecContext.create("libx264", "w")
+        codec.width = width
+        codec.height = height
+        codec.bit_rate = self.bitrate
+        codec.pix_fmt = "yuv420p"
+        codec.framerate = fractions.Fraction(self.framerate, 1)
+        codec.time_base = VIDEO_TIME_BASE
+        codec.gop_size = self.framerate * KEYFRAME_INTERVAL
+        codec.options = {
+            # 3.1 covers up to 720p30; larger renditions need 4.0.
+            "level": "31" if width * height <= 1280 * 720 else "40",
+            "tune": "zerolatency",
+            "preset": "veryfast",
+        }
+        codec.profile = "Baseline"
+        logger.info(f"Opened shared H.264 encoder {width}x{height} @ {self.bitrate} bps")
+        return codec
+
+    def _join_packets(self) -> tuple[list[av.Packet], bool]:
+        # Replaying a long GOP delays live video, so show the cached keyframe
+        # and switch to a freshly forced IDR as soon as it is encoded.
+        if len(self._gop) > KEYFRAME_CACHE_BURST:
+            self.request_keyframe()
+            return self._gop[:1], False
+        return super()._join_packets()
+
+    def _encode(self, frame: av.VideoFrame, pts: int, force_keyframe: bool) -> list[av.Packet]:
+        self.source_height = frame.height
+        if self.height is not None and frame.height > self.height:
+            width = round(frame.width * self.height / frame.height / 2) * 2
+            frame = frame.reformat(width=width, height=self.height, format="yuv420p")
+
+        if self._codec is None or (self._codec.width, self._codec.height) != (frame.width, frame.height):
+            self._codec = self._open_codec(frame.width, frame.height)
+            force_keyframe = True
+
+        frame.pts = pts
+        frame.time_base = VIDEO_TIME_BASE
+        frame.pict_type = (
+            av.video.frame.PictureType.I if force_keyframe else av.video.frame.PictureType.NONE
+        )
+        started = time.perf_counter()
+        packets = self._codec.encode(frame)
+        frame_load = (time.perf_counter() - started) * self.framerate
+        self.load += ENCODER_LOAD_SMOOTHING * (frame_load - self.load)
+        FRAMES_ENCODED.inc(height=str(frame.height))
+        for packet in packets:
+            packet.time_base = VIDEO_TIME_BASE
+        return packets
+
+    async def encode(self, frame: av.VideoFrame, force_keyframe: bool = False) -> list[av.Packet]:
+        # Stamp frames against a monotonic clock: live sources do not always
+        # provide usable pts and the encoder rejects non-increasing ones.
+        pts = max(int((time.monotonic() - _CLOCK_ORIGIN) * VIDEO_CLOCK_RATE), self._last_pts + 1)
+        self._last_pts = pts
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._encode, frame, pts, force_keyframe
+        )
+
+    async def _next_packets(self) -> list[av.Packet]:
+        frame = await self.source.recv()
+        if frame is None:
+            return []
+
+        force_keyframe = self._force_keyframe
+        self._force_keyframe = False
+        return await self.encode(frame, force_keyframe)
+
+
+_encoders: "weakref.WeakSet[EncodingFanout]" = weakref.WeakSet()
+
+
+def encoder_load() -> float:
+    """Load of the busiest running shared encoder (see EncodingFanout.load)."""
+    return max((encoder.load for encoder in _encoders if encoder.driver._task is not None), default=0.0)
+
+
+class PassthroughFanout(VideoFanout):
+    """Fans out pre-encoded H.264 (PassthroughTrack, IngestTrack); nothing is decoded or encoded.
+
+    Keyframes cannot be forced, so joining subscribers replay the cached GOP
+    (up to KEYFRAME_CACHE_SIZE packets) or otherwise start at the source's next
+    IDR; sources with a `request_keyframe()` of their own (RemotePacketTrack)
+    are asked for one. Raw frames from the source (an IngestTrack session that
+    could not be passed through) are encoded like EncodingFanout does, at
+    `bitrate` and `height`.
+    """
+
+    def __init__(self, source: MediaStreamTrack, bitrate: int = DEFAULT_BITRATE, height: int | None = None):
+        super().__init__()
+        self.source = source
+        self.bitrate = bitrate
+        self.height = height
+        self._encoder: EncodingFanout | None = None
+
+    async def _next_packets(self) -> list[av.Packet]:
+        force_keyframe, self._force_keyframe = self._force_keyframe, False
+        if force_keyframe:
+            request_keyframe = getattr(self.source, "request_keyframe", None)
+            if request_keyframe is not None:
+                request_keyframe()
+        item = await self.source.recv()
+        if isinstance(item, av.VideoFrame):
+            if self._encoder is None:
+                self._encoder = EncodingFanout(self.source, self.bitrate, height=self.height, driver=self)
+            return await self._encoder.encode(item, force_keyframe)
+        return [item]
@@ -0,0 +1,198 @@
+import logging
+import struct
+import sys
+from multiprocessing import resource_tracker, shared_memory
+from typing import NamedTuple
+
+import numpy as np
+
+from services.metrics_service import registry
+
+logger = logging.getLogger("frame_bus_service")
+
+MAGIC = b"BFB1"
+ALIGN = 64
+# magic, slot count, bytes of pixel data per slot, latest published sequence
+_HEADER = struct.Struct("<4sIQQ")
+# begin sequence, end sequence, pts (90 kHz), capture time, width, height, channels
+_SLOT = struct.Struct("<QQqdIII")
+_LATEST_OFFSET = 16  # offset of the latest sequence in _HEADER
+
+FRAME_BUS_PUBLISHED = registry.counter(
+    "birdstream_frame_bus_published_total", "Frames written to the shared-memory frame bus"
+)
+FRAME_BUS_SKIPPED = registry.counter(
+    "birdstream_frame_bus_skipped_total", "Frames too large for the frame bus slots"
+)
+
+
+def _aligned(size: int) -> int:
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+_HEADER_SIZE = _aligned(_HEADER.size)
+_SLOT_HEADER_SIZE = _aligned(_SLOT.size)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # Before 3.13 every attach registers the segment with this process's
+    # resource tracker, which unlinks it when the reader exits.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _create(name: str | None, size: int) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        # Left behind by a publisher that did not shut down cleanly.
+        logger.warning(f"Replacing stale frame bus {name}")
+        stale = shared_memory.SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+
+class BusFrame(NamedTuple):
+    sequence: int
+    pts: int  # 90 kHz ticks of the (system-wide) monotonic clock
+    captured_at: float  # wall clock
+    width: int
+    height: int
+    image: np.ndarray  # view into shared memory, valid until the slot is reused
+
+
+class _Ring:
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        magic, self.slots, self.slot_size, _ = _HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{shm.name} is not a frame bus")
+        self._stride = _SLOT_HEADER_SIZE + _aligned(self.slot_size)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def latest(self) -> int:
+        """Sequence number of the newest complete frame (0 before the first)."""
+        return struct.unpack_from("<Q", self.shm.buf, _LATEST_OFFSET)[0]
+
+    def _slot_offset(self, sequence: int) -> int:
+        return _HEADER_SIZE + (sequence % self.slots) * self._stride
+
+    def _sequences(self, sequence: int) -> tuple[int, int]:
+        return struct.unpack_from("<QQ", self.shm.buf, self._slot_offset(sequence))
+
+
+class FrameBus(_Ring):
+    """Single-writer ring of raw frames in shared memory.
+
+    Each slot is guarded like a seqlock: the writer stamps the slot's begin
+    sequence, copies the pixels and metadata, then stamps the end sequence
+    and publishes it as `latest`. Readers never block the writer; they detect
+    a slot reused under them by re-checking the begin sequence. A named bus
+    replaces any segment of that name, so readers can attach by a fixed name.
+    """
+
+    def __init__(self, slots: int, slot_size: int, name: str | None = None):
+        size = _HEADER_SIZE + slots * (_SLOT_HEADER_SIZE + _aligned(slot_size))
+        shm = _create(name, size)
+        _HEADER.pack_into(shm.buf, 0, MAGIC, slots, slot_size, 0)
+        super().__init__(shm)
+        self._sequence = 0
+        self._unlinked = False
+        logger.info(f"Frame bus {shm.name}: {slots} slots of {slot_size} bytes")
+
+    def publish(self, image: np.ndarray, pts: int, captured_at: float) -> int | None:
+        """Copy a uint8 HxW or HxWxC frame into the next slot; its sequence, or
+        None if it does not fit."""
+        if image.nbytes > self.slot_size:
+            FRAME_BUS_SKIPPED.inc()
+            return None
+        sequence = self._sequence + 1
+        offset = self._slot_offset(sequence)
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+
+        struct.pack_into("<Q", self.shm.buf, offset, sequence)
+        data = np.ndarray((image.nbytes,), np.uint8, self.shm.buf, offset + _SLOT_HEADER_SIZE)
+        data[:] = image.reshape(-1)
+        _SLOT.pack_into(self.shm.buf, offset, sequence, sequence, pts, captured_at, width, height, channels)
+        struct.pack_into("<Q", self.shm.buf, _LATEST_OFFSET, sequence)
+
+        self._sequence = sequence
+        FRAME_BUS_PUBLISHED.inc()
+        return sequence
+
+    def unlink(self) -> None:
+        """Free the name for a new bus; attached readers keep working."""
+        if not self._unlinked:
+            self._unlinked = True
+            self.shm.unlink()
+
+    def close(self) -> None:
+        self.shm.close()
+        self.unlink()
+
+
+class FrameBusReader(_Ring):
+    """Attaches to a FrameBus, usually from another process, with its own cursor.
+
+    Frames are returned as views into shared memory without copying. A slow
+    reader that falls more than a ring behind skips ahead and counts the
+    frames it missed in `overruns`; `intact(frame)` tells whether a frame
+    was overwritten while it was being used.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(_attach(name))
+        self.cursor = self.latest + 1
+        self.overruns = 0
+
+    def get(self, sequence: int) -> BusFrame | None:
+        """The frame with this sequence number, if it is still in the ring."""
+        offset = self._slot_offset(sequence)
+        begin, end, pts, captured_at, width, height, channels = _SLOT.unpack_from(self.shm.buf, offset)
+        if begin != sequence or end != sequence:
+            return None
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        image = np.ndarray(shape, np.uint8, self.shm.buf, offset + _SLOT_HEADER_SIZE)
+        image.flags.writeable = False
+        frame = BusFrame(sequence, pts, captured_at, width, height, image)
+        return frame if self.intact(frame) else None
+
+    def intact(self, frame: BusFrame) -> bool:
+        return self._sequences(frame.sequence)[0] == frame.sequence
+
+    def read(self) -> BusFrame | None:
+        """The next unread frame, or None when the reader has caught up."""
+        while True:
+            latest = self.latest
+            if self.cursor > latest:
+                return None
+            # The slot after `latest` may already be being rewritten.
+            oldest = latest - self.slots + 2
+            if self.cursor < oldest:
+                self.overruns += oldest - self.cursor
+                self.cursor = oldest
+            frame = self.get(self.cursor)
+            self.cursor += 1
+            if frame is not None:
+                return frame
+            self.overruns += 1
+
+    def read_latest(self) -> BusFrame | None:
+        """The newest frame, skipping (without counting) anything unread."""
+        latest = self.latest
+        if latest == 0:
+            return None
+        self.cursor = latest
+        return self.read()
+
+    def close(self) -> None:
+        self.shm.close()
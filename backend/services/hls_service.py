@@ -0,0 +1,624 @@
+import abc
+import asyncio
+import logging
+import math
+import os
+import re
+import struct
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple
+
+import av
+from aiortc.mediastreams import MediaStreamError
+
+from services.encoder_service import EncodedVideoTrack
+from services.metrics_service import registry
+from services.rendition_service import shared_fanout
+from services.source_service import MediaSource
+
+logger = logging.getLogger("hls_service")
+
+HLS_SEGMENT_TARGET = float(os.environ.get("HLS_SEGMENT_TARGET", "2"))  # seconds
+HLS_PART_TARGET = float(os.environ.get("HLS_PART_TARGET", "0.5"))  # seconds
+HLS_WINDOW = int(os.environ.get("HLS_WINDOW", "6"))  # complete segments kept in memory
+HLS_IDLE_TIMEOUT = float(os.environ.get("HLS_IDLE_TIMEOUT", "30"))  # seconds without requests
+# Ladder rung to package; empty picks the highest one.
+HLS_RENDITION = os.environ.get("HLS_RENDITION", "")
+
+PART_WINDOW = 3  # segments at the live edge whose parts are listed
+TIMESCALE = 90000
+
+HLS_PARTS = registry.counter("birdstream_hls_parts_total", "LL-HLS partial segments produced")
+HLS_REQUESTS = registry.counter(
+    "birdstream_hls_requests_total", "LL-HLS requests served", ("kind", "status")
+)
+
+_MEDIA_NAME = re.compile(r"^(init|seg|part)-(\d+)(?:\.(\d+))?\.(mp4|m4s)$")
+
+
+class HlsUnavailableError(Exception):
+    pass
+
+
+class HlsRequestError(Exception):
+    pass
+
+
+# --- fragmented MP4 (CMAF) boxes -------------------------------------------
+
+
+class Sample(NamedTuple):
+    data: bytes  # length-prefixed NAL units
+    duration: int  # in TIMESCALE units
+    keyframe: bool
+
+
+_MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+_SYNC_SAMPLE = 0x02000000  # depends on no other sample
+_NON_SYNC_SAMPLE = 0x01010000  # depends on others, not a sync sample
+
+
+def _box(kind: bytes, *payload: bytes) -> bytes:
+    body = b"".join(payload)
+    return struct.pack(">I", 8 + len(body)) + kind + body
+
+
+def _full_box(kind: bytes, version: int, flags: int, *payload: bytes) -> bytes:
+    return _box(kind, struct.pack(">I", (version << 24) | flags), *payload)
+
+
+def split_annex_b(data: bytes) -> list[bytes]:
+    return [nal.rstrip(b"\x00") for nal in data.split(b"\x00\x00\x01") if nal.strip(b"\x00")]
+
+
+def to_length_prefixed(nals: list[bytes]) -> bytes:
+    # Parameter sets live in the init segment; access unit delimiters are dropped.
+    return b"".join(
+        struct.pack(">I", len(nal)) + nal for nal in nals if nal[0] & 0x1F not in (7, 8, 9)
+    )
+
+
+def init_segment(sps: bytes, pps: bytes, width: int, height: int) -> bytes:
+    avcc = (
+        bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1])
+        + struct.pack(">H", len(sps))
+        + sps
+        + bytes([1])
+        + struct.pack(">H", len(pps))
+        + pps
+    )
+    if sps[1] in (100, 110, 122, 144):
+        avcc += bytes([0xFD, 0xF8, 0xF8, 0])  # 4:2:0, 8 bit
+    avc1 = _box(
+        b"avc1",
+        bytes(6),
+        struct.pack(">H", 1),
+        bytes(16),
+        struct.pack(">HHIIIH", width, height, 0x480000, 0x480000, 0, 1),
+        bytes(32),
+        struct.pack(">Hh", 0x18, -1),
+        _box(b"avcC", avcc),
+    )
+    stbl = _box(
+        b"stbl",
+        _full_box(b"stsd", 0, 0, struct.pack(">I", 1), avc1),
+        _full_box(b"stts", 0, 0, struct.pack(">I", 0)),
+        _full_box(b"stsc", 0, 0, struct.pack(">I", 0)),
+        _full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+        _full_box(b"stco", 0, 0, struct.pack(">I", 0)),
+    )
+    minf = _box(
+        b"minf",
+        _full_box(b"vmhd", 0, 1, bytes(8)),
+        _box(b"dinf", _full_box(b"dref", 0, 0, struct.pack(">I", 1), _full_box(b"url ", 0, 1))),
+        stbl,
+    )
+    mdia = _box(
+        b"mdia",
+        _full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, TIMESCALE, 0, 0x55C4, 0)),
+        _full_box(b"hdlr", 0, 0, bytes(4), b"vide", bytes(12), b"VideoHandler\x00"),
+        minf,
+    )
+    tkhd = _full_box(
+        b"tkhd",
+        0,
+        3,
+        struct.pack(">IIIII", 0, 0, 1, 0, 0),
+        bytes(16),
+        _MATRIX,
+        struct.pack(">II", width << 16, height << 16),
+    )
+    mvhd = _full_box(
+        b"mvhd",
+        0,
+        0,
+        struct.pack(">IIIIIH", 0, 0, 1000, 0, 0x10000, 0x100),
+        bytes(10),
+        _MATRIX,
+        bytes(24),
+        struct.pack(">I", 2),
+    )
+    mvex = _box(b"mvex", _full_box(b"trex", 0, 0, struct.pack(">IIIII", 1, 1, 0, 0, 0)))
+    ftyp = _box(b"ftyp", b"iso6", bytes(4), b"iso6cmfcavc1mp41")
+    return ftyp + _box(b"moov", mvhd, _box(b"trak", tkhd, mdia), mvex)
+
+
+def media_fragment(sequence: int, decode_time: int, samples: list[Sample]) -> bytes:
+    def moof(data_offset: int) -> bytes:
+        trun = _full_box(
+            b"trun",
+            0,
+            0x000701,  # data offset, sample durations, sizes and flags
+            struct.pack(">Ii", len(samples), data_offset),
+            *(
+                struct.pack(
+                    ">III",
+                    s.duration,
+                    len(s.data),
+                    _SYNC_SAMPLE if s.keyframe else _NON_SYNC_SAMPLE,
+                )
+                for s in samples
+            ),
+        )
+        traf = _box(
+            b"traf",
+            _full_box(b"tfhd", 0, 0x020000, struct.pack(">I", 1)),  # default-base-is-moof
+            _full_box(b"tfdt", 1, 0, struct.pack(">Q", decode_time)),
+            trun,
+        )
+        return _box(b"moof", _full_box(b"mfhd", 0, 0, struct.pack(">I", sequence)), traf)
+
+    header_size = len(moof(0)) + 8
+    return moof(header_size) + _box(b"mdat", *(s.data for s in samples))
+
+
+class _BitReader:
+    def __init__(self, data: bytes):
+        self._value = int.from_bytes(data, "big")
+        self._left = len(data) * 8
+
+    def u(self, bits: int) -> int:
+        if bits > self._left:
+            raise ValueError("truncated SPS")
+        self._left -= bits
+        return (self._value >> self._left) & ((1 << bits) - 1)
+
+    def ue(self) -> int:
+        zeros = 0
+        while not self.u(1):
+            zeros += 1
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self) -> int:
+        code = self.ue()
+        return (code + 1) // 2 if code & 1 else -(code // 2)
+
+
+# profile_idc values whose SPS carries chroma format, bit depth and scaling lists
+_HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+
+def sps_dimensions(sps: bytes) -> tuple[int, int]:
+    """Cropped picture size from an H.264 SPS NAL unit (ITU-T H.264 7.3.2.1.1)."""
+    bits = _BitReader(sps[1:].replace(b"\x00\x00\x03", b"\x00\x00"))  # drop emulation prevention
+    profile = bits.u(8)
+    bits.u(16)  # constraint flags, level
+    bits.ue()  # seq_parameter_set_id
+    chroma_format, separate_planes = 1, 0
+    if profile in _HIGH_PROFILES:
+        chroma_format = bits.ue()
+        if chroma_format == 3:
+            separate_planes = bits.u(1)
+        bits.ue(), bits.ue(), bits.u(1)  # bit depths, transform bypass
+        if bits.u(1):  # scaling matrices
+            for i in range(8 if chroma_format != 3 else 12):
+                if bits.u(1):
+                    last = next_scale = 8
+                    for _ in range(16 if i < 6 else 64):
+                        if next_scale:
+                            next_scale = (last + bits.se()) % 256
+                        last = next_scale or last
+    bits.ue()  # log2_max_frame_num_minus4
+    poc_type = bits.ue()
+    if poc_type == 0:
+        bits.ue()
+    elif poc_type == 1:
+        bits.u(1), bits.se(), bits.se()
+        for _ in range(bits.ue()):
+            bits.se()
+    bits.ue(), bits.u(1)  # max_num_ref_frames, gaps allowed
+    width_mbs, height_units = bits.ue() + 1, bits.ue() + 1
+    frame_mbs_only = bits.u(1)
+    if not frame_mbs_only:
+        bits.u(1)  # mb_adaptive_frame_field
+    bits.u(1)  # direct_8x8_inference
+    width, height = width_mbs * 16, (2 - frame_mbs_only) * height_units * 16
+    if bits.u(1):  # frame cropping
+        left, right, top, bottom = bits.ue(), bits.ue(), bits.ue(), bits.ue()
+        if separate_planes or chroma_format == 0:
+            crop_x, crop_y = 1, 2 - frame_mbs_only
+        else:
+            crop_x = 1 if chroma_format == 3 else 2
+            crop_y = (2 if chroma_format == 1 else 1) * (2 - frame_mbs_only)
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+    return width, height
+
+
+# --- fragmenter -------------------------------------------------------------
+
+
+class CmafFragmenter(abc.ABC):
+    """Cuts the shared H.264 packet stream into CMAF segments and fragments.
+
+    A sample's duration is only known once the next packet arrives, so the
+    latest one is held back. A keyframe opens a new segment when none is
+    open, when the parameter sets change, or once the open segment lasts
+    `_min_segment` seconds; the encoder is asked for one when a segment
+    reaches `_segment_target`. Subclasses store what is produced and set the
+    flush policy in `_fragment_full()`.
+    """
+
+    _segment_target: float
+    _min_segment: float
+
+    def _reset_fragmenter(self) -> None:
+        self._params: tuple[bytes, bytes] | None = None
+        self._pending: tuple[Sample, int] | None = None
+        self._samples: list[Sample] = []
+        self._fragment_sequence = 1
+        self._decode_time = 0
+
+    @abc.abstractmethod
+    def _segment_duration(self) -> float | None:
+        """Seconds already fragmented into the open segment; None if none is open."""
+
+    @abc.abstractmethod
+    def _open_segment(self, params: tuple[bytes, bytes], pts: int) -> None:
+        """Close the open segment, if any, and start one at the keyframe at `pts`.
+        `_params` still holds the previous segment's parameter sets."""
+
+    @abc.abstractmethod
+    def _on_fragment(self, data: bytes, samples: list[Sample]) -> None:
+        """Store a fragment of the open segment."""
+
+    @abc.abstractmethod
+    def _fragment_full(self, next_duration: float) -> bool:
+        """Whether the buffered samples are cut into a fragment before a
+        sample of `next_duration` seconds is added, and again after it."""
+
+    def _buffered(self) -> float:
+        return sum(s.duration for s in self._samples) / TIMESCALE
+
+    def _ingest(self, packet: av.Packet, track: EncodedVideoTrack) -> bool:
+        """Add one packet; returns True when a new fragment was produced."""
+        pts = int(packet.pts * packet.time_base * TIMESCALE)
+        published = False
+        if self._pending is not None:
+            sample, sample_pts = self._pending
+            self._pending = None
+            published = self._add_sample(sample._replace(duration=max(pts - sample_pts, 1)))
+
+        nals = split_annex_b(bytes(packet))
+        if packet.is_keyframe:
+            published = self._on_keyframe(nals, pts) or published
+        elapsed = self._segment_duration()
+        if elapsed is None:
+            # Still waiting for a keyframe with parameter sets.
+            return published
+
+        if elapsed + self._buffered() >= self._segment_target:
+            # Ask the encoder for an IDR so segments do not outgrow the target.
+            track.request_keyframe()
+        self._pending = (Sample(to_length_prefixed(nals), 0, packet.is_keyframe), pts)
+        return published
+
+    def _on_keyframe(self, nals: list[bytes], pts: int) -> bool:
+        sps = next((nal for nal in nals if nal[0] & 0x1F == 7), None)
+        pps = next((nal for nal in nals if nal[0] & 0x1F == 8), None)
+        params = (sps, pps) if sps and pps else self._params
+        if params is None:
+            return False
+
+        elapsed = self._segment_duration()
+        if elapsed is not None and params == self._params and elapsed + self._buffered() < self._min_segment:
+            return False
+
+        published = self._flush()
+        self._open_segment(params, pts)
+        self._params = params
+        return published
+
+    def _add_sample(self, sample: Sample) -> bool:
+        published = False
+        duration = sample.duration / TIMESCALE
+        if self._samples and self._fragment_full(duration):
+            published = self._flush()
+        self._samples.append(sample)
+        if self._fragment_full(duration):
+            published = self._flush() or published
+        return published
+
+    def _flush(self) -> bool:
+        if not self._samples or self._segment_duration() is None:
+            return False
+        samples, self._samples = self._samples, []
+        data = media_fragment(self._fragment_sequence, self._decode_time, samples)
+        self._fragment_sequence += 1
+        self._decode_time += sum(s.duration for s in samples)
+        self._on_fragment(data, samples)
+        return True
+
+    def _drain(self) -> bool:
+        """Flush everything, including the held-back sample."""
+        if self._pending is not None:
+            # The last sample has no successor to measure; repeat the previous duration.
+            sample, _ = self._pending
+            self._pending = None
+            last = self._samples[-1].duration if self._samples else TIMESCALE // 30
+            self._samples.append(sample._replace(duration=last))
+        return self._flush()
+
+
+# --- segment window ---------------------------------------------------------
+
+
+class Part(NamedTuple):
+    data: bytes
+    duration: float
+    independent: bool
+
+
+class Segment:
+    def __init__(self, msn: int, init: str):
+        self.msn = msn
+        self.init = init
+        self.program_date_time = datetime.now(timezone.utc)
+        self.parts: list[Part] = []
+        self.complete = False
+
+    @property
+    def duration(self) -> float:
+        return sum(part.duration for part in self.parts)
+
+    @property
+    def data(self) -> bytes:
+        return b"".join(part.data for part in self.parts)
+
+
+def segment_name(msn: int) -> str:
+    return f"seg-{msn}.m4s"
+
+
+def part_name(msn: int, index: int) -> str:
+    return f"part-{msn}.{index}.m4s"
+
+
+class HlsPackager(CmafFragmenter):
+    """Packages the shared H.264 stream into LL-HLS (CMAF) segments and parts.
+
+    Packaging only runs while HLS clients are polling: the first request
+    subscribes to the video fan-out and holds the MediaSource open, and after
+    `idle_timeout` seconds without requests both are released again. Media
+    sequence numbers start from the wall clock, so names never repeat across
+    restarts and every segment URL can be cached as immutable.
+    """
+
+    def __init__(
+        self,
+        source: MediaSource,
+        segment_target: float = HLS_SEGMENT_TARGET,
+        part_target: float = HLS_PART_TARGET,
+        window: int = HLS_WINDOW,
+        idle_timeout: float = HLS_IDLE_TIMEOUT,
+    ):
+        self.source = source
+        self.segment_target = segment_target
+        self._segment_target = segment_target
+        # A keyframe in the first half of a segment does not cut it short.
+        self._min_segment = segment_target / 2
+        self.part_target = part_target
+        self.window = window
+        self.idle_timeout = idle_timeout
+        self.segments: deque[Segment] = deque()
+        self.inits: dict[str, bytes] = {}
+        self._target_duration = math.ceil(segment_target)
+        self._task: asyncio.Task | None = None
+        self._changed = asyncio.Condition()
+        self._last_request = 0.0
+        self._reset()
+
+    def _reset(self) -> None:
+        self.segments.clear()
+        self.inits.clear()
+        self._reset_fragmenter()
+        self._next_msn = int(time.time())
+
+    @property
+    def blocking_timeout(self) -> float:
+        return 3 * self.segment_target
+
+    def touch(self) -> None:
+        self._last_request = time.monotonic()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        track: EncodedVideoTrack | None = None
+        self.source.retain()
+        try:
+            _, video = await self.source.acquire()
+            fanout = shared_fanout(video, HLS_RENDITION)
+            if fanout is None:
+                logger.warning("LL-HLS needs the shared encoder pipeline (VIDEO_ENCODER_MODE=shared)")
+                return
+            track = fanout.subscribe()
+            logger.info("LL-HLS packaging started")
+            while time.monotonic() - self._last_request < self.idle_timeout:
+                packet = await track.recv()
+                if self._ingest(packet, track):
+                    async with self._changed:
+                        self._changed.notify_all()
+            logger.info(f"No LL-HLS requests for {self.idle_timeout:.0f}s, packaging stopped")
+        except MediaStreamError:
+            logger.warning("LL-HLS source ended")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("LL-HLS packaging crashed")
+        finally:
+            if track is not None:
+                track.stop()
+            self._reset()
+            self._task = None
+            self.source.release()
+            async with self._changed:
+                self._changed.notify_all()
+
+    def _segment_duration(self) -> float | None:
+        return self.segments[-1].duration if self.segments else None
+
+    def _open_segment(self, params: tuple[bytes, bytes], pts: int) -> None:
+        if self.segments:
+            self._complete(self.segments[-1])
+        init = self._init_name(params)
+        self.segments.append(Segment(self._next_msn, init))
+        self._next_msn += 1
+
+    def _init_name(self, params: tuple[bytes, bytes]) -> str:
+        if params == self._params and self.segments:
+            return self.segments[-1].init
+        name = f"init-{self._next_msn}.mp4"
+        width, height = sps_dimensions(params[0])
+        self.inits[name] = init_segment(params[0], params[1], width, height)
+        logger.info(f"LL-HLS init segment {name} ({width}x{height})")
+        return name
+
+    def _fragment_full(self, next_duration: float) -> bool:
+        # Parts must not exceed PART-TARGET, so one is published as soon as
+        # one more sample of this length would not fit.
+        return self._buffered() + next_duration > self.part_target
+
+    def _on_fragment(self, data: bytes, samples: list[Sample]) -> None:
+        duration = sum(s.duration for s in samples) / TIMESCALE
+        self.segments[-1].parts.append(Part(data, duration, samples[0].keyframe))
+        HLS_PARTS.inc()
+
+    def _complete(self, segment: Segment) -> None:
+        segment.complete = True
+        rounded = math.floor(segment.duration + 0.5)
+        if rounded > self._target_duration:
+            logger.warning(f"LL-HLS segment of {segment.duration:.2f}s exceeds the target duration")
+            self._target_duration = rounded
+        while sum(s.complete for s in self.segments) > self.window:
+            self.segments.popleft()
+        referenced = {s.init for s in self.segments}
+        for name in [name for name in self.inits if name not in referenced]:
+            del self.inits[name]
+
+    # --- request side -------------------------------------------------------
+
+    async def _wait(self, resolved: Callable[[], bool]) -> None:
+        """Block until `resolved()` holds; HlsUnavailableError on timeout or
+        when packaging is not running."""
+        self.touch()
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: resolved() or self._task is None),
+                    self.blocking_timeout,
+                )
+            except asyncio.TimeoutError:
+                pass
+            if not resolved():
+                raise HlsUnavailableError()
+
+    def _has_part(self, msn: int, part: int | None) -> bool:
+        if not self.segments or not self.segments[0].parts:
+            return False
+        last = self.segments[-1]
+        if msn < last.msn:
+            return True
+        if part is None:
+            return msn == last.msn and last.complete
+        return msn == last.msn and part < len(last.parts)
+
+    async def playlist(self, msn: int | None = None, part: int | None = None) -> str:
+        if msn is None:
+            await self._wait(lambda: bool(self.segments and self.segments[0].parts))
+        else:
+            if self.segments and msn > self.segments[-1].msn + 2:
+                raise HlsRequestError("_HLS_msn is too far in the future")
+            await self._wait(lambda: self._has_part(msn, part))
+        return self.render_playlist()
+
+    def render_playlist(self) -> str:
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:9",
+            f"#EXT-X-TARGETDURATION:{self._target_duration}",
+            f"#EXT-X-PART-INF:PART-TARGET={self.part_target:.3f}",
+            f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * self.part_target:.3f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self.segments[0].msn}",
+        ]
+        init = None
+        parts_from = self.segments[-1].msn - PART_WINDOW + 1
+        for segment in self.segments:
+            if not segment.parts:
+                continue
+            if segment.init != init:
+                init = segment.init
+                lines.append(f'#EXT-X-MAP:URI="{init}"')
+            pdt = segment.program_date_time.isoformat(timespec="milliseconds")
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{pdt}")
+            if segment.msn >= parts_from:
+                for index, part in enumerate(segment.parts):
+                    independent = ",INDEPENDENT=YES" if part.independent else ""
+                    lines.append(
+                        f'#EXT-X-PART:DURATION={part.duration:.5f},'
+                        f'URI="{part_name(segment.msn, index)}"{independent}'
+                    )
+            if segment.complete:
+                lines.append(f"#EXTINF:{segment.duration:.5f},")
+                lines.append(segment_name(segment.msn))
+        last = self.segments[-1]
+        lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{part_name(last.msn, len(last.parts))}"')
+        return "\n".join(lines) + "\n"
+
+    def _find(self, msn: int, part: int | None) -> tuple[bool, bytes | None]:
+        """(resolved, data) for a segment or part; resolved with no data is a 404."""
+        if not self.segments or not self.segments[0].parts:
+            return False, None
+        first, last = self.segments[0], self.segments[-1]
+        if msn < first.msn or msn > last.msn + 1:
+            return True, None
+        if msn == last.msn + 1:
+            return False, None
+        segment = self.segments[msn - first.msn]
+        if part is None:
+            return segment.complete, segment.data if segment.complete else None
+        if part < len(segment.parts):
+            return True, segment.parts[part].data
+        return segment.complete, None
+
+    async def media(self, name: str) -> bytes | None:
+        """Init segment, segment or part by URI; blocks for ones not yet produced."""
+        match = _MEDIA_NAME.match(name)
+        if match is None:
+            return None
+        kind, number, index, extension = match.groups()
+        if kind == "init":
+            self.touch()
+            return self.inits.get(name) if extension == "mp4" else None
+        if extension != "m4s" or (kind == "part") != (index is not None):
+            return None
+        msn, part = int(number), int(index) if index is not None else None
+        await self._wait(lambda: self._find(msn, part)[0])
+        return self._find(msn, part)[1]
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
@@ -0,0 +1,171 @@
+import asyncio
+import fractions
+import logging
+import struct
+import time
+
+import av
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import VIDEO_TIME_BASE, MediaStreamError
+
+from services.camera_service import Camera, CameraConfig
+from services.cluster_service import camera_socket, prepare_socket_path
+from services.encoder_service import PassthroughFanout
+from services.metrics_service import registry
+from services.rendition_service import shared_fanout
+from services.source_service import Media
+
+logger = logging.getLogger("packet_relay_service")
+
+# pts, time base numerator and denominator, flags, payload size
+_PACKET = struct.Struct("<qIIBI")
+_KEYFRAME = 1
+KEYFRAME_REQUEST = b"K"
+CONNECT_TIMEOUT = 10.0  # seconds a worker keeps retrying while the primary starts
+
+RELAY_WORKERS = registry.gauge(
+    "birdstream_packet_relay_workers",
+    "Workers receiving a camera's encoded stream from the primary",
+    ("camera",),
+)
+
+
+class PacketRelayServer:
+    """Serves one camera's shared H.264 stream to the other workers (primary only).
+
+    Each connected worker holds the camera's MediaSource like a viewer and
+    receives the fan-out's packets, GOP cache first, framed on a Unix socket;
+    a KEYFRAME_REQUEST byte from the worker is passed on to the encoder. The
+    camera is thus captured and encoded once, and the other workers only
+    packetize and encrypt for their own peers.
+    """
+
+    def __init__(self, camera: Camera, path: str | None = None):
+        self.camera = camera
+        self.path = path or camera_socket(camera.id)
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        prepare_socket_path(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, self.path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        source = self.camera.source
+        source.retain()
+        track = None
+        feedback = None
+        RELAY_WORKERS.inc(camera=self.camera.id)
+        try:
+            _, video = await source.acquire()
+            fanout = shared_fanout(video)
+            if fanout is None:
+                logger.error(f"Camera {self.camera.id} has no shared encoder to relay (per-peer mode)")
+                return
+            track = fanout.subscribe()
+            feedback = asyncio.create_task(self._feedback(reader, fanout, task))
+            logger.info(f"Relaying camera {self.camera.id} to a worker")
+            while True:
+                packet = await track.recv()
+                time_base = packet.time_base or VIDEO_TIME_BASE
+                data = bytes(packet)
+                writer.write(
+                    _PACKET.pack(
+                        packet.pts or 0,
+                        time_base.numerator,
+                        time_base.denominator,
+                        _KEYFRAME if packet.is_keyframe else 0,
+                        len(data),
+                    )
+                    + data
+                )
+                await writer.drain()
+        except (MediaStreamError, ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception:
+            logger.exception(f"Relay of camera {self.camera.id} crashed")
+        finally:
+            RELAY_WORKERS.dec(camera=self.camera.id)
+            if feedback is not None:
+                feedback.cancel()
+            if track is not None:
+                track.stop()
+            writer.close()
+            source.release()
+            self._connections.discard(task)
+
+    @staticmethod
+    async def _feedback(reader: asyncio.StreamReader, fanout, serving: asyncio.Task) -> None:
+        while chunk := await reader.read(64):
+            if KEYFRAME_REQUEST in chunk:
+                fanout.request_keyframe()
+        # The worker hung up; don't wait for the next packet to notice.
+        serving.cancel()
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+
+class RemotePacketTrack(MediaStreamTrack):
+    """A camera's encoded stream as relayed by the primary's PacketRelayServer."""
+
+    kind = "video"
+    passthrough = True
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def _connect(self) -> None:
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                return
+            except OSError as e:
+                if time.monotonic() > deadline:
+                    logger.error(f"Primary relay {self.path} unreachable: {e}")
+                    self.stop()
+                    raise MediaStreamError from e
+                await asyncio.sleep(0.25)
+
+    async def recv(self) -> av.Packet:
+        if self.readyState != "live":
+            raise MediaStreamError
+        if self._reader is None:
+            await self._connect()
+        try:
+            pts, numerator, denominator, flags, size = _PACKET.unpack(
+                await self._reader.readexactly(_PACKET.size)
+            )
+            data = await self._reader.readexactly(size)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.stop()
+            raise MediaStreamError from e
+        packet = av.Packet(data)
+        packet.pts = pts
+        packet.time_base = fractions.Fraction(numerator, denominator)
+        packet.is_keyframe = bool(flags & _KEYFRAME)
+        return packet
+
+    def request_keyframe(self) -> None:
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(KEYFRAME_REQUEST)
+
+    def stop(self) -> None:
+        super().stop()
+        if self._writer is not None:
+            self._writer.close()
+
+
+def open_remote_media(config: CameraConfig) -> Media:
+    return None, PassthroughFanout(RemotePacketTrack(camera_socket(config.id)))
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from types import FrameType
+
+from services.metrics_service import registry
+
+logger = logging.getLogger("profiling_service")
+
+# Seconds between event loop heartbeats; lag is how late each one runs.
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.1"))
+# A loop blocked longer than this is logged with the stack that holds it.
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", "0.25"))
+STALL_STACK_DEPTH = 12  # innermost frames logged for a stall
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_MAX_HZ = 1000
+
+LOOP_LAG = registry.histogram(
+    "birdstream_event_loop_lag_seconds",
+    "How late event loop heartbeats ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LOOP_STALLS = registry.counter(
+    "birdstream_event_loop_stalls_total", "Times the event loop was blocked longer than LOOP_STALL_THRESHOLD"
+)
+
+
+class ProfileInProgressError(Exception):
+    pass
+
+
+class LoopMonitor:
+    """Measures event loop lag and reports what blocks the loop.
+
+    A heartbeat task records how late it wakes up. A watchdog thread notices
+    when heartbeats stop for longer than `threshold` and logs the loop
+    thread's stack while it is still blocked, so the log names the callback
+    holding the loop (a blocking read, a synchronous query) rather than
+    whichever one happened to run next.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._last_beat = time.monotonic()
+        self._stalled_since: float | None = None
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG.observe(max(now - expected, 0.0))
+            self._last_beat = now
+            stalled_since = self._stalled_since
+            if stalled_since is not None:
+                self._stalled_since = None
+                logger.warning(f"Event loop unblocked after {(now - stalled_since) * 1000:.0f} ms")
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(min(self.interval, self.threshold) / 2):
+            blocked = time.monotonic() - self._last_beat - self.interval
+            if blocked < self.threshold or self._stalled_since is not None:
+                continue
+            self._stalled_since = self._last_beat + self.interval
+            LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)[-STALL_STACK_DEPTH:]) if frame else ""
+            logger.warning(f"Event loop blocked for {blocked * 1000:.0f} ms so far, in:\n{stack}")
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+
+def _short_path(filename: str) -> str:
+    # Paths relative to the longest sys.path entry: "aiortc/rtcrtpsender.py".
+    prefixes = [p for p in sys.path if p and filename.startswith(p.rstrip("/") + "/")]
+    return filename[len(max(prefixes, key=len).rstrip("/")) + 1:] if prefixes else filename
+
+
+def _frame_label(frame: FrameType, labels: dict) -> str:
+    code = frame.f_code
+    label = labels.get(code)
+    if label is None:
+        label = labels[code] = f"{code.co_qualname} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def sample_stacks(seconds: float, hz: int) -> str:
+    """Samples every thread's stack `hz` times a second for `seconds`.
+
+    Blocking; returns collapsed stacks ("thread;outer;...;inner count" per
+    line) as read by flamegraph.pl, speedscope and inferno.
+    """
+    me = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    labels: dict = {}
+    counts: Counter[str] = Counter()
+    period = 1 / hz
+    deadline = time.monotonic() + seconds
+    next_sample = time.monotonic()
+    while next_sample < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if ident not in names:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame, labels))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}").replace(";", ":").replace(" ", "_"))
+            counts[";".join(reversed(stack))] += 1
+        next_sample += period
+        time.sleep(max(next_sample - time.monotonic(), 0))
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+_profile_lock = asyncio.Lock()
+
+
+async def profile(seconds: float, hz: int) -> str:
+    """Samples this process for `seconds` without blocking the event loop;
+    ProfileInProgressError while another profile runs."""
+    if _profile_lock.locked():
+        raise ProfileInProgressError()
+    async with _profile_lock:
+        logger.info(f"Profiling for {seconds} s at {hz} Hz")
+        return await asyncio.to_thread(sample_stacks, seconds, hz)
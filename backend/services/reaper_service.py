@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+import resource
+
+from aiortc import RTCPeerConnection
+
+from services.connection_manager import ConnectionManager
+from services.metrics_service import registry
+
+logger = logging.getLogger("reaper_service")
+
+# Seconds between sweeps.
+PEER_REAP_INTERVAL = float(os.environ.get("PEER_REAP_INTERVAL", "5"))
+# Seconds a peer may stay in a connection state before it is closed. Clients
+# that vanish mid-negotiation never reach an ending state, so nothing else
+# would release their ports and encoder subscriptions. aiortc has no
+# "disconnected" state: a connected peer whose client went away fails once
+# ICE consent has gone unanswered for WEBRTC_ICE_RESTART_GRACE.
+PEER_STATE_DEADLINES = {
+    "new": float(os.environ.get("PEER_NEW_TIMEOUT", "30")),
+    "connecting": float(os.environ.get("PEER_CONNECTING_TIMEOUT", "30")),
+    # Ended peers are removed by their state change handler unless it failed.
+    "failed": 5.0,
+    "closed": 5.0,
+}
+
+PEERS_REAPED = registry.counter(
+    "birdstream_peers_reaped_total", "Peers closed for staying in a connection state too long", ("state",)
+)
+SOCKETS_REAPED = registry.counter(
+    "birdstream_reaped_udp_sockets_total", "ICE UDP sockets released by closing reaped peers"
+)
+PROCESS_RSS = registry.gauge("birdstream_process_resident_memory_bytes", "Resident memory, as of the last sweep")
+PROCESS_FDS = registry.gauge("birdstream_process_open_fds", "Open file descriptors, as of the last sweep")
+
+_PAGE_SIZE = resource.getpagesize()
+
+
+def _udp_sockets(pc: RTCPeerConnection) -> int:
+    # Each transport's ICE connection owns one socket per gathered host address.
+    gatherers = {}
+    for transceiver in pc.getTransceivers():
+        if transceiver.sender.transport is not None:
+            gatherer = transceiver.sender.transport.transport.iceGatherer
+            gatherers[id(gatherer)] = gatherer
+    return sum(
+        1
+        for gatherer in gatherers.values()
+        for protocol in gatherer._connection._protocols
+        if protocol.transport.get_extra_info("socket") is not None  # not the shared UDP mux
+    )
+
+
+def _record_process_usage() -> None:
+    try:
+        with open("/proc/self/statm") as statm:
+            PROCESS_RSS.set(int(statm.read().split()[1]) * _PAGE_SIZE)
+        PROCESS_FDS.set(len(os.listdir("/proc/self/fd")))
+    except OSError:
+        pass  # not Linux
+
+
+class PeerReaper:
+    """Closes peers stuck in a connection state past its deadline.
+
+    State entry times come from the ConnectionManager's state index, so a
+    sweep only looks at peers in the states that have deadlines. Connected
+    peers are left to ICE consent freshness, which fails them once the
+    client stops answering.
+    """
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        deadlines: dict[str, float] = PEER_STATE_DEADLINES,
+        interval: float = PEER_REAP_INTERVAL,
+    ):
+        self.manager = manager
+        self.deadlines = deadlines
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def sweep(self) -> int:
+        """Runs one sweep; the number of peers reaped."""
+        reaped = 0
+        for peer_id, pc, state in self.manager.overdue(self.deadlines):
+            sockets = _udp_sockets(pc)
+            logger.info(f"Reaping peer {peer_id}: {state} for over {self.deadlines[state]:.0f} s")
+            try:
+                await self.manager.remove_peer(peer_id, pc)
+            except Exception:
+                logger.exception(f"Error reaping peer {peer_id}")
+                continue
+            reaped += 1
+            PEERS_REAPED.inc(state=state)
+            SOCKETS_REAPED.inc(sockets)
+        _record_process_usage()
+        return reaped
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Reaping peers failed")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,392 @@
+import asyncio
+import bisect
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import av
+from aiortc.mediastreams import MediaStreamError
+
+from services.encoder_service import EncodedVideoTrack
+from services.hls_service import TIMESCALE, CmafFragmenter, Sample, init_segment, sps_dimensions
+from services.metrics_service import registry
+from services.rendition_service import shared_fanout
+from services.source_service import MediaSource
+
+logger = logging.getLogger("recording_service")
+
+# Directory for the rolling recording; empty disables it. While recording,
+# capture is never suspended.
+RECORDING_DIR = os.environ.get("RECORDING_DIR", "")
+RECORDING_SEGMENT_SECONDS = float(os.environ.get("RECORDING_SEGMENT_SECONDS", "60"))
+RECORDING_FLUSH_SECONDS = float(os.environ.get("RECORDING_FLUSH_SECONDS", "2"))  # media per disk write
+RECORDING_RETENTION_HOURS = float(os.environ.get("RECORDING_RETENTION_HOURS", "24"))
+RECORDING_MAX_BYTES = int(float(os.environ.get("RECORDING_MAX_GB", "20")) * 1_000_000_000)
+# Ladder rung to record; empty picks the highest one.
+RECORDING_RENDITION = os.environ.get("RECORDING_RENDITION", "")
+RECORDING_MAX_CLIP_SECONDS = 600
+RECORDING_RESTART_DELAY = 1.0  # seconds before resubscribing after the source ends
+INDEX_FILE = "index.tsv"
+
+RECORDING_BYTES = registry.gauge("birdstream_recording_bytes", "Bytes of recorded segments on disk")
+RECORDING_SEGMENTS = registry.gauge("birdstream_recording_segments", "Recorded segments on disk")
+RECORDING_PENDING_WRITES = registry.gauge(
+    "birdstream_recording_pending_writes", "Recording disk writes queued behind the writer thread"
+)
+RECORDING_CLIPS = registry.counter("birdstream_recording_clips_total", "Clips exported")
+
+
+class RecordedSegment(NamedTuple):
+    start: float  # wall clock of the first sample
+    duration: float  # seconds
+    size: int  # bytes
+    name: str
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration
+
+
+class SegmentIndex:
+    """Completed segments in time order, persisted as one short TSV line each."""
+
+    def __init__(self, segments: list[RecordedSegment] | None = None):
+        self.segments = sorted(segments or [])
+        self._starts = [s.start for s in self.segments]
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(s.size for s in self.segments)
+
+    def append(self, segment: RecordedSegment) -> None:
+        index = bisect.bisect(self._starts, segment.start)
+        self.segments.insert(index, segment)
+        self._starts.insert(index, segment.start)
+
+    def between(self, start: float, end: float) -> list[RecordedSegment]:
+        """Segments overlapping [start, end)."""
+        first = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        last = bisect.bisect_left(self._starts, end)
+        return [s for s in self.segments[first:last] if s.end > start]
+
+    def prune(self, now: float, max_age: float, max_bytes: int) -> list[RecordedSegment]:
+        """Drop the oldest segments until both limits hold; returns them."""
+        total = self.total_bytes
+        count = 0
+        for segment in self.segments:
+            if segment.end >= now - max_age and total <= max_bytes:
+                break
+            total -= segment.size
+            count += 1
+        removed = self.segments[:count]
+        del self.segments[:count]
+        del self._starts[:count]
+        return removed
+
+    @staticmethod
+    def format(segment: RecordedSegment) -> str:
+        return f"{segment.start:.3f}\t{segment.duration:.3f}\t{segment.size}\t{segment.name}\n"
+
+    @classmethod
+    def load(cls, path: Path) -> "SegmentIndex":
+        segments = []
+        if path.exists():
+            for line in path.read_text().splitlines():
+                try:
+                    start, duration, size, name = line.split("\t")
+                    segments.append(RecordedSegment(float(start), float(duration), int(size), name))
+                except ValueError:
+                    logger.warning(f"Skipping malformed recording index line {line!r}")
+        return cls(segments)
+
+    def dump(self, path: Path) -> None:
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text("".join(self.format(s) for s in self.segments))
+        os.replace(tmp, path)
+
+
+def _probe_duration(path: Path) -> float:
+    """Length of a (possibly truncated) recording, from its packet timestamps."""
+    end = 0.0
+    try:
+        with av.open(str(path)) as container:
+            stream = container.streams.video[0]
+            for packet in container.demux(stream):
+                if packet.pts is not None:
+                    end = max(end, float((packet.pts + (packet.duration or 0)) * stream.time_base))
+    except av.FFmpegError:
+        pass
+    return end
+
+
+def remux_clip(directory: Path, segments: list[RecordedSegment], start: float, end: float, output: Path) -> int:
+    """Copy the packets covering [start, end) from `segments` into one MP4.
+
+    The clip starts at the last keyframe at or before `start`; nothing is
+    decoded. Returns the number of packets written.
+    """
+    written = 0
+    with av.open(str(output), "w", format="mp4") as out:
+        out_stream = None
+        origin: float | None = None
+        last_pts = -1
+        lead_in: list[tuple[av.Packet, float]] = []
+        for segment in segments:
+            try:
+                container = av.open(str(directory / segment.name))
+            except (av.FFmpegError, OSError) as e:
+                logger.warning(f"Skipping unreadable recording {segment.name}: {e}")
+                continue
+            with container:
+                stream = container.streams.video[0]
+                if out_stream is None:
+                    out_stream = out.add_stream_from_template(stream)
+                try:
+                    for packet in container.demux(stream):
+                        if packet.pts is None:
+                            continue
+                        at = segment.start + float(packet.pts * stream.time_base)
+                        if at >= end:
+                            break
+                        if origin is None:
+                            # Hold back everything from the latest keyframe
+                            # until `start` is reached.
+                            if packet.is_keyframe:
+                                lead_in = []
+                            if lead_in or packet.is_keyframe:
+                                lead_in.append((packet, at))
+                            if at < start or not lead_in:
+                                continue
+                            origin = lead_in[0][1]
+                            queued, lead_in = lead_in, []
+                        else:
+                            queued = [(packet, at)]
+                        for queued_packet, queued_at in queued:
+                            # Segments from separate sessions may overlap by a tick.
+                            last_pts = max(round((queued_at - origin) / out_stream.time_base), last_pts + 1)
+                            queued_packet.stream = out_stream
+                            queued_packet.pts = queued_packet.dts = last_pts
+                            out.mux(queued_packet)
+                            written += 1
+                except av.FFmpegError:
+                    # The segment still being written may end mid-fragment.
+                    pass
+    return written
+
+
+class Recorder(CmafFragmenter):
+    """Rolling recording of the shared H.264 stream as fragmented MP4 files.
+
+    Packets are copied into RECORDING_SEGMENT_SECONDS files (cut at
+    keyframes, one init segment each) without re-encoding. Samples are
+    buffered and appended as one fragment every RECORDING_FLUSH_SECONDS by a
+    single writer thread, which also maintains the index and deletes
+    segments beyond the retention limits.
+    """
+
+    def __init__(
+        self,
+        source: MediaSource,
+        directory: str = RECORDING_DIR,
+        segment_seconds: float = RECORDING_SEGMENT_SECONDS,
+        flush_seconds: float = RECORDING_FLUSH_SECONDS,
+        retention_hours: float = RECORDING_RETENTION_HOURS,
+        max_bytes: int = RECORDING_MAX_BYTES,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.source = source
+        self.directory = Path(directory) if directory else None
+        self.segment_seconds = segment_seconds
+        self._segment_target = self._min_segment = segment_seconds
+        self.flush_seconds = flush_seconds
+        self.max_age = retention_hours * 3600
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.index = SegmentIndex()
+        self.current: RecordedSegment | None = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recording-writer")
+        self._writes: set[Future] = set()
+        self._task: asyncio.Task | None = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._origin: tuple[float, int] | None = None  # (wall clock, pts) of the first packet
+        self._reset_fragmenter()
+        self.current = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    # --- writer thread ---------------------------------------------------------
+
+    def _submit(self, fn: Callable, *args) -> None:
+        future = self._writer.submit(fn, *args)
+        self._writes.add(future)
+        RECORDING_PENDING_WRITES.set(len(self._writes))
+
+        def done(f: Future) -> None:
+            self._writes.discard(f)
+            RECORDING_PENDING_WRITES.set(len(self._writes))
+            if f.exception() is not None:
+                logger.error(f"Recording write failed: {f.exception()}")
+
+        future.add_done_callback(done)
+
+    def _append(self, name: str, data: bytes) -> None:
+        with open(self.directory / name, "ab") as file:
+            file.write(data)
+
+    def _append_index(self, segment: RecordedSegment) -> None:
+        with open(self.directory / INDEX_FILE, "a") as file:
+            file.write(SegmentIndex.format(segment))
+
+    def _remove(self, removed: list[RecordedSegment], remaining: SegmentIndex) -> None:
+        for segment in removed:
+            (self.directory / segment.name).unlink(missing_ok=True)
+        remaining.dump(self.directory / INDEX_FILE)
+
+    def _load(self) -> SegmentIndex:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index = SegmentIndex.load(self.directory / INDEX_FILE)
+        index = SegmentIndex([s for s in index.segments if (self.directory / s.name).exists()])
+        # A segment that was still open when the process stopped has no
+        # index line yet; its flushed fragments are still playable.
+        known = {s.name for s in index.segments}
+        for path in sorted(self.directory.glob("*.mp4")):
+            if path.name not in known and path.stem.isdigit():
+                duration = _probe_duration(path)
+                if duration > 0:
+                    index.append(RecordedSegment(int(path.stem) / 1000, duration, path.stat().st_size, path.name))
+                else:
+                    path.unlink()
+        index.dump(self.directory / INDEX_FILE)
+        return index
+
+    # --- ingest ------------------------------------------------------------------
+
+    async def start(self) -> None:
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        self.index = await loop.run_in_executor(self._writer, self._load)
+        self._update_gauges()
+        self.source.retain()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Recording to {self.directory} ({len(self.index.segments)} segments kept)")
+
+    async def _run(self) -> None:
+        while True:
+            track: EncodedVideoTrack | None = None
+            try:
+                _, video = await self.source.acquire()
+                fanout = shared_fanout(video, RECORDING_RENDITION)
+                if fanout is None:
+                    logger.warning("Recording needs the shared encoder pipeline (VIDEO_ENCODER_MODE=shared)")
+                    return
+                track = fanout.subscribe()
+                while True:
+                    self._ingest(await track.recv(), track)
+            except MediaStreamError:
+                logger.warning("Recording source ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Recording crashed")
+            finally:
+                if track is not None:
+                    track.stop()
+                self._finish_segment()
+                self._reset()
+            await asyncio.sleep(RECORDING_RESTART_DELAY)
+
+    def _ingest(self, packet: av.Packet, track: EncodedVideoTrack) -> bool:
+        if self._origin is None:
+            self._origin = (self.clock(), int(packet.pts * packet.time_base * TIMESCALE))
+        return super()._ingest(packet, track)
+
+    def _segment_duration(self) -> float | None:
+        return self.current.duration if self.current is not None else None
+
+    def _open_segment(self, params: tuple[bytes, bytes], pts: int) -> None:
+        self._finish_segment()
+        # Every segment is a standalone file with its own timeline.
+        self._fragment_sequence = 1
+        self._decode_time = 0
+        origin_wall, origin_pts = self._origin
+        start = origin_wall + (pts - origin_pts) / TIMESCALE
+        name = f"{int(start * 1000)}.mp4"
+        width, height = sps_dimensions(params[0])
+        init = init_segment(params[0], params[1], width, height)
+        self.current = RecordedSegment(start, 0.0, len(init), name)
+        self._submit(self._append, name, init)
+
+    def _fragment_full(self, next_duration: float) -> bool:
+        return self._buffered() >= self.flush_seconds
+
+    def _on_fragment(self, data: bytes, samples: list[Sample]) -> None:
+        self.current = self.current._replace(
+            duration=self._decode_time / TIMESCALE, size=self.current.size + len(data)
+        )
+        self._submit(self._append, self.current.name, data)
+
+    def _finish_segment(self) -> None:
+        if self.current is None:
+            return
+        self._drain()
+        segment, self.current = self.current, None
+        if segment.duration <= 0:
+            return
+        self.index.append(segment)
+        self._submit(self._append_index, segment)
+
+        removed = self.index.prune(self.clock(), self.max_age, self.max_bytes)
+        if removed:
+            remaining = SegmentIndex(list(self.index.segments))
+            self._submit(self._remove, removed, remaining)
+            logger.info(f"Recording retention removed {len(removed)} segment(s)")
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        RECORDING_BYTES.set(self.index.total_bytes)
+        RECORDING_SEGMENTS.set(len(self.index.segments))
+
+    # --- export ------------------------------------------------------------------
+
+    def segments_between(self, start: float, end: float) -> list[RecordedSegment]:
+        segments = self.index.between(start, end)
+        current = self.current
+        if current is not None and current.duration > 0 and current.start < end and current.end > start:
+            segments.append(current)
+        return segments
+
+    async def export_clip(self, start: float, end: float) -> Path | None:
+        """Remux [start, end) into a temporary MP4 the caller must delete;
+        None when nothing was recorded in that range."""
+        segments = self.segments_between(start, end)
+        if not segments:
+            return None
+        fd, name = tempfile.mkstemp(prefix="clip-", suffix=".mp4")
+        os.close(fd)
+        path = Path(name)
+        written = await asyncio.get_running_loop().run_in_executor(
+            None, remux_clip, self.directory, segments, start, end, path
+        )
+        if not written:
+            path.unlink(missing_ok=True)
+            return None
+        RECORDING_CLIPS.inc()
+        return path
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self.source.release()
+        # Let queued writes land before the process exits.
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.shutdown)
@@ -0,0 +1,306 @@
+import logging
+import os
+import time
+from typing import Callable, NamedTuple
+
+import av
+from aiortc import MediaStreamTrack
+from aiortc.contrib.media import MediaRelay
+from aiortc.mediastreams import MediaStreamError
+from aiortc.rtcrtpsender import RTCRtpSender
+from aiortc.rtp import (
+    RTCP_PSFB_APP,
+    RtcpPsfbPacket,
+    RtcpRrPacket,
+    RtcpSrPacket,
+    unpack_remb_fci,
+)
+
+from services.encoder_service import (
+    EncodedVideoTrack,
+    EncodingFanout,
+    PassthroughFanout,
+    VideoFanout,
+    sender_hooks,
+)
+from services.metrics_service import registry
+
+logger = logging.getLogger("rendition_service")
+
+
+class Rendition(NamedTuple):
+    name: str
+    height: int
+    bitrate: int
+
+
+RENDITIONS = {
+    "1080p": Rendition("1080p", 1080, 4_500_000),
+    "720p": Rendition("720p", 720, 2_500_000),
+    "480p": Rendition("480p", 480, 1_200_000),
+    "360p": Rendition("360p", 360, 600_000),
+    "240p": Rendition("240p", 240, 300_000),
+}
+
+# Comma-separated names from RENDITIONS; empty disables the ladder.
+VIDEO_RENDITIONS = os.environ.get("VIDEO_RENDITIONS", "1080p,720p,360p")
+
+INITIAL_ESTIMATE = 1_200_000  # bps assumed before the first REMB arrives
+BANDWIDTH_HEADROOM = 0.85  # only use this share of the estimate
+LOSS_DOWNSWITCH = 0.10  # fraction lost in a receiver report that forces a step down
+LOSS_UPSWITCH = 0.02  # fraction lost that counts as a clean report
+UPSWITCH_HOLD = 8.0  # seconds of clean reports before stepping up
+SWITCH_COOLDOWN = 2.0  # seconds between any two switches
+
+RENDITION_VIEWERS = registry.gauge(
+    "birdstream_rendition_viewers", "WebRTC viewers per rendition", ("rendition",)
+)
+RENDITION_SWITCHES = registry.counter(
+    "birdstream_rendition_switches_total", "Rendition switches", ("direction",)
+)
+
+
+def parse_renditions(spec: str) -> list[Rendition]:
+    renditions = []
+    for name in filter(None, (part.strip() for part in spec.split(","))):
+        if name not in RENDITIONS:
+            raise ValueError(f"Unknown rendition {name!r}; expected one of {', '.join(RENDITIONS)}")
+        renditions.append(RENDITIONS[name])
+    return sorted(renditions, key=lambda r: r.height, reverse=True)
+
+
+class RenditionSelector:
+    """Chooses a rung for one peer from its REMB estimates and receiver reports.
+
+    Steps down immediately on heavy loss or when the estimate no longer covers
+    the current rung; steps up one rung at a time after a stable period.
+    """
+
+    def __init__(self, renditions: list[Rendition], clock: Callable[[], float] = time.monotonic):
+        self.renditions = renditions  # highest first
+        self.clock = clock
+        self.estimate = INITIAL_ESTIMATE
+        self._has_estimate = False
+        self._clean_since = clock()
+        self._last_switch = float("-inf")
+        self.index = self._best_index_for(self.estimate)
+
+    @property
+    def rendition(self) -> Rendition:
+        return self.renditions[self.index]
+
+    def set_renditions(self, renditions: list[Rendition]) -> None:
+        """Replace the rungs (the ladder learnt the source height), keeping
+        the tallest rung that is not above the current one."""
+        height = self.rendition.height
+        self.renditions = renditions
+        self.index = next(
+            (i for i, r in enumerate(renditions) if r.height <= height), len(renditions) - 1
+        )
+
+    def _best_index_for(self, estimate: int) -> int:
+        budget = estimate * BANDWIDTH_HEADROOM
+        for index, rendition in enumerate(self.renditions):
+            if rendition.bitrate <= budget:
+                return index
+        return len(self.renditions) - 1
+
+    def on_estimate(self, bitrate: int) -> Rendition | None:
+        self.estimate = bitrate
+        self._has_estimate = True
+        return self._decide(loss=None)
+
+    def on_loss(self, fraction_lost: float) -> Rendition | None:
+        return self._decide(loss=fraction_lost)
+
+    def _decide(self, loss: float | None) -> Rendition | None:
+        now = self.clock()
+        if loss is not None and loss > LOSS_UPSWITCH:
+            self._clean_since = now
+
+        # Without REMB the initial estimate is only a starting guess, so clean
+        # receiver reports may climb all the way up.
+        ceiling = self._best_index_for(self.estimate) if self._has_estimate else 0
+        target = self.index
+        if loss is not None and loss >= LOSS_DOWNSWITCH:
+            target = max(self.index + 1, ceiling)
+        elif ceiling > self.index:
+            target = ceiling
+        elif ceiling < self.index and now - self._clean_since >= UPSWITCH_HOLD:
+            target = self.index - 1
+
+        target = min(target, len(self.renditions) - 1)
+        if target == self.index or now - self._last_switch < SWITCH_COOLDOWN:
+            return None
+
+        self.index = target
+        self._last_switch = now
+        self._clean_since = now
+        return self.rendition
+
+
+class AdaptiveVideoTrack(MediaStreamTrack):
+    """A peer's video track that can move between ladder rungs.
+
+    A switch subscribes to the new rung first and only swaps over once that
+    subscription has a keyframe queued, so the decoder never sees a gap.
+    """
+
+    kind = "video"
+
+    def __init__(self, ladder: "RenditionLadder"):
+        super().__init__()
+        self._ladder: RenditionLadder | None = ladder
+        self.selector = RenditionSelector(ladder.usable_renditions())
+        self.rendition = self.selector.rendition
+        self._current: EncodedVideoTrack = ladder.fanouts[self.rendition.name].subscribe()
+        self._pending: tuple[Rendition, EncodedVideoTrack] | None = None
+        RENDITION_VIEWERS.inc(rendition=self.rendition.name)
+
+    def switch_to(self, rendition: Rendition) -> None:
+        if self._ladder is None:
+            return
+        if self._pending is not None:
+            self._pending[1].stop()
+            self._pending = None
+        if rendition == self.rendition:
+            return
+        self._pending = (rendition, self._ladder.fanouts[rendition.name].subscribe(prime=False))
+
+    def request_keyframe(self) -> None:
+        self._current.request_keyframe()
+
+    def handle_rtcp(self, packet, ssrc: int) -> None:
+        if self._ladder is None:
+            return
+        usable = self._ladder.usable_renditions()
+        if usable != self.selector.renditions:
+            self.selector.set_renditions(usable)
+            self.switch_to(self.selector.rendition)
+        decision = None
+        if isinstance(packet, RtcpPsfbPacket) and packet.fmt == RTCP_PSFB_APP:
+            try:
+                bitrate, ssrcs = unpack_remb_fci(packet.fci)
+            except ValueError:
+                return
+            if ssrc in ssrcs:
+                decision = self.selector.on_estimate(bitrate)
+        elif isinstance(packet, (RtcpRrPacket, RtcpSrPacket)):
+            for report in packet.reports:
+                if report.ssrc == ssrc:
+                    decision = self.selector.on_loss(report.fraction_lost / 256)
+        if decision is not None:
+            self.switch_to(decision)
+
+    def _complete_switch(self) -> None:
+        rendition, track = self._pending
+        self._pending = None
+        previous = self.rendition
+        self._current.stop()
+        self._current = track
+        self.rendition = rendition
+        RENDITION_VIEWERS.dec(rendition=previous.name)
+        RENDITION_VIEWERS.inc(rendition=rendition.name)
+        direction = "down" if rendition.height < previous.height else "up"
+        RENDITION_SWITCHES.inc(direction=direction)
+        logger.info(f"Switched rendition {previous.name} -> {rendition.name}")
+        self.emit("renditionchange")
+
+    async def recv(self) -> av.Packet:
+        if self.readyState != "live":
+            raise MediaStreamError
+        # The pending subscription only queues from a keyframe onwards.
+        if self._pending is not None and self._pending[1].ready:
+            self._complete_switch()
+        return await self._current.recv()
+
+    def stop(self) -> None:
+        if self._ladder is not None:
+            RENDITION_VIEWERS.dec(rendition=self.rendition.name)
+            self._current.stop()
+            if self._pending is not None:
+                self._pending[1].stop()
+                self._pending = None
+            self._ladder = None
+        super().stop()
+
+
+class RenditionLadder:
+    """Encodes one capture into several renditions, each its own shared encoder.
+
+    A rung only encodes while at least one peer is subscribed to it.
+    """
+
+    def __init__(self, source: MediaStreamTrack, renditions: list[Rendition]):
+        self.source = source
+        self.renditions = sorted(renditions, key=lambda r: r.height, reverse=True)
+        self._relay = MediaRelay()
+        # Unbuffered relay: every rung encodes the latest captured frame.
+        self.fanouts: dict[str, EncodingFanout] = {
+            r.name: EncodingFanout(
+                self._relay.subscribe(source, buffered=False), bitrate=r.bitrate, height=r.height
+            )
+            for r in self.renditions
+        }
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(fanout.subscriber_count for fanout in self.fanouts.values())
+
+    def usable_renditions(self) -> list[Rendition]:
+        """Rungs worth offering for the source resolution, highest first.
+
+        Rungs at or above the source height would all encode it at native
+        size, so they are merged into the smallest of them.
+        """
+        source_height = next(
+            (f.source_height for f in self.fanouts.values() if f.source_height is not None), None
+        )
+        if source_height is None:
+            return self.renditions
+        native = [r for r in self.renditions if r.height >= source_height]
+        smaller = [r for r in self.renditions if r.height < source_height]
+        return native[-1:] + smaller
+
+    def subscribe(self) -> AdaptiveVideoTrack:
+        return AdaptiveVideoTrack(self)
+
+    def attach_sender(self, sender: RTCRtpSender) -> None:
+        track: AdaptiveVideoTrack = sender.track
+        hooks = sender_hooks(sender)
+        hooks.route_keyframes(track.request_keyframe)
+        hooks.on_rtcp(lambda packet: track.handle_rtcp(packet, sender._ssrc))
+
+    async def stop(self) -> None:
+        for fanout in self.fanouts.values():
+            await fanout.stop()
+
+
+def create_fanout(track: MediaStreamTrack) -> VideoFanout | RenditionLadder:
+    """Wrap a local track in the shared-encoder pipeline that fits it."""
+    renditions = parse_renditions(VIDEO_RENDITIONS)
+    if getattr(track, "passthrough", False):
+        # Only an ingest session that cannot be passed through is encoded,
+        # at the top rung.
+        if renditions:
+            return PassthroughFanout(track, bitrate=renditions[0].bitrate, height=renditions[0].height)
+        return PassthroughFanout(track)
+    if len(renditions) > 1:
+        return RenditionLadder(track, renditions)
+    if renditions:
+        return EncodingFanout(track, bitrate=renditions[0].bitrate, height=renditions[0].height)
+    return EncodingFanout(track)
+
+
+def shared_fanout(video, rendition: str = "") -> VideoFanout | None:
+    """The encoded stream that other outputs (HLS, snapshots) should tap.
+
+    For a ladder that is `rendition` if usable, else the highest rung; None in
+    per-peer mode, where no shared encoded stream exists.
+    """
+    if isinstance(video, RenditionLadder):
+        names = [r.name for r in video.usable_renditions()]
+        return video.fanouts[rendition if rendition in names else names[0]]
+    if isinstance(video, VideoFanout):
+        return video
+    return None
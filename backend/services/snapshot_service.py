@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import NamedTuple
+
+import av
+import cv2
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+from services.metrics_service import registry
+from services.rendition_service import shared_fanout
+from services.source_service import MediaSource
+from services.webrtc_service import relay
+
+logger = logging.getLogger("snapshot_service")
+
+# Upper bound on JPEG encodes per second for each variant, however many
+# requests arrive; requests in between are answered from the cache.
+SNAPSHOT_MAX_FPS = float(os.environ.get("SNAPSHOT_MAX_FPS", "1"))
+# Widths a client may ask for; anything else would let callers force an
+# encode per distinct value.
+SNAPSHOT_WIDTHS = tuple(
+    int(width) for width in os.environ.get("SNAPSHOT_WIDTHS", "160,320,640,1280").split(",")
+)
+SNAPSHOT_QUALITY = 80
+SNAPSHOT_QUALITY_STEP = 5  # requested qualities are rounded to this step
+SNAPSHOT_IDLE_TIMEOUT = float(os.environ.get("SNAPSHOT_IDLE_TIMEOUT", "30"))  # seconds without requests
+SNAPSHOT_WAIT = 5.0  # seconds a request waits for the first frame after a cold start
+MAX_PENDING_PACKETS = 300  # undecoded packets kept while nobody asks for a snapshot
+
+SNAPSHOT_REQUESTS = registry.counter(
+    "birdstream_snapshot_requests_total", "Snapshot requests", ("result",)
+)
+SNAPSHOT_ENCODE_SECONDS = registry.histogram(
+    "birdstream_snapshot_encode_seconds",
+    "Time to decode and JPEG-encode one snapshot",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class SnapshotUnavailableError(Exception):
+    pass
+
+
+class Snapshot(NamedTuple):
+    data: bytes
+    etag: str
+    modified: float  # wall-clock time of the frame
+    created: float  # monotonic time of the encode
+    sequence: int  # input counter the frame was taken from
+
+
+def quantize_quality(quality: int) -> int:
+    step = SNAPSHOT_QUALITY_STEP
+    return min(100, max(step, round(quality / step) * step))
+
+
+class SnapshotService:
+    """Serves JPEG stills of the live video without adding capture load.
+
+    While snapshots are being requested a background task follows the video:
+    raw frames in per-peer mode, or the shared H.264 stream otherwise, whose
+    packets are only decoded when a snapshot is actually due. Each
+    (width, quality) variant is re-encoded at most `max_fps` times a second
+    in an executor; every other request gets the cached bytes. After
+    `idle_timeout` seconds without requests the MediaSource is released.
+    """
+
+    def __init__(
+        self,
+        source: MediaSource,
+        max_fps: float = SNAPSHOT_MAX_FPS,
+        idle_timeout: float = SNAPSHOT_IDLE_TIMEOUT,
+    ):
+        self.source = source
+        self.interval = 1 / max_fps
+        self.idle_timeout = idle_timeout
+        self._cache: dict[tuple[int | None, int], Snapshot] = {}
+        self._lock = asyncio.Lock()
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._last_request = 0.0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._raw: av.VideoFrame | None = None
+        self._pending: list[av.Packet] = []
+        self._synced = False
+        self._decoder: av.CodecContext | None = None
+        self._frame: av.VideoFrame | None = None
+        self._sequence = 0
+        self._updated = 0.0
+
+    def touch(self) -> None:
+        self._last_request = time.monotonic()
+        if self._task is None:
+            self._changed.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        track: MediaStreamTrack | None = None
+        self.source.retain()
+        try:
+            _, video = await self.source.acquire()
+            fanout = shared_fanout(video)
+            if fanout is not None:
+                track = fanout.subscribe()
+            elif isinstance(video, MediaStreamTrack):
+                track = relay.subscribe(video, buffered=False)
+            else:
+                return
+            while time.monotonic() - self._last_request < self.idle_timeout:
+                self._ingest(await track.recv())
+            logger.info(f"No snapshot requests for {self.idle_timeout:.0f}s, snapshot feed stopped")
+        except MediaStreamError:
+            logger.warning("Snapshot source ended")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Snapshot feed crashed")
+        finally:
+            if track is not None:
+                track.stop()
+            self._reset()
+            self._task = None
+            self.source.release()
+            self._changed.set()
+
+    def _ingest(self, item: av.Packet | av.VideoFrame | None) -> None:
+        if item is None:
+            return
+        if isinstance(item, av.Packet):
+            # Packets are only queued here; decoding waits until a snapshot is
+            # due, and a keyframe makes everything queued before it obsolete.
+            if item.is_keyframe:
+                self._pending = [item]
+                self._synced = True
+            elif not self._synced:
+                return
+            elif len(self._pending) < MAX_PENDING_PACKETS:
+                self._pending.append(item)
+            else:
+                self._pending = []
+                self._synced = False
+                return
+        else:
+            self._raw = item
+        self._sequence += 1
+        self._updated = time.time()
+        self._changed.set()
+
+    def _has_input(self) -> bool:
+        return self._raw is not None or self._frame is not None or bool(self._pending)
+
+    def _decode(self, packets: list[av.Packet]) -> av.VideoFrame | None:
+        if self._decoder is None:
+            self._decoder = av.CodecContext.create("h264", "r")
+        frame = None
+        for packet in packets:
+            try:
+                for frame in self._decoder.decode(packet):
+                    pass
+            except av.FFmpegError as e:
+                logger.warning(f"Snapshot decode failed: {e}")
+        return frame
+
+    def _render(
+        self, raw: av.VideoFrame | None, packets: list[av.Packet], width: int | None, quality: int
+    ) -> tuple[av.VideoFrame | None, bytes | None]:
+        started = time.monotonic()
+        frame = raw
+        if packets:
+            frame = self._decode(packets) or self._frame
+        elif frame is None:
+            frame = self._frame
+        if frame is None:
+            return None, None
+
+        if width is not None and width < frame.width:
+            height = round(frame.height * width / frame.width / 2) * 2
+        else:
+            width, height = frame.width, frame.height
+        # One swscale pass does both the resize and the conversion for OpenCV.
+        image = frame.reformat(width=width, height=height, format="bgr24").to_ndarray()
+        ok, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        SNAPSHOT_ENCODE_SECONDS.observe(time.monotonic() - started)
+        return frame, jpeg.tobytes() if ok else None
+
+    def _fresh(self, snapshot: Snapshot | None) -> bool:
+        return snapshot is not None and time.monotonic() - snapshot.created < self.interval
+
+    async def snapshot(self, width: int | None = None, quality: int = SNAPSHOT_QUALITY) -> Snapshot:
+        """The latest frame as JPEG; SnapshotUnavailableError if there is no video."""
+        self.touch()
+        key = (width, quality)
+        if self._fresh(self._cache.get(key)):
+            SNAPSHOT_REQUESTS.inc(result="cached")
+            return self._cache[key]
+
+        async with self._lock:
+            cached = self._cache.get(key)
+            if self._fresh(cached):
+                SNAPSHOT_REQUESTS.inc(result="cached")
+                return cached
+
+            if not self._has_input():
+                try:
+                    await asyncio.wait_for(self._changed.wait(), SNAPSHOT_WAIT)
+                except asyncio.TimeoutError:
+                    pass
+                if not self._has_input():
+                    SNAPSHOT_REQUESTS.inc(result="unavailable")
+                    raise SnapshotUnavailableError()
+
+            sequence, modified = self._sequence, self._updated
+            if cached is not None and cached.sequence == sequence and self._task is not None:
+                # Nothing new since the last encode (a still source).
+                snapshot = cached._replace(created=time.monotonic())
+            else:
+                packets, self._pending = self._pending, []
+                frame, data = await asyncio.get_running_loop().run_in_executor(
+                    None, self._render, self._raw, packets, width, quality
+                )
+                if data is None:
+                    SNAPSHOT_REQUESTS.inc(result="unavailable")
+                    raise SnapshotUnavailableError()
+                if self._task is not None:
+                    self._frame = frame
+                etag = f'"{hashlib.blake2b(data, digest_size=12).hexdigest()}"'
+                snapshot = Snapshot(data, etag, modified, time.monotonic(), sequence)
+                SNAPSHOT_REQUESTS.inc(result="encoded")
+            self._cache[key] = snapshot
+            return snapshot
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
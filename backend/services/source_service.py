@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable
+
+from aiortc import MediaStreamTrack
+
+from services.connection_manager import ConnectionManager
+from services.metrics_service import registry
+
+logger = logging.getLogger("source_service")
+
+# Seconds without viewers before capture and decode are shut down; a negative
+# value keeps the sources running permanently.
+VIDEO_SUSPEND_GRACE = float(os.environ.get("VIDEO_SUSPEND_GRACE", "60"))
+
+SOURCE_ACTIVE = registry.gauge(
+    "birdstream_source_active",
+    "1 while the capture pipeline is running, 0 while suspended",
+    ("camera",),
+)
+SOURCE_TRANSITIONS = registry.counter(
+    "birdstream_source_transitions_total",
+    "Capture pipeline suspends and resumes",
+    ("camera", "action"),
+)
+SOURCE_RESUME_SECONDS = registry.histogram(
+    "birdstream_source_resume_seconds", "Time to reopen the capture pipeline", ("camera",)
+)
+
+# (audio, video): video is a raw track in per-peer mode, otherwise a fan-out.
+Media = tuple[MediaStreamTrack | None, Any]
+
+
+class MediaSource:
+    """Keeps the local capture pipeline open only while someone is watching.
+
+    Viewers are counted by the ConnectionManager (only those of `camera`, if
+    given), plus any `retain()` held by other consumers (HLS packaging,
+    recording): once there have been none for `grace`
+    seconds the tracks are stopped (releasing the camera and the decode
+    threads), and the next `acquire()` reopens them.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Media],
+        manager: ConnectionManager,
+        grace: float = VIDEO_SUSPEND_GRACE,
+        camera: str | None = None,
+    ):
+        self._factory = factory
+        self._manager = manager
+        self.grace = grace
+        self.camera = camera
+        self._media: Media | None = None
+        self._lock = asyncio.Lock()
+        self._suspend_timer: asyncio.TimerHandle | None = None
+        self._holds = 0
+        self._manager.on_change(self.check_idle)
+
+    @property
+    def active(self) -> bool:
+        return self._media is not None
+
+    async def start(self) -> None:
+        await self.acquire()
+        self.check_idle()
+
+    async def acquire(self) -> Media:
+        """Return the running tracks, reopening them if they were suspended."""
+        self._cancel_suspend()
+        async with self._lock:
+            if self._media is None:
+                started = time.monotonic()
+                # Opening a device or file blocks on I/O.
+                self._media = await asyncio.get_running_loop().run_in_executor(None, self._factory)
+                elapsed = time.monotonic() - started
+                SOURCE_RESUME_SECONDS.observe(elapsed, camera=self._label)
+                SOURCE_TRANSITIONS.inc(camera=self._label, action="resume")
+                SOURCE_ACTIVE.set(1, camera=self._label)
+                logger.info(f"Capture pipeline {self._label} opened in {elapsed * 1000:.0f} ms")
+            return self._media
+
+    def retain(self) -> None:
+        self._holds += 1
+        self._cancel_suspend()
+
+    def release(self) -> None:
+        self._holds -= 1
+        self.check_idle()
+
+    @property
+    def _label(self) -> str:
+        return self.camera or "default"
+
+    def _in_use(self) -> bool:
+        return bool(self._manager.count(self.camera) or self._holds)
+
+    def check_idle(self) -> None:
+        """Arm the suspend timer when nobody is watching, disarm it otherwise."""
+        if self._in_use() or self._media is None or self.grace < 0:
+            self._cancel_suspend()
+            return
+        if self._suspend_timer is None:
+            loop = asyncio.get_running_loop()
+            self._suspend_timer = loop.call_later(
+                self.grace, lambda: asyncio.ensure_future(self._suspend_if_idle())
+            )
+
+    def _cancel_suspend(self) -> None:
+        if self._suspend_timer is not None:
+            self._suspend_timer.cancel()
+            self._suspend_timer = None
+
+    async def _suspend_if_idle(self) -> None:
+        self._suspend_timer = None
+        if self._in_use():
+            return
+        async with self._lock:
+            if self._media is None or self._in_use():
+                return
+            await self._close()
+            SOURCE_TRANSITIONS.inc(camera=self._label, action="suspend")
+            logger.info(f"No viewers for {self.grace:.0f}s, capture pipeline {self._label} suspended")
+
+    async def _close(self) -> None:
+        audio, video = self._media
+        self._media = None
+        SOURCE_ACTIVE.set(0, camera=self._label)
+        if audio is not None:
+            audio.stop()
+        if isinstance(video, MediaStreamTrack):
+            video.stop()
+        elif video is not None:
+            # Fan-outs only stop their subscribers; the capture track is ours.
+            await video.stop()
+            video.source.stop()
+
+    async def stop(self) -> None:
+        self._cancel_suspend()
+        self._manager.remove_change_listener(self.check_idle)
+        async with self._lock:
+            if self._media is not None:
+                await self._close()
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from aiortc import RTCPeerConnection, RTCRtpSender
+from aiortc.rtp import RTCP_PSFB_FIR, RTCP_PSFB_PLI, RTCP_RTPFB_NACK, RtcpPsfbPacket, RtcpRtpfbPacket
+from aiortc.stats import RTCOutboundRtpStreamStats, RTCRemoteInboundRtpStreamStats
+
+from services.connection_manager import ConnectionManager
+from services.encoder_service import sender_hooks
+from services.metrics_service import registry
+
+logger = logging.getLogger("stats_service")
+
+# Seconds between collection rounds.
+WEBRTC_STATS_INTERVAL = float(os.environ.get("WEBRTC_STATS_INTERVAL", "5"))
+# Peers sampled per round at most; the others are sampled in later rounds, so
+# collection cost stays flat however many viewers there are.
+WEBRTC_STATS_BATCH = int(os.environ.get("WEBRTC_STATS_BATCH", "50"))
+
+CLOCK_RATES = {"audio": 48000, "video": 90000}  # Opus and H.264, see force_codec
+
+PEER_BITRATE = registry.histogram(
+    "birdstream_peer_send_bitrate_bps",
+    "Bitrate sent to each sampled peer",
+    ("kind",),
+    buckets=(32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 1.5e6, 2.5e6, 5e6),
+)
+PEER_RTT = registry.histogram(
+    "birdstream_peer_rtt_seconds",
+    "Round-trip time to each sampled peer, from its RTCP receiver reports",
+    ("kind",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.4, 0.8, 1.6),
+)
+PEER_JITTER = registry.histogram(
+    "birdstream_peer_jitter_seconds",
+    "Interarrival jitter each sampled peer reports",
+    ("kind",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2),
+)
+PEER_FRACTION_LOST = registry.histogram(
+    "birdstream_peer_fraction_lost",
+    "Fraction of packets lost since each sampled peer's previous receiver report",
+    ("kind",),
+    buckets=(0.0, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0),
+)
+RTP_PACKETS_SENT = registry.counter("birdstream_rtp_packets_sent_total", "RTP packets sent to peers", ("kind",))
+RTP_BYTES_SENT = registry.counter("birdstream_rtp_bytes_sent_total", "RTP payload bytes sent to peers", ("kind",))
+RTP_PACKETS_LOST = registry.counter(
+    "birdstream_rtp_packets_lost_total", "RTP packets peers reported lost", ("kind",)
+)
+RTCP_FEEDBACK = registry.counter(
+    "birdstream_rtcp_feedback_total",
+    "Retransmissions requested (nack) and keyframes requested (pli, fir) by peers",
+    ("kind", "type"),
+)
+STATS_PEERS = registry.gauge("birdstream_stats_peers_sampled", "Peers sampled in the last collection round")
+STATS_SECONDS = registry.histogram(
+    "birdstream_stats_collection_seconds",
+    "Time one collection round took",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+def instrument_sender(sender: RTCRtpSender) -> None:
+    """Counts the NACK and PLI/FIR feedback `sender` receives, which aiortc
+    handles without reporting it in getStats()."""
+    counts = sender.feedback_counts = {"nack": 0, "pli": 0, "fir": 0}
+
+    def count_feedback(packet) -> None:
+        feedback = None
+        if isinstance(packet, RtcpRtpfbPacket) and packet.fmt == RTCP_RTPFB_NACK:
+            feedback, amount = "nack", len(packet.lost)
+        elif isinstance(packet, RtcpPsfbPacket) and packet.fmt in (RTCP_PSFB_PLI, RTCP_PSFB_FIR):
+            feedback, amount = ("pli" if packet.fmt == RTCP_PSFB_PLI else "fir"), 1
+        if feedback is not None:
+            counts[feedback] += amount
+            RTCP_FEEDBACK.inc(amount, kind=sender.kind, type=feedback)
+
+    sender_hooks(sender).on_rtcp(count_feedback)
+
+
+class PeerStatsCollector:
+    """Samples getStats() of the connected peers into the metrics registry.
+
+    Every `interval` seconds up to `batch` peers are sampled, round-robin, so
+    with many viewers each one is sampled less often rather than a round
+    taking longer. Rates are computed over the time since the peer's own
+    previous sample. The latest sample per peer is kept in
+    `ConnectionManager.stats` for the verbose peer listing.
+    """
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        interval: float = WEBRTC_STATS_INTERVAL,
+        batch: int = WEBRTC_STATS_BATCH,
+    ):
+        self.manager = manager
+        self.interval = interval
+        self.batch = batch
+        self._pending: deque[str] = deque()
+        # peer id -> (sampled at, pc, {stats id: (bytes sent, packets sent, packets lost)})
+        self._previous: dict[str, tuple[float, RTCPeerConnection, dict[str, tuple[int, int, int]]]] = {}
+        self._task: asyncio.Task | None = None
+
+    def _next_batch(self) -> list[tuple[str, RTCPeerConnection]]:
+        if not self._pending:
+            self._pending.extend(self.manager.pcs)
+        picked = []
+        while self._pending and len(picked) < self.batch:
+            peer_id = self._pending.popleft()
+            pc = self.manager.get_peer(peer_id)
+            if pc is not None and pc.connectionState == "connected":
+                picked.append((peer_id, pc))
+        return picked
+
+    async def collect(self) -> int:
+        """Runs one round; the number of peers sampled."""
+        started = time.monotonic()
+        for peer_id in [p for p in self._previous if p not in self.manager.pcs]:
+            del self._previous[peer_id]
+
+        picked = self._next_batch()
+        reports = await asyncio.gather(*(pc.getStats() for _, pc in picked), return_exceptions=True)
+        now = time.monotonic()
+        for (peer_id, pc), report in zip(picked, reports):
+            if isinstance(report, Exception):
+                logger.debug(f"getStats failed for peer {peer_id}: {report!r}")
+                continue
+            self.manager.set_stats(peer_id, self._record(peer_id, pc, report, now))
+
+        STATS_PEERS.set(len(picked))
+        STATS_SECONDS.observe(time.monotonic() - started)
+        return len(picked)
+
+    def _record(self, peer_id: str, pc: RTCPeerConnection, report, now: float) -> dict:
+        previous_at, previous_pc, previous = self._previous.get(peer_id, (None, None, {}))
+        if previous_pc is not pc:  # the peer reconnected with a new connection
+            previous_at, previous = None, {}
+        totals: dict[str, tuple[int, int, int]] = {}
+        summary: dict[str, dict] = {}
+
+        for stats in report.values():
+            if isinstance(stats, RTCOutboundRtpStreamStats):
+                kind = stats.kind
+                bytes_before, packets_before, lost = previous.get(stats.id, (0, 0, 0))
+                totals[stats.id] = (stats.bytesSent, stats.packetsSent, lost)
+                RTP_BYTES_SENT.inc(max(stats.bytesSent - bytes_before, 0), kind=kind)
+                RTP_PACKETS_SENT.inc(max(stats.packetsSent - packets_before, 0), kind=kind)
+                entry = summary.setdefault(kind, {})
+                entry["packets_sent"] = stats.packetsSent
+                if previous_at is not None and now > previous_at:
+                    bitrate = max(stats.bytesSent - bytes_before, 0) * 8 / (now - previous_at)
+                    PEER_BITRATE.observe(bitrate, kind=kind)
+                    entry["bitrate_bps"] = round(bitrate)
+
+        for stats in report.values():
+            if isinstance(stats, RTCRemoteInboundRtpStreamStats):
+                kind = stats.kind
+                outbound = next(
+                    (key for key, value in report.items()
+                     if isinstance(value, RTCOutboundRtpStreamStats) and value.ssrc == stats.ssrc),
+                    None,
+                )
+                if outbound is not None:
+                    sent_bytes, sent_packets, lost_before = totals[outbound]
+                    RTP_PACKETS_LOST.inc(max(stats.packetsLost - lost_before, 0), kind=kind)
+                    totals[outbound] = (sent_bytes, sent_packets, stats.packetsLost)
+                jitter = stats.jitter / CLOCK_RATES.get(kind, 90000)
+                fraction_lost = stats.fractionLost / 256
+                PEER_JITTER.observe(jitter, kind=kind)
+                PEER_FRACTION_LOST.observe(fraction_lost, kind=kind)
+                entry = summary.setdefault(kind, {})
+                entry.update(packets_lost=stats.packetsLost, jitter=jitter, fraction_lost=fraction_lost)
+                if stats.roundTripTime is not None:
+                    PEER_RTT.observe(stats.roundTripTime, kind=kind)
+                    entry["rtt"] = stats.roundTripTime
+
+        for sender in pc.getSenders():
+            counts = getattr(sender, "feedback_counts", None)
+            if counts is not None and sender.kind in summary:
+                summary[sender.kind].update(counts)
+
+        self._previous[peer_id] = (now, pc, totals)
+        return summary
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.collect()
+            except Exception:
+                logger.exception("Collecting peer stats failed")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+
+from aioice import stun
+from aioice.candidate import Candidate, candidate_foundation, candidate_priority
+from aioice.ice import Connection, StunProtocol, TransportPolicy, get_host_addresses
+
+from services.cluster_service import WORKER_ID
+from services.metrics_service import registry
+
+logger = logging.getLogger("udp_mux_service")
+
+# UDP port all WebRTC peers share, one socket per host address; each cluster
+# worker uses the port plus its worker id. 0 gives every peer its own sockets.
+WEBRTC_UDP_MUX_PORT = int(os.environ.get("WEBRTC_UDP_MUX_PORT", "0"))
+# Address advertised in the candidates instead of the host's own, for a host
+# behind 1:1 NAT (a cloud VM's public IP). Empty advertises the host addresses.
+WEBRTC_UDP_MUX_PUBLIC_IP = os.environ.get("WEBRTC_UDP_MUX_PUBLIC_IP", "")
+
+MUX_CANDIDATES = registry.gauge(
+    "birdstream_udp_mux_candidates", "ICE host candidates currently served from the UDP mux sockets"
+)
+MUX_UNMATCHED = registry.counter(
+    "birdstream_udp_mux_unmatched_total", "Datagrams on the UDP mux that belonged to no ICE connection"
+)
+
+
+class _MuxSocket(asyncio.DatagramProtocol):
+    def __init__(self, mux: "UdpMux", address: str, advertised: str):
+        self.mux = mux
+        self.address = address
+        self.advertised = advertised
+        self.transport: asyncio.DatagramTransport | None = None
+        self.by_ufrag: dict[str, StunProtocol] = {}
+        self.by_remote: dict[tuple, StunProtocol] = {}
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        addr = (addr[0], addr[1])
+        protocol = self.by_remote.get(addr)
+        if protocol is None:
+            protocol = self._match_binding_request(data, addr)
+            if protocol is None:
+                MUX_UNMATCHED.inc()
+                return
+        protocol.datagram_received(data, addr)
+
+    def _match_binding_request(self, data: bytes, addr: tuple) -> StunProtocol | None:
+        # A new remote address is learnt from its first connectivity check:
+        # USERNAME is "<our ufrag>:<their ufrag>".
+        try:
+            message = stun.parse_message(data)
+        except ValueError:
+            return None
+        username = message.attributes.get("USERNAME")
+        if message.message_class != stun.Class.REQUEST or not username:
+            return None
+        protocol = self.by_ufrag.get(username.split(":", 1)[0])
+        if protocol is not None:
+            self.mux.route(self, protocol, addr)
+        return protocol
+
+
+class _MuxedTransport(asyncio.DatagramTransport):
+    """One ICE connection's view of a shared mux socket."""
+
+    def __init__(self, mux: "UdpMux", socket: _MuxSocket, protocol: StunProtocol):
+        super().__init__()
+        self._mux = mux
+        self._socket = socket
+        self._protocol = protocol
+        self._closing = False
+
+    def sendto(self, data: bytes, addr: tuple | None = None) -> None:
+        if self._closing or self._socket.transport is None:
+            return
+        # Replies to our own checks come from the address they were sent to.
+        self._mux.route(self._socket, self._protocol, addr)
+        self._socket.transport.sendto(data, addr)
+
+    def get_extra_info(self, name: str, default=None):
+        if name == "sockname":
+            return (self._socket.advertised, self._mux.port)
+        return default  # no "socket": the reaper does not count these as owned
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        if not self._closing:
+            self._closing = True
+            self._mux.release(self._socket, self._protocol)
+            self._protocol.connection_lost(None)
+
+    def abort(self) -> None:
+        self.close()
+
+
+class UdpMux:
+    """Serves the ICE host candidates of every peer from one UDP port.
+
+    aiortc binds fresh sockets for each peer's ICE connection. With the mux
+    installed, aioice's candidate gathering instead hands each connection a
+    host candidate on the shared sockets, and incoming datagrams are routed
+    by remote address, or, for a remote address not seen yet, by the ICE
+    ufrag in its STUN binding request. Like an ICE-lite server it only
+    offers host candidates; clients still reach it through their own
+    STUN/TURN candidates.
+    """
+
+    def __init__(self, port: int = WEBRTC_UDP_MUX_PORT, public_ip: str = WEBRTC_UDP_MUX_PUBLIC_IP):
+        self.port = port + WORKER_ID if port else 0
+        self.public_ip = public_ip
+        self._sockets: list[_MuxSocket] = []
+        self._routes: dict[StunProtocol, set[tuple]] = {}  # remote addresses per connection
+        self._gather = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._sockets)
+
+    async def start(self) -> None:
+        if not self.port or self._sockets:
+            return
+        loop = asyncio.get_running_loop()
+        for address in get_host_addresses(use_ipv4=True, use_ipv6=True):
+            advertised = self.public_ip if self.public_ip and ":" not in address else address
+            try:
+                _, socket = await loop.create_datagram_endpoint(
+                    lambda: _MuxSocket(self, address, advertised), local_addr=(address, self.port)
+                )
+            except OSError as e:
+                logger.warning(f"UDP mux could not bind {address}:{self.port}: {e}")
+                continue
+            self._sockets.append(socket)
+        if not self._sockets:
+            logger.error(f"UDP mux disabled: no address could bind port {self.port}")
+            return
+        mux = self
+
+        async def get_component_candidates(connection: Connection, component: int, addresses, timeout=5):
+            return mux.host_candidates(connection, component)
+
+        self._gather = Connection.get_component_candidates
+        Connection.get_component_candidates = get_component_candidates
+        logger.info(f"UDP mux serving all peers on port {self.port} ({', '.join(s.advertised for s in self._sockets)})")
+
+    def host_candidates(self, connection: Connection, component: int) -> list[Candidate]:
+        candidates = []
+        for socket in self._sockets:
+            if not (connection._use_ipv6 if ":" in socket.address else connection._use_ipv4):
+                continue
+            protocol = StunProtocol(connection)
+            protocol.connection_made(_MuxedTransport(self, socket, protocol))
+            protocol.local_candidate = Candidate(
+                foundation=candidate_foundation("host", "udp", socket.advertised),
+                component=component,
+                transport="udp",
+                priority=candidate_priority(component, "host"),
+                host=socket.advertised,
+                port=self.port,
+                type="host",
+            )
+            # aiortc multiplexes RTCP, so a connection has one component.
+            socket.by_ufrag[connection.local_username] = protocol
+            self._routes[protocol] = set()
+            connection._protocols.append(protocol)
+            if connection._transport_policy == TransportPolicy.ALL:
+                candidates.append(protocol.local_candidate)
+        MUX_CANDIDATES.set(len(self._routes))
+        return candidates
+
+    def route(self, socket: _MuxSocket, protocol: StunProtocol, addr: tuple) -> None:
+        routes = self._routes.get(protocol)
+        if routes is not None and addr not in routes:
+            routes.add(addr)
+            socket.by_remote[addr] = protocol
+
+    def rename(self, old_ufrag: str, new_ufrag: str) -> None:
+        """Follows a connection's new local ufrag after an ICE restart."""
+        for socket in self._sockets:
+            protocol = socket.by_ufrag.pop(old_ufrag, None)
+            if protocol is not None:
+                socket.by_ufrag[new_ufrag] = protocol
+
+    def release(self, socket: _MuxSocket, protocol: StunProtocol) -> None:
+        for addr in self._routes.pop(protocol, ()):
+            if socket.by_remote.get(addr) is protocol:
+                del socket.by_remote[addr]
+        ufrag = protocol.receiver.local_username
+        if socket.by_ufrag.get(ufrag) is protocol:
+            del socket.by_ufrag[ufrag]
+        MUX_CANDIDATES.set(len(self._routes))
+
+    async def stop(self) -> None:
+        if self._gather is not None:
+            Connection.get_component_candidates = self._gather
+            self._gather = None
+        for socket in self._sockets:
+            socket.transport.close()
+        self._sockets = []
+
+
+udp_mux = UdpMux()
@@ -1,24 +1,234 @@
+import asyncio
+import concurrent.futures
+import errno
 import logging
+import math
 import os
+import subprocess
 import sys
+import threading
+import time
+import urllib.parse
+from collections import deque
+from typing import Any, BinaryIO, Callable
 
+import av
 import cv2
+import numpy as np
 import pytz
-from aiortc import VideoStreamTrack
-from aiortc.contrib.media import MediaPlayer
+from aiortc import MediaStreamTrack, VideoStreamTrack
+from aiortc.contrib.media import REAL_TIME_FORMATS, MediaPlayer
+from aiortc.mediastreams import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE, MediaStreamError
 from aiortc.rtcrtpsender import RTCRtpSender
 from av import VideoFrame
 from datetime import datetime
 
+from services.frame_bus_service import FrameBus
+from services.metrics_service import registry
+
 logger = logging.getLogger("videostream")
 
+# Forward already-encoded H.264 to the WebRTC senders when the source allows it.
+VIDEO_PASSTHROUGH = os.environ.get("VIDEO_PASSTHROUGH", "1") == "1"
+# Capture backend for devices and files: "ffmpeg" (aiortc MediaPlayer) or
+# "opencv" (VideoTrack, which feeds frame sinks and the frame bus).
+VIDEO_CAPTURE = os.environ.get("VIDEO_CAPTURE", "ffmpeg")
+
+# aiortc always negotiates Constrained Baseline (profile-level-id 42e01f), so
+# Main or High streams would reach browsers that never agreed to decode them.
+# B-frames are rejected separately because RTP timestamps must follow decode order.
+H264_PASSTHROUGH_PROFILES = ("Baseline", "Constrained Baseline")
+PASSTHROUGH_QUEUE_SIZE = 30
+
+# OpenCV capture ring buffer (VideoTrack)
+VIDEO_CAPTURE_BUFFER = int(os.environ.get("VIDEO_CAPTURE_BUFFER", "2"))
+VIDEO_CAPTURE_DROP_OLDEST = os.environ.get("VIDEO_CAPTURE_DROP_OLDEST", "1") == "1"
+VIDEO_CAPTURE_MAX_LATENCY = float(os.environ.get("VIDEO_CAPTURE_MAX_LATENCY", "0.5"))
+# Publish raw captured frames to a shared-memory ring for other processes
+# (OpenCV capture only). DetectionService samples from it instead of decoding.
+VIDEO_FRAME_BUS = os.environ.get("VIDEO_FRAME_BUS", "0") == "1"
+VIDEO_FRAME_BUS_SLOTS = int(os.environ.get("VIDEO_FRAME_BUS_SLOTS", "8"))
+# Shared-memory segment name readers attach to (under /dev/shm on Linux).
+VIDEO_FRAME_BUS_NAME = os.environ.get("VIDEO_FRAME_BUS_NAME", "birdstream-frames")
+
+# Network ingest (IngestTrack): MPEG-TS over SRT (listener) or UDP
+INGEST_SCHEMES = ("srt://", "udp://")
+VIDEO_INGEST_LATENCY = int(os.environ.get("VIDEO_INGEST_LATENCY", "120"))  # ms, SRT retransmission window
+VIDEO_JITTER_BUFFER = float(os.environ.get("VIDEO_JITTER_BUFFER", "0.2"))  # seconds of playout delay
+JITTER_BUFFER_MAX_PACKETS = 300
+INGEST_RECONNECT_DELAY = 1.0  # seconds, doubled per quick failure
+INGEST_RECONNECT_MAX_DELAY = 10.0
+TS_PACKET_SIZE = 188
+
+CAPTURE_FRAMES = registry.counter(
+    "birdstream_capture_frames_total", "Frames read from the capture device"
+)
+CAPTURE_FAILURES = registry.counter(
+    "birdstream_capture_failures_total", "Failed reads from the capture device"
+)
+CAPTURE_DROPPED = registry.counter(
+    "birdstream_capture_frames_dropped_total",
+    "Captured frames discarded before delivery",
+    ("reason",),
+)
+CAPTURE_BUFFER_FILL = registry.gauge(
+    "birdstream_capture_buffer_frames", "Frames waiting in the capture ring buffer"
+)
+CAPTURE_LATENCY = registry.histogram(
+    "birdstream_capture_to_recv_seconds", "Delay between frame capture and VideoTrack.recv"
+)
+
+INGEST_CONNECTED = registry.gauge(
+    "birdstream_ingest_connected", "1 while an ingest sender is connected", ("camera",)
+)
+INGEST_CONNECTIONS = registry.counter(
+    "birdstream_ingest_connections_total", "Ingest sessions accepted from a sender", ("camera", "mode")
+)
+INGEST_BYTES = registry.counter("birdstream_ingest_bytes_total", "MPEG-TS bytes received")
+INGEST_BITRATE = registry.gauge("birdstream_ingest_bitrate_bps", "Ingest bitrate over the last second")
+INGEST_TS_PACKETS = registry.counter("birdstream_ingest_ts_packets_total", "MPEG-TS packets received")
+INGEST_TS_LOST = registry.counter(
+    "birdstream_ingest_ts_packets_lost_total",
+    "MPEG-TS packets missing from the continuity counters (not recovered by SRT)",
+)
+INGEST_BUFFER_FILL = registry.gauge(
+    "birdstream_ingest_buffer_packets", "Packets waiting in the ingest jitter buffer"
+)
+INGEST_BUFFER_SECONDS = registry.gauge(
+    "birdstream_ingest_buffer_seconds", "Media time held in the ingest jitter buffer"
+)
+INGEST_DROPPED = registry.counter(
+    "birdstream_ingest_packets_dropped_total", "Ingest packets discarded", ("reason",)
+)
+
+
+# Teardown of stopped tracks still running in a thread.
+_teardowns: set[asyncio.Task] = set()
+
+
+def _teardown_done(task: asyncio.Task) -> None:
+    _teardowns.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Track teardown failed: {task.exception()!r}")
+
+
+def _tear_down(close: Callable[[], None]) -> None:
+    """Run a stopped track's blocking cleanup (thread joins, device and
+    container closes) in a thread when on the event loop; stop() is
+    synchronous, so it cannot await it."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        close()
+        return
+    task = loop.create_task(asyncio.to_thread(close))
+    _teardowns.add(task)
+    task.add_done_callback(_teardown_done)
+
+
+class FrameRingBuffer:
+    """Bounded, thread-safe buffer of (frame, capture time) pairs.
+
+    When full, either the oldest frame is evicted (`drop_oldest=True`, keeps
+    latency low) or the incoming frame is discarded (keeps frame continuity).
+    """
+
+    def __init__(self, depth: int, drop_oldest: bool = True):
+        self.depth = max(depth, 1)
+        self.drop_oldest = drop_oldest
+        self._frames: deque[tuple[np.ndarray, float]] = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def put(self, frame: np.ndarray, captured_at: float) -> bool:
+        """Store a frame; returns False if a frame had to be dropped."""
+        with self._lock:
+            if len(self._frames) < self.depth:
+                self._frames.append((frame, captured_at))
+                return True
+            if self.drop_oldest:
+                self._frames.popleft()
+                self._frames.append((frame, captured_at))
+            return False
+
+    def get(self) -> tuple[np.ndarray, float] | None:
+        with self._lock:
+            return self._frames.popleft() if self._frames else None
+
+
+class TimestampOverlay:
+    """Draws the local time into the bottom-left corner of BGR frames.
+
+    The text is rasterized into an alpha mask once per second; every frame in
+    between only blends that mask into its small region of interest.
+    """
+
+    def __init__(self, timezone, font_scale: float = 0.7, thickness: int = 1, margin: int = 10):
+        self.timezone = timezone
+        self.font_scale = font_scale
+        self.thickness = thickness
+        self.margin = margin
+        self._second: int | None = None
+        self._mask: np.ndarray | None = None
+        self._ascent = 0
+        self.renders = 0
+
+    def _rasterize(self, text: str) -> None:
+        (width, height), baseline = cv2.getTextSize(
+            text, cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, self.thickness
+        )
+        mask = np.zeros((height + baseline, width), dtype=np.uint8)
+        cv2.putText(
+            mask,
+            text,
+            (0, height),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            self.font_scale,
+            255,
+            self.thickness,
+            cv2.LINE_AA,
+        )
+        self._mask = cv2.merge([mask, mask, mask])
+        self._ascent = height
+        self.renders += 1
+
+    def apply(self, frame: np.ndarray) -> None:
+        second = int(time.time())
+        if second != self._second:
+            self._second = second
+            self._rasterize(datetime.fromtimestamp(second, self.timezone).strftime("%Y-%m-%d %H:%M:%S"))
+
+        # Same placement cv2.putText used: baseline `margin` pixels above the
+        # bottom edge, clipped to the frame.
+        mask_height, mask_width = self._mask.shape[:2]
+        top = frame.shape[0] - self.margin - self._ascent
+        y0, y1 = max(top, 0), min(top + mask_height, frame.shape[0])
+        x0, x1 = self.margin, min(self.margin + mask_width, frame.shape[1])
+        if y0 >= y1 or x0 >= x1:
+            return
+
+        # White text over the ROI: roi + (255 - roi) * alpha, in saturating uint8.
+        roi = frame[y0:y1, x0:x1]
+        mask = self._mask[y0 - top : y1 - top, : x1 - x0]
+        roi[:] = cv2.add(roi, cv2.multiply(cv2.bitwise_not(roi), mask, scale=1 / 255))
+
 
 class VideoTrack(VideoStreamTrack):
     kind = "video"
 
-    def __init__(self):
+    def __init__(
+        self,
+        buffer_depth: int = VIDEO_CAPTURE_BUFFER,
+        drop_oldest: bool = VIDEO_CAPTURE_DROP_OLDEST,
+        max_latency: float = VIDEO_CAPTURE_MAX_LATENCY,
+        frame_bus: bool = VIDEO_FRAME_BUS,
+        video_source: str | None = None,
+    ):
         super().__init__()
-        video_source = os.environ.get("VIDEO_SOURCE", None)
+        if video_source is None:
+            video_source = os.environ.get("VIDEO_SOURCE", None)
         if video_source is None:
             source = 0 if sys.platform == "darwin" else "/dev/video0"
         elif video_source.lstrip("-").isdigit():
@@ -27,46 +237,625 @@ class VideoTrack(VideoStreamTrack):
             source = video_source
         self.camera = cv2.VideoCapture(source)
         self.timezone = pytz.timezone("Europe/Amsterdam")
-        logger.info(f"init video stream capture from {source!r} ...")
+        self.overlay = TimestampOverlay(self.timezone)
+        self.max_latency = max_latency
+        self._buffer = FrameRingBuffer(buffer_depth, drop_oldest)
+        self._frame_ready = asyncio.Event()
+        self._capture_thread: threading.Thread | None = None
+        self._capture_quit = threading.Event()
+        # Created on the first frame, once the frame size is known. The lock
+        # keeps stop() from dropping it while the capture thread creates it.
+        self.frame_bus: FrameBus | None = None
+        self._frame_bus_lock = threading.Lock()
+        self._publish_frames = frame_bus
+        logger.info(
+            f"init video stream capture from {source!r} "
+            f"(buffer={buffer_depth}, drop_oldest={drop_oldest}, max_latency={max_latency}s) ..."
+        )
 
-    async def recv(self):
-        success, frame = self.camera.read()
-        if not success:
-            logger.error("Failed to capture frame from camera")
-            return None
+    def _capture_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        # cv2.VideoCapture.read() blocks for a whole frame interval, so it
+        # never runs on the event loop.
+        while not self._capture_quit.is_set():
+            success, frame = self.camera.read()
+            if not success:
+                CAPTURE_FAILURES.inc()
+                logger.error("Failed to capture frame from camera")
+                self._capture_quit.wait(0.1)
+                continue
 
-        local_time = datetime.now(self.timezone)
-        timestamp = local_time.strftime("%Y-%m-%d %H:%M:%S")
-        cv2.putText(
-            frame,
-            timestamp,
-            (10, frame.shape[0] - 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.7,
-            (255, 255, 255),
-            1,
-            cv2.LINE_AA,
-        )
+            CAPTURE_FRAMES.inc()
+            captured, captured_at = time.monotonic(), time.time()
+            if self._publish_frames:
+                self._publish(frame, captured, captured_at)
+            if not self._buffer.put(frame, captured):
+                CAPTURE_DROPPED.inc(reason="overflow")
+            CAPTURE_BUFFER_FILL.set(len(self._buffer))
+            loop.call_soon_threadsafe(self._frame_ready.set)
+
+    def _publish(self, frame: np.ndarray, captured: float, captured_at: float) -> None:
+        with self._frame_bus_lock:
+            if self._capture_quit.is_set():
+                return  # stopped while this frame was being read
+            bus = self.frame_bus
+            if bus is None:
+                try:
+                    bus = self.frame_bus = FrameBus(VIDEO_FRAME_BUS_SLOTS, frame.nbytes, name=VIDEO_FRAME_BUS_NAME)
+                except OSError as e:
+                    logger.error(f"Could not create the frame bus, not publishing frames: {e}")
+                    self._publish_frames = False
+                    return
+        # The monotonic clock is system-wide, so pts compare across processes.
+        # stop() only unlinks the bus; its memory is closed after the join.
+        bus.publish(frame, int(captured * VIDEO_CLOCK_RATE), captured_at)
 
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        video_frame = VideoFrame.from_ndarray(frame, format="rgb24")
-        video_frame.pts = video_frame.time = 0
+    async def _next_frame(self) -> np.ndarray:
+        if self._capture_thread is None:
+            self._capture_thread = threading.Thread(
+                name="video-capture",
+                target=self._capture_loop,
+                args=(asyncio.get_running_loop(),),
+                daemon=True,
+            )
+            self._capture_thread.start()
+
+        while True:
+            self._frame_ready.clear()
+            item = self._buffer.get()
+            if item is None:
+                await self._frame_ready.wait()
+                continue
+
+            frame, captured_at = item
+            latency = time.monotonic() - captured_at
+            # Skip frames that waited too long, unless nothing newer exists.
+            if latency > self.max_latency and len(self._buffer):
+                CAPTURE_DROPPED.inc(reason="stale")
+                continue
+
+            CAPTURE_BUFFER_FILL.set(len(self._buffer))
+            CAPTURE_LATENCY.observe(latency)
+            return frame
+
+    async def recv(self):
+        # Paces delivery to the 30 fps clock and yields increasing pts.
+        pts, time_base = await self.next_timestamp()
+        frame = await self._next_frame()
+        self.overlay.apply(frame)
+
+        # The encoder converts to yuv420p anyway, so skip a separate BGR->RGB pass.
+        video_frame = VideoFrame.from_ndarray(frame, format="bgr24")
+        video_frame.pts = pts
+        video_frame.time_base = time_base
         return video_frame
 
     def stop(self):
         super().stop()
-        self.camera.release()
+        with self._frame_bus_lock:
+            self._capture_quit.set()
+            bus, self.frame_bus = self.frame_bus, None
+        thread, self._capture_thread = self._capture_thread, None
+        if bus is not None:
+            bus.unlink()  # a restarted capture may publish under the name at once
+
+        def close() -> None:
+            if thread is not None:
+                thread.join()
+            self.camera.release()
+            if bus is not None:
+                bus.close()
+
+        _tear_down(close)
+
+
+class PassthroughTrack(MediaStreamTrack):
+    """Forwards compressed H.264 access units from a file or device without decoding.
+
+    Packets are converted to Annex B (what aiortc's H.264 packetizer expects),
+    re-stamped so pts keep increasing across loops, and paced in real time for
+    file sources.
+    """
+
+    kind = "video"
+    passthrough = True
+
+    def __init__(self, container: av.container.InputContainer, loop: bool = False):
+        super().__init__()
+        self._container = container
+        self._stream = container.streams.video[0]
+        self._loop_playback = loop
+        container_format = set(container.format.name.split(","))
+        self._throttle_playback = not container_format.intersection(REAL_TIME_FORMATS)
+        self._queue: asyncio.Queue[av.Packet | None] = asyncio.Queue(maxsize=PASSTHROUGH_QUEUE_SIZE)
+        self._thread: threading.Thread | None = None
+        self._thread_quit = threading.Event()
+
+    async def recv(self) -> av.Packet:
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        if self._thread is None:
+            self._thread = threading.Thread(
+                name="passthrough-demux",
+                target=self._worker,
+                args=(asyncio.get_running_loop(),),
+                daemon=True,
+            )
+            self._thread.start()
+
+        packet = await self._queue.get()
+        if packet is None:
+            self.stop()
+            raise MediaStreamError
+        return packet
+
+    def _put(self, loop: asyncio.AbstractEventLoop, packet: av.Packet | None) -> bool:
+        # Block (and so stop demuxing) while nobody drains the queue.
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(packet), loop)
+        while not self._thread_quit.is_set():
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    def _worker(self, loop: asyncio.AbstractEventLoop) -> None:
+        stream = self._stream
+        extradata = stream.codec_context.extradata
+        # MP4/MKV carry length-prefixed NAL units (avcC) with SPS/PPS out of band.
+        bsf = None
+        if extradata and extradata[0] == 1:
+            bsf = av.bitstream.BitStreamFilterContext("h264_mp4toannexb", stream)
+
+        time_base = stream.time_base
+        rate = stream.average_rate or 30
+        frame_duration = max(int(1 / (rate * time_base)), 1)
+        first_pts = None
+        offset = 0
+        last_pts = -1
+        start = time.time()
+
+        while not self._thread_quit.is_set():
+            try:
+                packet = next(self._container.demux(stream))
+                if not packet.size:
+                    raise StopIteration
+            except Exception as exc:
+                if isinstance(exc, av.FFmpegError) and exc.errno == errno.EAGAIN:
+                    time.sleep(0.01)
+                    continue
+                if isinstance(exc, StopIteration) and self._loop_playback:
+                    self._container.seek(0)
+                    first_pts = None
+                    offset = last_pts + frame_duration
+                    continue
+                if not isinstance(exc, StopIteration):
+                    logger.error(f"Passthrough demux failed: {exc}")
+                self._put(loop, None)
+                break
+
+            if packet.pts is None:
+                continue
+            if first_pts is None:
+                first_pts = packet.pts
+
+            for out in bsf.filter(packet) if bsf else [packet]:
+                out.pts = max(out.pts - first_pts + offset, last_pts + 1)
+                out.dts = out.pts
+                out.time_base = time_base
+                last_pts = out.pts
+
+                if self._throttle_playback:
+                    wait = start + float(out.pts * time_base) - time.time()
+                    if wait > 0 and self._thread_quit.wait(wait):
+                        return
+
+                if not self._put(loop, out):
+                    return
+
+    def stop(self) -> None:
+        super().stop()
+        self._thread_quit.set()
+        thread, self._thread = self._thread, None
+
+        def close() -> None:
+            if thread is not None:
+                thread.join()
+            if self._container is not None:
+                self._container.close()
+                self._container = None
+
+        _tear_down(close)
+
+
+class TsMonitor:
+    """Counts MPEG-TS packets and continuity-counter gaps in a raw TS byte stream.
+
+    SRT retransmits what it can within its latency window; gaps left in the
+    continuity counters are what it could not recover.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.packets = 0
+        self.lost = 0
+        self._continuity: dict[int, int] = {}
+        self._remainder = b""
+        self._window_start = clock()
+        self._window_bytes = 0
+
+    def feed(self, data: bytes) -> None:
+        INGEST_BYTES.inc(len(data))
+        self._window_bytes += len(data)
+        now = self.clock()
+        if now - self._window_start >= 1.0:
+            INGEST_BITRATE.set(self._window_bytes * 8 / (now - self._window_start))
+            self._window_start, self._window_bytes = now, 0
+
+        data = self._remainder + data
+        packets, lost = self.packets, self.lost
+        offset = 0
+        while offset + TS_PACKET_SIZE <= len(data):
+            if data[offset] != 0x47:
+                offset += 1  # lost sync
+                continue
+            self._check(data, offset)
+            offset += TS_PACKET_SIZE
+        self._remainder = data[offset:]
+        INGEST_TS_PACKETS.inc(self.packets - packets)
+        if self.lost > lost:
+            INGEST_TS_LOST.inc(self.lost - lost)
+
+    def _check(self, data: bytes, i: int) -> None:
+        self.packets += 1
+        pid = ((data[i + 1] & 0x1F) << 8) | data[i + 2]
+        if pid == 0x1FFF:  # null packets
+            return
+        adaptation = (data[i + 3] >> 4) & 0x3
+        counter = data[i + 3] & 0x0F
+        if adaptation & 0x2 and data[i + 4] > 0 and data[i + 5] & 0x80:
+            # Signalled discontinuity: the counter restarts legitimately.
+            self._continuity[pid] = counter
+            return
+        if not adaptation & 0x1:  # no payload, counter does not advance
+            return
+        last = self._continuity.get(pid)
+        self._continuity[pid] = counter
+        if last is not None and counter != last:  # equal means a duplicate
+            self.lost += (counter - last - 1) & 0x0F
+
+
+class _TsTap:
+    """Read-only file object handing PyAV the TS stream while TsMonitor watches it."""
 
+    def __init__(self, raw: BinaryIO, monitor: TsMonitor):
+        self._raw = raw
+        self._monitor = monitor
 
-def create_local_tracks(play_from=False, decode=True, enable_audio=False):
-    video_source = os.environ.get("VIDEO_SOURCE", "/dev/video0")
+    def read(self, size: int = -1) -> bytes:
+        read = getattr(self._raw, "read1", self._raw.read)
+        data = read(size if size > 0 else 65536)
+        self._monitor.feed(data)
+        return data
+
+
+class JitterBuffer:
+    """Thread-safe playout buffer releasing items at the pace of their timestamps.
+
+    The first item is held for `delay` seconds and everything after it keeps
+    that offset from its media time, which smooths out bursty network
+    arrival. After an underrun longer than `delay` the buffer re-anchors and
+    builds the delay up again.
+    """
+
+    def __init__(
+        self,
+        delay: float,
+        max_items: int = JITTER_BUFFER_MAX_PACKETS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.delay = delay
+        self.max_items = max_items
+        self.clock = clock
+        self._items: deque[tuple[Any, float, bool]] = deque()
+        self._anchor: tuple[float, float] | None = None  # (wall clock, media time)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def span(self) -> float:
+        with self._lock:
+            return self._items[-1][1] - self._items[0][1] if self._items else 0.0
+
+    def put(self, item: Any, media_time: float, keyframe: bool = True) -> bool:
+        """Store an item; returns False if buffered items had to be dropped."""
+        with self._lock:
+            dropped = len(self._items) >= self.max_items
+            if dropped:
+                # The consumer stalled: skip to the newest keyframe so what is
+                # left still decodes.
+                keyframes = [i for i, (_, _, key) in enumerate(self._items) if key]
+                cut = keyframes[-1] if keyframes and keyframes[-1] else len(self._items)
+                for _ in range(cut):
+                    self._items.popleft()
+                self._anchor = None
+            self._items.append((item, media_time, keyframe))
+            return not dropped
+
+    def pop(self) -> tuple[Any | None, float]:
+        """Return (item, 0) when the oldest item is due, else (None, seconds to wait)."""
+        with self._lock:
+            if not self._items:
+                return None, math.inf
+            item, media_time, _ = self._items[0]
+            now = self.clock()
+            if self._anchor is None or now - self._due(media_time) > self.delay:
+                self._anchor = (now + self.delay, media_time)
+            due = self._due(media_time)
+            if due - now > self.delay + 1.0:
+                # Timestamps jumped ahead; do not stall for the gap.
+                self._anchor = (now, media_time)
+            elif due > now:
+                return None, due - now
+            self._items.popleft()
+            return item, 0.0
+
+    def _due(self, media_time: float) -> float:
+        wall, anchor_media = self._anchor
+        return wall + media_time - anchor_media
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._anchor = None
+
+
+def ingest_url(url: str, latency_ms: int = VIDEO_INGEST_LATENCY) -> str:
+    """Default SRT URLs to listener mode with the configured receiver latency."""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme != "srt":
+        return url
+    query = dict(urllib.parse.parse_qsl(parts.query))
+    query.setdefault("mode", "listener")
+    query.setdefault("latency", str(latency_ms * 1000))  # FFmpeg takes microseconds
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+class IngestTrack(MediaStreamTrack):
+    """Receives MPEG-TS from the network (an SRT listener by default) and plays
+    it out through a jitter buffer.
+
+    The ffmpeg CLI terminates SRT (PyAV wheels ship without libsrt) and pipes
+    the TS to PyAV. With `decode=False` H.264 access units are forwarded for
+    passthrough; otherwise they are decoded to frames. A session whose stream
+    cannot be passed through (B-frames, another codec or profile) is decoded
+    too, and PassthroughFanout encodes it. The listener is restarted whenever
+    the sender goes away, and pts stay continuous across sessions.
+    """
+
+    kind = "video"
+
+    def __init__(
+        self,
+        url: str,
+        decode: bool = False,
+        jitter_delay: float = VIDEO_JITTER_BUFFER,
+        camera: str = "default",
+    ):
+        super().__init__()
+        self.url = url
+        self.camera = camera
+        self.passthrough = not decode
+        self._buffer = JitterBuffer(jitter_delay)
+        self._ready = asyncio.Event()
+        self._thread: threading.Thread | None = None
+        self._thread_quit = threading.Event()
+        self._process: subprocess.Popen | None = None
+        self._last_pts = -1
+
+    def _open_input(self) -> BinaryIO:
+        command = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-i", ingest_url(self.url),
+            "-map", "0:v:0", "-c", "copy", "-f", "mpegts", "pipe:1",
+        ]
+        self._process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        return self._process.stdout
+
+    def _close_input(self) -> None:
+        process, self._process = self._process, None
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        if self._thread is None:
+            self._thread = threading.Thread(
+                name="video-ingest",
+                target=self._worker,
+                args=(asyncio.get_running_loop(),),
+                daemon=True,
+            )
+            self._thread.start()
+
+        while True:
+            self._ready.clear()
+            item, wait = self._buffer.pop()
+            INGEST_BUFFER_FILL.set(len(self._buffer))
+            INGEST_BUFFER_SECONDS.set(self._buffer.span)
+            if item is not None:
+                return item
+            if self.readyState != "live":
+                raise MediaStreamError
+            try:
+                await asyncio.wait_for(self._ready.wait(), None if wait == math.inf else wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _worker(self, loop: asyncio.AbstractEventLoop) -> None:
+        delay = INGEST_RECONNECT_DELAY
+        while not self._thread_quit.is_set():
+            started = time.monotonic()
+            try:
+                self._session(loop)
+            except Exception as exc:
+                logger.warning(f"Ingest from {self.url} ended: {exc}")
+            finally:
+                INGEST_CONNECTED.set(0, camera=self.camera)
+                self._close_input()
+            if self._thread_quit.is_set():
+                break
+            # Back off only when sessions fail straight away (port in use, bad stream).
+            delay = (
+                INGEST_RECONNECT_DELAY
+                if time.monotonic() - started > INGEST_RECONNECT_MAX_DELAY
+                else min(delay * 2, INGEST_RECONNECT_MAX_DELAY)
+            )
+            logger.info(f"Ingest listening again on {self.url} in {delay:.0f}s")
+            self._thread_quit.wait(delay)
+
+    def _session(self, loop: asyncio.AbstractEventLoop) -> None:
+        monitor = TsMonitor()
+        container = av.open(_TsTap(self._open_input(), monitor), format="mpegts")
+        try:
+            if not container.streams.video:
+                raise ValueError("no video stream")
+            stream = container.streams.video[0]
+            codec = stream.codec_context
+            decode = not self.passthrough
+            if self.passthrough:
+                reason = passthrough_incompatibility(stream)
+                if reason:
+                    logger.warning(f"Ingest from {self.url} cannot be passed through, transcoding: {reason}")
+                    decode = True
+
+            INGEST_CONNECTED.set(1, camera=self.camera)
+            INGEST_CONNECTIONS.inc(camera=self.camera, mode="decode" if decode else "passthrough")
+            logger.info(f"Ingest sender connected: {codec.name} {codec.width}x{codec.height}")
+            # Continue the previous session's timeline one frame later.
+            offset = self._last_pts + VIDEO_CLOCK_RATE // 30 if self._last_pts >= 0 else 0
+            first_pts = None
+
+            for packet in container.demux(stream):
+                if self._thread_quit.is_set():
+                    return
+                if packet.pts is None or not packet.size:
+                    continue
+                if first_pts is None:
+                    if not packet.is_keyframe:
+                        INGEST_DROPPED.inc(reason="before_keyframe")
+                        continue
+                    first_pts = packet.pts
+
+                for item in codec.decode(packet) if decode else [packet]:
+                    if item.pts is None:
+                        continue
+                    pts = offset + int((item.pts - first_pts) * stream.time_base * VIDEO_CLOCK_RATE)
+                    pts = max(pts, self._last_pts + 1)
+                    self._last_pts = pts
+                    item.pts = pts
+                    if not decode:
+                        item.dts = pts
+                    item.time_base = VIDEO_TIME_BASE
+                    keyframe = True if decode else packet.is_keyframe
+                    if not self._buffer.put(item, pts / VIDEO_CLOCK_RATE, keyframe):
+                        INGEST_DROPPED.inc(reason="overflow")
+                    loop.call_soon_threadsafe(self._ready.set)
+        finally:
+            container.close()
+
+    def stop(self) -> None:
+        super().stop()
+        self._thread_quit.set()
+        self._ready.set()
+        thread, self._thread = self._thread, None
+
+        def close() -> None:
+            self._close_input()  # unblocks the worker's read
+            if thread is not None:
+                thread.join()
+            self._buffer.clear()
+
+        _tear_down(close)
+
+
+def passthrough_incompatibility(stream: av.video.stream.VideoStream) -> str | None:
+    """Return why `stream` cannot be sent to WebRTC peers as-is, or None if it can."""
+    codec = stream.codec_context
+    if codec.name != "h264":
+        return f"codec is {codec.name}, not h264"
+    if codec.profile not in H264_PASSTHROUGH_PROFILES:
+        return f"H.264 profile {codec.profile!r} is not WebRTC compatible"
+    if codec.has_b_frames:
+        return "stream contains B-frames"
+    return None
+
+
+def open_passthrough(source, format=None, options=None, loop=False) -> PassthroughTrack | None:
+    try:
+        container = av.open(source, format=format, options=options)
+    except (av.FFmpegError, OSError) as e:
+        logger.info(f"Passthrough unavailable for {source!r}: {e}")
+        return None
+
+    reason = (
+        passthrough_incompatibility(container.streams.video[0])
+        if container.streams.video
+        else "no video stream"
+    )
+    if reason:
+        logger.info(f"Passthrough unavailable for {source!r}, transcoding instead: {reason}")
+        container.close()
+        return None
+
+    logger.info(f"Passthrough enabled for {source!r} ({container.streams.video[0].codec_context.profile})")
+    return PassthroughTrack(container, loop=loop)
+
+
+def create_local_tracks(
+    play_from=False,
+    decode=True,
+    enable_audio=False,
+    video_source=None,
+    capture=VIDEO_CAPTURE,
+    camera="default",
+):
+    if video_source is None:
+        video_source = os.environ.get("VIDEO_SOURCE", "/dev/video0")
+
+    # Network ingest (e.g. pi-agent pushing MPEG-TS over SRT); video only.
+    if not play_from and video_source.startswith(INGEST_SCHEMES):
+        track = IngestTrack(video_source, decode=decode, camera=camera)
+        logger.info(f"VIDEO STREAM ingest from {ingest_url(video_source)} (passthrough={track.passthrough})")
+        return None, track
+
+    if not play_from and capture == "opencv":
+        # Raw frames only: nothing to pass through, and no audio.
+        return None, VideoTrack(video_source=video_source)
 
     # If VIDEO_SOURCE points to a file (not a device), stream it on loop
     if not play_from and not video_source.startswith("/dev/"):
         play_from = video_source
 
+    # Passthrough carries video only, so audio always goes through MediaPlayer.
+    passthrough = not decode and not enable_audio
+
     if play_from:
-        player = MediaPlayer(play_from, decode=decode, loop=True)
+        if passthrough:
+            track = open_passthrough(play_from, loop=True)
+            if track is not None:
+                return None, track
+        player = MediaPlayer(play_from, decode=True, loop=True)
         return player.audio if enable_audio else None, player.video
 
     if sys.platform == "darwin":
@@ -97,6 +886,17 @@ def create_local_tracks(play_from=False, decode=True, enable_audio=False):
                     "audio_channels": "2",
                 }
             )
+        if passthrough:
+            # H.264-capable cameras (UVC H.264, Pi camera via bcm2835-v4l2)
+            h264_options = {
+                "framerate": options["framerate"],
+                "video_size": options["video_size"],
+                "input_format": "h264",
+            }
+            track = open_passthrough(video_source, format="v4l2", options=h264_options)
+            if track is not None:
+                logger.info(f"VIDEO STREAM options: {h264_options}")
+                return None, track
         webcam = MediaPlayer(video_source, format="v4l2", options=options)
 
     logger.info(f"VIDEO STREAM options: {options}")
@@ -1,14 +1,14 @@
 import asyncio
 import logging
 from datetime import datetime, timedelta
+from typing import Callable
 
 import requests
 
-from services.config_service import load_api_key
+from services.config_service import settings
 
 logger = logging.getLogger("weather_service")
 
-WEATHER_API_KEY = load_api_key("WEATHER_API_KEY")
 WEATHER_DATA: dict = {"data": None, "last_updated": 0}
 
 
@@ -36,7 +36,8 @@ async def get_weather(lat: float, lon: float, cache_expiration: int) -> None:
 
     logger.info("Fetching fresh weather data")
 
-    if not WEATHER_API_KEY:
+    api_key = settings.get().weather_api_key
+    if not api_key:
         raise WeatherNotConfiguredError()
 
     try:
@@ -46,7 +47,7 @@ async def get_weather(lat: float, lon: float, cache_expiration: int) -> None:
                 "lat": lat,
                 "lon": lon,
                 "units": "metric",
-                "appid": WEATHER_API_KEY,
+                "appid": api_key,
             },
         )
         response.raise_for_status()
@@ -62,7 +63,15 @@ async def get_weather(lat: float, lon: float, cache_expiration: int) -> None:
         raise WeatherFetchError(str(e)) from e
 
 
-async def fetch_weather_periodically(cache_expiration: int = 3600) -> None:
+def apply_weather(data: dict) -> None:
+    """Adopt weather data fetched by another worker process."""
+    WEATHER_DATA.update(data)
+    WEATHER_DATA["last_updated"] = datetime.fromisoformat(data["last_updated"])
+
+
+async def fetch_weather_periodically(
+    cache_expiration: int = 3600, on_update: Callable[[dict], None] | None = None
+) -> None:
     ip_info = requests.get("http://ip-api.com/json/").json()
     lat, lon = ip_info["lat"], ip_info["lon"]
 
@@ -70,6 +79,8 @@ async def fetch_weather_periodically(cache_expiration: int = 3600) -> None:
         try:
             logger.info("Refreshing weather data in background task")
             await get_weather(lat=lat, lon=lon, cache_expiration=cache_expiration)
+            if on_update is not None:
+                on_update({**WEATHER_DATA, "last_updated": WEATHER_DATA["last_updated"].isoformat()})
         except Exception as e:
             logger.error(f"Error refreshing weather data: {e}")
 
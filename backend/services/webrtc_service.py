@@ -1,21 +1,58 @@
+import asyncio
 import logging
+import os
+import time
+from collections import deque
 
+import aioice.ice
+from aioice.utils import random_string
 from aiortc import (
+    MediaStreamTrack,
     RTCConfiguration,
     RTCIceServer,
     RTCPeerConnection,
     RTCSessionDescription,
 )
 from aiortc.contrib.media import MediaRelay
+from aiortc.rtcicetransport import RTCIceTransport
 from aiortc.rtcrtpsender import RTCRtpSender
+from aiortc.sdp import SessionDescription, candidate_from_sdp
 
-from models.datastructures import ClientModel
-from services.config_service import load_turn_credentials
+from models.datastructures import ClientModel, IceCandidateModel
+from services.config_service import Settings, settings
 from services.connection_manager import ConnectionManager
+from services.metrics_service import registry
+from services.stats_service import instrument_sender
+from services.udp_mux_service import udp_mux
 from services.video_service import force_codec
 
 logger = logging.getLogger("webrtc_service")
 
+# Peer connections kept with their ICE candidates already gathered, so that
+# answering an offer does not wait for STUN/TURN round-trips; 0 disables.
+WEBRTC_PREWARM = int(os.environ.get("WEBRTC_PREWARM", "2"))
+# Seconds before an unused prewarmed connection is regathered; server
+# reflexive candidates go stale with the NAT mapping behind them.
+WEBRTC_PREWARM_MAX_AGE = float(os.environ.get("WEBRTC_PREWARM_MAX_AGE", "60"))
+DEFAULT_OFFER_KINDS = ("audio", "video")  # m-lines of the web client's offer
+# Seconds a peer whose network dropped is kept for the client to restart ICE
+# on it (POST /webrtc/ice-restart) rather than negotiate a new connection.
+# aiortc has no "disconnected" state; aioice closes the connection once its
+# consent checks have gone unanswered this long.
+WEBRTC_ICE_RESTART_GRACE = float(os.environ.get("WEBRTC_ICE_RESTART_GRACE", "30"))
+aioice.ice.CONSENT_FAILURES = max(1, round(WEBRTC_ICE_RESTART_GRACE / aioice.ice.CONSENT_INTERVAL))
+
+OFFER_ANSWER_SECONDS = registry.histogram(
+    "birdstream_offer_answer_seconds",
+    "Time from receiving an offer to having the answer",
+    ("ice",),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+ICE_RESTARTS = registry.counter(
+    "birdstream_ice_restarts_total", "ICE restarts requested by clients", ("result",)
+)
+
 pcs_manager = ConnectionManager()
 relay = MediaRelay()
 
@@ -28,11 +65,11 @@ def get_webrtc_config() -> dict:
         "port_range": RTCRtpSender.TRANSPORT_PORT_MAX
         - RTCRtpSender.TRANSPORT_PORT_MIN
         + 1,
+        "udp_mux_port": udp_mux.port if udp_mux.enabled else None,
     }
 
 
-async def handle_offer(peer: ClientModel, audio, video) -> dict:
-    turn_username, turn_credential = load_turn_credentials()
+def _build_rtc_configuration(current: Settings) -> RTCConfiguration:
     config = RTCConfiguration(
         [
             RTCIceServer(urls=["stun:stun.l.google.com:19302"]),
@@ -41,8 +78,8 @@ async def handle_offer(peer: ClientModel, audio, video) -> dict:
                     "turn:turn.lifeofarobin.com:3478?transport=udp",
                     "turns:turn.lifeofarobin.com:5349?transport=udp",
                 ],
-                username=turn_username,
-                credential=turn_credential,
+                username=current.turn_username,
+                credential=current.turn_credential,
             ),
         ]
     )
@@ -53,16 +90,165 @@ async def handle_offer(peer: ClientModel, audio, video) -> dict:
     config.iceConnectionTimeout = 5
     config.iceKeepAliveInterval = 2
     config.iceInactiveTimeout = 3
+    return config
+
+
+# Shared by every peer connection (aiortc only reads it); rebuilt after the
+# settings (TURN credentials) change.
+_rtc_configuration: RTCConfiguration | None = None
+
+
+def _invalidate_rtc_configuration(_: Settings) -> None:
+    global _rtc_configuration
+    _rtc_configuration = None
+
+
+settings.on_change(_invalidate_rtc_configuration)
+
+
+def get_rtc_configuration() -> RTCConfiguration:
+    global _rtc_configuration
+    current = settings.get()
+    if _rtc_configuration is None:
+        _rtc_configuration = _build_rtc_configuration(current)
+    return _rtc_configuration
+
+
+def offer_kinds(sdp: str) -> tuple[str, ...]:
+    """Media kinds of the offer's m-lines, in order."""
+    return tuple(line[2:].split(" ", 1)[0] for line in sdp.splitlines() if line.startswith("m="))
+
+
+async def _gather(pc: RTCPeerConnection) -> None:
+    await asyncio.gather(
+        *(t.receiver.transport.transport.iceGatherer.gather() for t in pc.getTransceivers())
+    )
+
+
+class WarmPeerPool:
+    """RTCPeerConnections with their ICE candidates gathered ahead of time.
+
+    aiortc cannot trickle its own candidates: setLocalDescription() returns
+    only once every candidate, STUN and TURN ones included, is gathered,
+    which would otherwise sit between each offer and its answer. Pooled
+    connections get one recvonly transceiver per m-line of an offer and are
+    only handed out for an offer with exactly those m-lines, so every
+    transport the answer can use is already gathered; a transport left
+    unmatched would keep the connection from ever reporting "connected".
+    Up to `size` connections are kept for the web client's m-lines and for
+    each other set of m-lines offered within the last `max_age` seconds, so
+    clients with different offers do not empty each other's pool.
+    """
+
+    def __init__(self, size: int = WEBRTC_PREWARM, max_age: float = WEBRTC_PREWARM_MAX_AGE):
+        self.size = size
+        self.max_age = max_age
+        # m-lines of the offers seen, with when they were last offered
+        self.kinds: dict[tuple[str, ...], float] = {DEFAULT_OFFER_KINDS: float("inf")}
+        # (created, kinds, configuration, pc), oldest first
+        self._ready: deque[tuple[float, tuple[str, ...], RTCConfiguration, RTCPeerConnection]] = deque()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def ready(self) -> int:
+        return len(self._ready)
+
+    def _wanted(self) -> list[tuple[str, ...]]:
+        now = time.monotonic()
+        return [kinds for kinds, offered in self.kinds.items() if now - offered < self.max_age]
+
+    def _usable(self, created: float, kinds: tuple[str, ...], config: RTCConfiguration) -> bool:
+        return (
+            kinds in self._wanted()
+            and config is get_rtc_configuration()
+            and time.monotonic() - created < self.max_age
+        )
 
-    pc = RTCPeerConnection(config)
-    await pcs_manager.add_peer(peer.id, pc)
+    def take(self, kinds: tuple[str, ...]) -> RTCPeerConnection | None:
+        if self._task is None:
+            return None
+        if kinds and set(kinds) <= {"audio", "video"}:
+            wanted = self._wanted()
+            if kinds not in wanted:
+                logger.info(f"Prewarming peer connections for {'+'.join(kinds)} offers")
+            self.kinds = {k: offered for k, offered in self.kinds.items() if k in wanted}
+            self.kinds[kinds] = max(self.kinds.get(kinds, 0.0), time.monotonic())
+        pc = None
+        for entry in list(self._ready):
+            created, pc_kinds, config, ready = entry
+            if not self._usable(created, pc_kinds, config):
+                self._ready.remove(entry)
+                asyncio.ensure_future(ready.close())
+            elif pc is None and pc_kinds == kinds:
+                self._ready.remove(entry)
+                pc = ready
+        self._wake.set()
+        return pc
+
+    async def start(self) -> None:
+        if self.size > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                for entry in [entry for entry in self._ready if not self._usable(*entry[:3])]:
+                    self._ready.remove(entry)
+                    await entry[3].close()
+                for kinds in self._wanted():
+                    while sum(entry[1] == kinds for entry in self._ready) < self.size:
+                        config = get_rtc_configuration()
+                        pc = RTCPeerConnection(config)
+                        for kind in kinds:
+                            pc.addTransceiver(kind, direction="recvonly")
+                        await _gather(pc)
+                        self._ready.append((time.monotonic(), kinds, config, pc))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Prewarming a peer connection failed")
+            self._wake.clear()
+            timeout = self.max_age - (time.monotonic() - self._ready[0][0]) if self._ready else self.max_age
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(timeout, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._ready:
+            await self._ready.popleft()[3].close()
+
+
+warm_pool = WarmPeerPool()
+
+
+async def handle_offer(peer: ClientModel, audio, video, camera: str | None = None) -> dict:
+    started = time.monotonic()
+    pc = warm_pool.take(offer_kinds(peer.offer.sdp))
+    ice = "cold" if pc is None else "warm"
+    if pc is None:
+        pc = RTCPeerConnection(get_rtc_configuration())
+    await pcs_manager.add_peer(peer.id, pc, camera)
 
     if audio:
         audio_sender = pc.addTrack(relay.subscribe(audio))
+        instrument_sender(audio_sender)
         logger.info(f"Audio sender created: {audio_sender}")
         force_codec(pc, audio_sender, "audio/opus")
 
-    video_sender = pc.addTrack(relay.subscribe(video))
+    if isinstance(video, MediaStreamTrack):
+        video_sender = pc.addTrack(relay.subscribe(video))
+    else:
+        # Shared encoder pipeline (VideoFanout or RenditionLadder)
+        video_sender = pc.addTrack(video.subscribe())
+        video.attach_sender(video_sender)
+        pcs_manager.watch_track(peer.id, pc, video_sender.track)
+    instrument_sender(video_sender)
     logger.info(f"Video sender created: {video_sender}")
     force_codec(pc, video_sender, "video/H264")
 
@@ -73,7 +259,8 @@ async def handle_offer(peer: ClientModel, audio, video) -> dict:
     @pc.on("iceconnectionstatechange")
     async def on_iceconnectionstatechange():
         logger.info(f"ICE connection state changed to: {pc.iceConnectionState}")
-        if pc.iceConnectionState in ("failed", "disconnected"):
+        # Not on "disconnected": the client may still restart ICE on this session.
+        if pc.iceConnectionState == "failed":
             try:
                 logger.info(f"ICE Connection failed for peer {peer.id}, cleaning up")
                 await pcs_manager.remove_peer(peer.id, pc)
@@ -83,7 +270,7 @@ async def handle_offer(peer: ClientModel, audio, video) -> dict:
     @pc.on("connectionstatechange")
     async def on_connectionstatechange():
         logger.info(f"Connection state changed to {pc.connectionState} for peer {peer.id}")
-        if pc.connectionState in ("closed", "failed", "disconnected"):
+        if pc.connectionState in ("closed", "failed"):
             try:
                 logger.info(f"Cleaning up connection for peer {peer.id}")
                 await pcs_manager.remove_peer(peer.id, pc)
@@ -100,7 +287,109 @@ async def handle_offer(peer: ClientModel, audio, video) -> dict:
     answer = await pc.createAnswer()
     await pc.setLocalDescription(answer)
 
+    elapsed = time.monotonic() - started
+    OFFER_ANSWER_SECONDS.observe(elapsed, ice=ice)
+    logger.info(f"Answered peer {peer.id} in {elapsed * 1000:.0f} ms ({ice} ICE)")
     return {
         "sdp": pc.localDescription.sdp,
         "type": pc.localDescription.type,
     }
+
+
+async def add_ice_candidate(candidate: IceCandidateModel) -> bool:
+    """Apply a candidate the client trickled after its offer; False if the
+    peer is not connected to this process."""
+    pc = pcs_manager.get_peer(candidate.id)
+    if pc is None:
+        return False
+    if not candidate.candidate:
+        await pc.addIceCandidate(None)  # end of candidates
+        return True
+    try:
+        ice_candidate = candidate_from_sdp(candidate.candidate.removeprefix("candidate:"))
+    except (AssertionError, IndexError, ValueError) as e:
+        raise ValueError(f"malformed candidate {candidate.candidate!r}") from e
+    ice_candidate.sdpMid = candidate.sdpMid
+    ice_candidate.sdpMLineIndex = candidate.sdpMLineIndex
+    await pc.addIceCandidate(ice_candidate)
+    return True
+
+
+_restart_checks: set[asyncio.Task] = set()
+
+
+async def _check_restarted(connection: aioice.Connection, deadline: float) -> None:
+    # connect() has long returned, so nothing else checks the new pairs. The
+    # old pair carries media until one of them is nominated.
+    connection._check_list_done = False
+    while not connection._closed and time.monotonic() < deadline and connection.check_periodic():
+        await asyncio.sleep(0.02)
+
+
+async def restart_ice_transport(transport: RTCIceTransport, offer: SessionDescription) -> None:
+    """Switches a connected ICE transport to the credentials and candidates
+    of a restart offer, with fresh local credentials; DTLS and SRTP run on
+    top unchanged."""
+    connection = transport.iceGatherer._connection
+    media = offer.media[0]  # bundled: every section carries the same ICE
+    if media.ice.usernameFragment == connection.remote_username:
+        raise ValueError("offer does not restart ICE (ice-ufrag unchanged)")
+    previous_ufrag = connection.local_username
+    connection._local_username = random_string(4)
+    connection._local_password = random_string(22)
+    udp_mux.rename(previous_ufrag, connection.local_username)
+    connection.remote_username = media.ice.usernameFragment
+    connection.remote_password = media.ice.password
+    connection._remote_candidates = []
+    connection._remote_candidates_end = False
+    connection._check_list = []
+    transport.iceGatherer._remote_candidates_end = False
+    for candidate in media.ice_candidates:
+        await transport.addRemoteCandidate(candidate)
+    if media.ice_candidates_complete:
+        await transport.addRemoteCandidate(None)
+    task = asyncio.create_task(_check_restarted(connection, time.monotonic() + WEBRTC_ICE_RESTART_GRACE))
+    _restart_checks.add(task)
+    task.add_done_callback(_restart_checks.discard)
+
+
+async def restart_ice(peer: ClientModel) -> dict | None:
+    """Answer a client's ICE restart offer on its existing connection, keeping
+    DTLS, SRTP and the encoder subscription; None if the peer has no live
+    connection in this process. ValueError if the offer is not an ICE restart
+    of that session."""
+    pc = pcs_manager.get_peer(peer.id)
+    if pc is None or pc.remoteDescription is None or pc.connectionState in ("closed", "failed"):
+        ICE_RESTARTS.inc(result="gone")
+        return None
+    transports = {
+        id(transceiver.sender.transport): transceiver.sender.transport.transport
+        for transceiver in pc.getTransceivers()
+        if transceiver.sender.transport is not None
+    }
+    # Past the grace window aioice has closed the connection for good.
+    if any(transport.iceGatherer._connection._closed for transport in transports.values()):
+        ICE_RESTARTS.inc(result="gone")
+        return None
+    try:
+        offer = SessionDescription.parse(peer.offer.sdp)
+        current = SessionDescription.parse(pc.remoteDescription.sdp)
+        if [m.rtp.muxId for m in offer.media] != [m.rtp.muxId for m in current.media]:
+            raise ValueError("restart offer changes the media sections")
+        if len(transports) != 1:
+            raise ValueError("ICE restart needs a bundled connection")
+        transport = next(iter(transports.values()))
+        await restart_ice_transport(transport, offer)
+    except ValueError:
+        ICE_RESTARTS.inc(result="invalid")
+        raise
+    ICE_RESTARTS.inc(result="restarted")
+    logger.info(f"Restarting ICE for peer {peer.id}")
+    # aiortc keeps the answer it created; only the ICE credentials change.
+    answer = SessionDescription.parse(pc.localDescription.sdp)
+    for media in answer.media:
+        media.ice = transport.iceGatherer.getLocalParameters()
+    return {
+        "sdp": str(answer),
+        "type": pc.localDescription.type,
+    }
@@ -1,10 +1,8 @@
 import json
 import logging
-import os
-import yaml
 import paho.mqtt.client as mqtt
 from src.components.event_logger import log_event
-from src.utils import get_secrets_path
+from services.config_service import settings
 
 logger = logging.getLogger("backend | mqtt_handler")
 
@@ -24,26 +22,9 @@ CAMERA_STATUS = {
 client = None
 
 def load_mqtt_config():
-    """Loads MQTT broker host, port and optional auth from .secrets.yaml."""
-    host = "localhost"
-    port = 1883
-    username = None
-    password = None
-
-    secrets_path = get_secrets_path()
-    if os.path.exists(secrets_path):
-        try:
-            with open(secrets_path, 'r') as file:
-                secrets = yaml.safe_load(file)
-                if secrets:
-                    host = secrets.get("MQTT_HOST", host)
-                    port = secrets.get("MQTT_PORT", port)
-                    username = secrets.get("MQTT_USERNAME", username)
-                    password = secrets.get("MQTT_PASSWORD", password)
-        except Exception as e:
-            logger.error(f"Error loading MQTT config from secrets: {e}")
-
-    return host, port, username, password
+    """MQTT broker host, port and optional auth from the shared settings."""
+    current = settings.get()
+    return current.mqtt_host, current.mqtt_port, current.mqtt_username, current.mqtt_password
 
 def on_connect(client, userdata, flags, rc, properties=None):
     """Callback when client connects to broker."""
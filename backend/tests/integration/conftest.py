@@ -12,12 +12,25 @@ from litestar.testing import AsyncTestClient
 from sqlalchemy import create_engine, delete, text
 from sqlalchemy.orm import sessionmaker
 
+from controllers.admin_controller import AdminController
 from controllers.chat_controller import chat_endpoint, chat_service
 from controllers.health_controller import health_check
+from controllers.hls_controller import HlsController
+from controllers.metrics_controller import metrics_endpoint
 from controllers.peer_count_controller import peer_count_endpoint
+from controllers.recording_controller import RecordingController
+from controllers.snapshot_controller import snapshot_endpoint
 from controllers.weather_controller import weather_endpoint
 from controllers.webrtc_controller import WebRTCController
 from models.orm import Base, ChatMessage
+from services.admission_service import OfferGate
+from services.broadcast_service import Broadcaster
+from services.camera_service import CameraConfig, CameraRegistry
+from services.cluster_service import LocalViewers
+from services.hls_service import HlsPackager
+from services.recording_service import Recorder
+from services.snapshot_service import SnapshotService
+from services.webrtc_service import pcs_manager
 
 load_dotenv(Path(__file__).resolve().parent.parent.parent / ".env")
 
@@ -56,12 +69,35 @@ def litestar_app(db_factory):
     @asynccontextmanager
     async def test_lifespan(app: Litestar):
         app.state.db = db_factory
-        app.state.audio = None
-        app.state.video = None
+        app.state.viewers = LocalViewers(pcs_manager)
+        app.state.offers = OfferGate()
+        await app.state.offers.start()
+        app.state.cameras = CameraRegistry(
+            [CameraConfig("default", "", "Camera")],
+            pcs_manager,
+            factory=lambda config: (None, None),
+            viewers=app.state.viewers,
+        )
+        app.state.peer_count = Broadcaster(
+            "peer_count",
+            lambda: {"count": app.state.viewers.count(), "cameras": app.state.cameras.viewer_counts()},
+        )
+        app.state.viewers.on_change(app.state.peer_count.notify)
+        await app.state.peer_count.start()
+        app.state.media = app.state.cameras.default.source
+        app.state.hls = HlsPackager(app.state.media)
+        app.state.snapshots = SnapshotService(app.state.media)
+        app.state.recorder = Recorder(app.state.media, directory="")
         RTCRtpSender.TRANSPORT_POOL_SIZE = 1000
         RTCRtpSender.TRANSPORT_PORT_MIN = 49152
         RTCRtpSender.TRANSPORT_PORT_MAX = 65535
         yield
+        await app.state.offers.stop()
+        await app.state.peer_count.stop()
+        await app.state.hls.stop()
+        await app.state.snapshots.stop()
+        await app.state.recorder.stop()
+        await app.state.cameras.stop()
 
     return Litestar(
         route_handlers=[
@@ -70,6 +106,11 @@ def litestar_app(db_factory):
             WebRTCController,
             chat_endpoint,
             peer_count_endpoint,
+            metrics_endpoint,
+            HlsController,
+            snapshot_endpoint,
+            RecordingController,
+            AdminController,
         ],
         lifespan=[test_lifespan],
         cors_config=CORSConfig(allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
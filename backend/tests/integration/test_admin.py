@@ -0,0 +1,32 @@
+import pytest
+
+from services.config_service import SettingsStore
+
+
+@pytest.fixture
+def admin_token(tmp_path, monkeypatch):
+    path = tmp_path / ".secrets.yaml"
+    path.write_text("ADMIN_TOKEN: hunter2\n")
+    monkeypatch.setattr("controllers.admin_controller.settings", SettingsStore(path, interval=0))
+    return "hunter2"
+
+
+async def test_admin_is_disabled_without_a_token(client, tmp_path, monkeypatch):
+    monkeypatch.setattr("controllers.admin_controller.settings", SettingsStore(tmp_path / "missing.yaml"))
+    response = await client.get("/admin/profile?seconds=0.1")
+    assert response.status_code == 403
+
+
+async def test_admin_rejects_a_wrong_token(client, admin_token):
+    response = await client.get("/admin/profile?seconds=0.1", headers={"Authorization": "Bearer nope"})
+    assert response.status_code == 401
+
+
+async def test_profile_returns_collapsed_stacks(client, admin_token):
+    response = await client.get(
+        "/admin/profile?seconds=0.2&hz=50", headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    stack, count = response.text.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0 and ";" in stack
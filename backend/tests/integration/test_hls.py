@@ -0,0 +1,16 @@
+async def test_playlist_unavailable_without_video_returns_503(client):
+    response = await client.get("/hls/stream.m3u8")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert response.headers["cache-control"] == "no-cache"
+
+
+async def test_unknown_media_name_returns_404(client):
+    response = await client.get("/hls/not-a-segment.ts")
+    assert response.status_code == 404
+    assert response.headers["cache-control"] == "no-cache"
+
+
+async def test_part_without_msn_returns_400(client):
+    response = await client.get("/hls/stream.m3u8?_HLS_part=1")
+    assert response.status_code == 400
@@ -0,0 +1,6 @@
+async def test_metrics_prometheus_text(client):
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE birdstream_capture_frames_total counter" in response.text
+    assert "# TYPE birdstream_peer_rtt_seconds histogram" in response.text
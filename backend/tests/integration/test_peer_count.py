@@ -11,3 +11,9 @@ async def test_peer_count_reflects_active_webrtc_peers(client):
     with await client.websocket_connect("/peer-count") as ws:
         msg = ws.receive_json()
         assert msg["count"] == 0
+
+
+async def test_peer_count_includes_per_camera_counts(client):
+    with await client.websocket_connect("/peer-count") as ws:
+        msg = ws.receive_json()
+        assert msg["cameras"] == {"default": 0}
@@ -0,0 +1,10 @@
+async def test_recordings_are_404_when_recording_is_disabled(client):
+    response = await client.get("/recordings")
+    assert response.status_code == 404
+
+
+async def test_clip_is_404_when_recording_is_disabled(client):
+    response = await client.get(
+        "/recordings/clip.mp4?start=2024-01-01T00:00:00Z&end=2024-01-01T00:01:00Z"
+    )
+    assert response.status_code == 404
@@ -0,0 +1,9 @@
+async def test_snapshot_unavailable_without_video_returns_503(client):
+    response = await client.get("/snapshot.jpg")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+async def test_snapshot_rejects_unlisted_width(client):
+    response = await client.get("/snapshot.jpg?width=333")
+    assert response.status_code == 400
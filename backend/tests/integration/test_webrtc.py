@@ -1,3 +1,8 @@
+from aiortc import RTCPeerConnection
+
+from services.webrtc_service import pcs_manager
+
+
 async def test_offer_empty_sdp_returns_400(client):
     response = await client.post(
         "/webrtc/offer",
@@ -40,6 +45,27 @@ async def test_get_peers_verbose_returns_dict(client):
     assert isinstance(response.json(), dict)
 
 
+async def test_get_peers_revalidates_with_etag(client):
+    response = await client.get("/webrtc/getpeers?limit=10")
+    assert response.status_code == 200
+    assert int(response.headers["x-total-count"]) >= len(response.json())
+    etag = response.headers["etag"]
+
+    response = await client.get("/webrtc/getpeers?limit=10", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+async def test_get_peers_rejects_bad_pagination(client):
+    response = await client.get("/webrtc/getpeers?offset=-1")
+    assert response.status_code == 400
+
+
+async def test_peer_states_shape(client):
+    response = await client.get("/webrtc/peer-states")
+    assert response.status_code == 200
+    assert response.json().keys() == {"connection", "ice"}
+
+
 async def test_webrtc_config_shape(client):
     response = await client.get("/webrtc/config")
     assert response.status_code == 200
@@ -47,3 +73,58 @@ async def test_webrtc_config_shape(client):
     assert {"pool_size", "port_min", "port_max", "port_range"} <= body.keys()
     assert body["port_range"] == body["port_max"] - body["port_min"] + 1
     assert body["port_min"] < body["port_max"]
+
+
+async def test_offer_for_unknown_camera_returns_404(client):
+    response = await client.post(
+        "/webrtc/offer?camera=garden",
+        json={"id": "t3", "offer": {"type": "offer", "sdp": "v=0\r\n"}},
+    )
+    assert response.status_code == 404
+
+
+async def test_ice_restart_for_unknown_peer_returns_404(client):
+    response = await client.post(
+        "/webrtc/ice-restart",
+        json={"id": "t4", "offer": {"type": "offer", "sdp": "v=0\r\n"}},
+    )
+    assert response.status_code == 404
+
+
+async def test_cameras_lists_the_registry(client):
+    response = await client.get("/webrtc/cameras")
+    assert response.status_code == 200
+    assert [camera["id"] for camera in response.json()] == ["default"]
+    assert response.json()[0]["viewers"] == 0
+
+
+async def test_offer_over_peer_limit_returns_503(client):
+    viewers = client.app.state.viewers
+    viewers.max_peers = 1
+    try:
+        async with viewers.admission():  # another offer holds the only slot
+            response = await client.post(
+                "/webrtc/offer",
+                json={"id": "t4", "offer": {"type": "offer", "sdp": "v=0\r\n"}},
+            )
+    finally:
+        viewers.max_peers = 0
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "10"
+
+
+async def test_candidate_for_unknown_peer_returns_404(client):
+    response = await client.post(
+        "/webrtc/candidate",
+        json={"id": "nobody", "candidate": "candidate:1 1 udp 2122260223 192.168.1.2 50000 typ host"},
+    )
+    assert response.status_code == 404
+
+
+async def test_invalid_candidate_returns_400(client):
+    await pcs_manager.add_peer("t5", RTCPeerConnection())
+    try:
+        response = await client.post("/webrtc/candidate", json={"id": "t5", "candidate": "candidate:bogus"})
+    finally:
+        await pcs_manager.clean_up()
+    assert response.status_code == 400
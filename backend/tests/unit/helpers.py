@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+import numpy as np
+
+
+async def eventually(condition, timeout: float = 5.0) -> None:
+    """Wait for `condition()` to hold, failing the test after `timeout` seconds."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+class FakeCamera:
+    """Stands in for cv2.VideoCapture; each frame is filled with its read count."""
+
+    def __init__(self, *args):
+        self.reads = 0
+
+    def read(self):
+        time.sleep(0.01)  # a blocking read, like a real device
+        self.reads += 1
+        return True, np.full((48, 64, 3), self.reads % 256, dtype=np.uint8)
+
+    def release(self):
+        pass
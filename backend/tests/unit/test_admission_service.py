@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from services import admission_service
+from services.admission_service import LoadMonitor, OfferGate, OfferRejectedError, retry_after
+from tests.unit.helpers import eventually
+
+
+class FakeMonitor(LoadMonitor):
+    def __init__(self, cpu: float = 0.0, encoder: float = 0.0):
+        super().__init__()
+        self.cores = 4
+        self.cpu, self.encoder = cpu, encoder
+
+    def sample(self) -> None:
+        for callback in self.listeners[:]:
+            callback()
+
+
+async def _hold(gate: OfferGate, release: asyncio.Event, admitted: list[int], n: int) -> None:
+    async with gate.slot():
+        admitted.append(n)
+        await release.wait()
+
+
+async def test_concurrency_is_bounded_and_a_full_queue_is_refused():
+    gate = OfferGate(FakeMonitor(), concurrency=2, queue_size=1, queue_timeout=5, cpu_target=0)
+    release, admitted = asyncio.Event(), []
+    tasks = [asyncio.create_task(_hold(gate, release, admitted, n)) for n in range(3)]
+    await eventually(lambda: gate.waiting == 1)
+    assert admitted == [0, 1]
+
+    with pytest.raises(OfferRejectedError) as rejected:
+        async with gate.slot():
+            pass
+    assert rejected.value.reason == "queue_full"
+    assert admission_service.WEBRTC_RETRY_AFTER <= rejected.value.retry_after
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert admitted == [0, 1, 2] and gate.active == 0
+
+
+async def test_offers_wait_for_cpu_headroom():
+    monitor = FakeMonitor(cpu=0.8)
+    gate = OfferGate(monitor, concurrency=10, queue_size=10, queue_timeout=5, peer_budget=0.2, cpu_target=0.85)
+    release, admitted = asyncio.Event(), []
+    # With nothing in flight one offer always goes through.
+    tasks = [asyncio.create_task(_hold(gate, release, admitted, n)) for n in range(3)]
+    await eventually(lambda: gate.waiting == 2)
+    assert admitted == [0]
+
+    # Load drops: each viewer adds 0.2 of 4 cores, room for the other two.
+    monitor.cpu = 0.7
+    monitor.sample()
+    await eventually(lambda: admitted == [0, 1, 2])
+    release.set()
+    await asyncio.gather(*tasks)
+
+
+async def test_busy_encoder_refuses_after_the_queue_timeout():
+    gate = OfferGate(FakeMonitor(encoder=1.3), concurrency=10, queue_size=10, queue_timeout=0.05)
+    release = asyncio.Event()
+    first = asyncio.create_task(_hold(gate, release, [], 0))
+    await eventually(lambda: gate.active == 1)
+    with pytest.raises(OfferRejectedError) as rejected:
+        async with gate.slot():
+            pass
+    assert rejected.value.reason == "overloaded"
+    assert gate.waiting == 0
+    release.set()
+    await first
+
+
+def test_retry_after_is_jittered(monkeypatch):
+    monkeypatch.setattr(admission_service, "WEBRTC_RETRY_AFTER", 5)
+    monkeypatch.setattr(admission_service, "WEBRTC_RETRY_JITTER", 1.0)
+    values = {retry_after() for _ in range(200)}
+    assert min(values) >= 5 and max(values) <= 10 and len(values) > 3
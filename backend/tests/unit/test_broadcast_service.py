@@ -0,0 +1,77 @@
+import asyncio
+
+from services.broadcast_service import BROADCAST_DROPPED, Broadcaster
+from tests.unit.helpers import eventually
+
+
+class FakeSocket:
+    def __init__(self, blocked: bool = False):
+        self.sent: list[str] = []
+        self.unblocked = asyncio.Event()
+        self.closed = False
+        if not blocked:
+            self.unblocked.set()
+
+    async def send_text(self, data: str) -> None:
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000, reason: str | None = None) -> None:
+        self.closed = True
+
+
+async def test_changes_are_coalesced_and_serialized_once():
+    state = {"count": 0}
+    renders = []
+
+    def render() -> dict:
+        renders.append(1)
+        return dict(state)
+
+    hub = Broadcaster("test", render, max_rate=10, refresh=60)
+    sockets = [FakeSocket() for _ in range(50)]
+    for socket in sockets:
+        hub.subscribe(socket)
+    await hub.start()
+    try:
+        await eventually(lambda: all(len(s.sent) == 1 for s in sockets))  # sent on subscribe
+        renders.clear()
+        for count in range(1, 101):
+            state["count"] = count
+            hub.notify()
+            await asyncio.sleep(0)
+        await eventually(lambda: all(s.sent[-1] == '{"count":100}' for s in sockets))
+        assert len(renders) <= 3
+        assert all(s.sent[-1] is sockets[0].sent[-1] for s in sockets)  # the same string object
+    finally:
+        await hub.stop()
+
+
+async def test_slow_subscriber_only_gets_the_newest_update():
+    state = {"count": 0}
+    hub = Broadcaster("test", lambda: dict(state), max_rate=100, refresh=60)
+    slow, fast = FakeSocket(blocked=True), FakeSocket()
+    hub.subscribe(slow)
+    hub.subscribe(fast)
+    for count in range(1, 6):
+        state["count"] = count
+        hub.publish()
+        await asyncio.sleep(0)
+    # The fast subscriber is not held up by the slow one.
+    await eventually(lambda: fast.sent[-1:] == ['{"count":5}'])
+    assert slow.sent == []
+
+    slow.unblocked.set()
+    await eventually(lambda: len(slow.sent) == 2)
+    assert slow.sent == ['{"count":0}', '{"count":5}']
+    await hub.stop()
+
+
+async def test_blocked_subscriber_is_dropped():
+    hub = Broadcaster("test", lambda: {"count": 0}, send_timeout=0.05)
+    stuck = FakeSocket(blocked=True)
+    before = BROADCAST_DROPPED.get(channel="test")
+    hub.subscribe(stuck)
+    await eventually(lambda: stuck.closed)
+    assert hub.subscriber_count == 0
+    assert BROADCAST_DROPPED.get(channel="test") == before + 1
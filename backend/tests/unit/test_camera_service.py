@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from aiortc import VideoStreamTrack
+
+from services.camera_service import CameraConfig, CameraRegistry, load_cameras, suspend_grace
+from services.connection_manager import ConnectionManager
+
+
+def test_load_cameras_from_yaml(tmp_path):
+    path = tmp_path / "cameras.yaml"
+    path.write_text(
+        "cameras:\n"
+        "  feeder: {source: /dev/video0, name: Feeder, capture: opencv}\n"
+        "  nestbox: {source: 'srt://0.0.0.0:9000'}\n"
+    )
+    feeder, nestbox = load_cameras(str(path))
+    assert (feeder.id, feeder.name, feeder.capture) == ("feeder", "Feeder", "opencv")
+    assert (nestbox.id, nestbox.name, nestbox.source) == ("nestbox", "nestbox", "srt://0.0.0.0:9000")
+    assert suspend_grace(nestbox) < 0 <= suspend_grace(feeder)
+
+
+def test_load_cameras_falls_back_to_video_source(tmp_path, monkeypatch):
+    monkeypatch.setenv("VIDEO_SOURCE", "/media/birbs.mp4")
+    (camera,) = load_cameras(str(tmp_path / "missing.yaml"))
+    assert (camera.id, camera.source) == ("default", "/media/birbs.mp4")
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "cameras:\n  Bad Id: {source: /dev/video0}\n",
+        "cameras:\n  feeder: {name: Feeder}\n",
+        "cameras:\n  feeder: {source: /dev/video0, capture: gstreamer}\n",
+        "cameras: {}\n",
+    ],
+)
+def test_load_cameras_rejects_invalid_config(tmp_path, body):
+    path = tmp_path / "cameras.yaml"
+    path.write_text(body)
+    with pytest.raises(ValueError):
+        load_cameras(str(path))
+
+
+async def test_cameras_open_lazily_and_idle_independently(monkeypatch):
+    monkeypatch.setattr("services.camera_service.VIDEO_SUSPEND_GRACE", 0.05)
+    opened: list[str] = []
+
+    def factory(config: CameraConfig):
+        opened.append(config.id)
+        return None, VideoStreamTrack()
+
+    manager = ConnectionManager()
+    registry = CameraRegistry(
+        [CameraConfig("feeder", "/dev/video0", "Feeder"), CameraConfig("nestbox", "/dev/video1", "Nest")],
+        manager,
+        factory=factory,
+    )
+    await registry.start()
+    assert opened == ["feeder"]
+    assert registry.get() is registry.get("feeder")
+    assert registry.get("garden") is None
+
+    nestbox = registry.get("nestbox")
+    await nestbox.source.acquire()
+    await manager.add_peer("viewer", _FakePc(), camera="nestbox")
+    assert opened == ["feeder", "nestbox"]
+    assert registry.viewer_counts() == {"feeder": 0, "nestbox": 1}
+
+    await asyncio.sleep(0.15)
+    assert not registry.get("feeder").source.active
+    assert nestbox.source.active
+
+    await registry.stop()
+
+
+class _FakePc:
+    connectionState = "new"
+    iceConnectionState = "new"
+
+    def on(self, event, f=None):
+        pass
+
+    def getTransceivers(self):
+        return []
+
+    async def close(self):
+        pass
@@ -0,0 +1,194 @@
+import asyncio
+
+import pytest
+from aiortc import RTCPeerConnection, VideoStreamTrack
+from litestar import Litestar, get
+from litestar.params import FromPath, FromQuery
+from uvicorn import Config, Server
+
+from services.cluster_service import ClusterClient, Coordinator, LocalViewers, PeerLimitError, forward_to_primary
+from services.connection_manager import ConnectionManager
+from tests.unit.helpers import eventually
+
+
+@pytest.fixture
+async def cluster(tmp_path):
+    coordinator = Coordinator(str(tmp_path / "coordinator.sock"), max_peers=2)
+    await coordinator.start()
+    clients = []
+
+    async def join(worker: int) -> ClusterClient:
+        client = ClusterClient(ConnectionManager(), worker=worker, path=coordinator.path, max_peers=2)
+        await client.start()
+        await eventually(lambda: client.connected and worker in coordinator.workers)
+        clients.append(client)
+        return client
+
+    yield coordinator, join
+    for client in clients:
+        await client.manager.clean_up()
+        await client.stop()
+    await coordinator.stop()
+
+
+async def test_peers_are_listed_across_workers_and_evicted_on_move(cluster):
+    coordinator, join = cluster
+    first, second = await join(0), await join(1)
+
+    await first.manager.add_peer("alice", RTCPeerConnection(), "feeder")
+    await second.manager.add_peer("bob", RTCPeerConnection(), "nestbox")
+    await eventually(lambda: first.count() == 2 and second.count() == 2)
+    assert first.peers()["bob"] == {"camera": "nestbox", "worker": 1}
+    assert second.camera_counts() == {"feeder": 1, "nestbox": 1}
+
+    # alice reloads and her new offer lands on the other worker.
+    await second.manager.add_peer("alice", RTCPeerConnection(), "feeder")
+    await eventually(lambda: "alice" not in first.manager.pcs)
+    await eventually(lambda: first.peers().get("alice", {}).get("worker") == 1)
+
+
+async def test_state_index_follows_connection_changes():
+    manager = ConnectionManager()
+    pc = RTCPeerConnection()
+    await manager.add_peer("alice", pc, "feeder")
+    await manager.add_peer("bob", RTCPeerConnection(), "feeder")
+    assert manager.state_counts() == {"connection": {"new": 2}, "ice": {"new": 2}}
+
+    version = manager.version
+    await pc.close()
+    assert manager.version > version
+    assert manager.peers_in_state("closed") == {"alice"}
+    assert manager.peers_in_state("new", "new") == {"bob"}
+
+    await manager.remove_peer("alice", pc)
+    assert manager.state_counts() == {"connection": {"new": 1}, "ice": {"new": 1}}
+    await manager.clean_up()
+    assert manager.state_counts() == {"connection": {}, "ice": {}}
+
+
+async def test_snapshots_are_cached_until_the_peers_change():
+    directory = LocalViewers(ConnectionManager())
+    for peer_id, camera in (("alice", "feeder"), ("bob", "nestbox"), ("carol", "feeder")):
+        await directory.manager.add_peer(peer_id, RTCPeerConnection(), camera)
+    try:
+        first = directory.snapshot()
+        assert first.body == b'["alice","bob","carol"]' and first.total == 3
+        assert directory.snapshot() is first
+
+        page = directory.snapshot(camera="feeder", offset=1, limit=1)
+        assert page.body == b'["carol"]' and page.total == 2
+        assert b"local_description" not in directory.snapshot(verbose=True).body
+        assert b"local_description" in directory.snapshot(verbose=True, sdp=True).body
+
+        await directory.manager.remove_peer("bob", directory.manager.get_peer("bob"))
+        second = directory.snapshot()
+        assert second.body == b'["alice","carol"]' and second.etag != first.etag
+    finally:
+        await directory.manager.clean_up()
+
+
+async def test_verbose_snapshots_follow_negotiation_and_rendition_switches():
+    directory = LocalViewers(ConnectionManager())
+    pc = RTCPeerConnection()
+    track = VideoStreamTrack()
+    await directory.manager.add_peer("alice", pc, "feeder")
+    directory.manager.watch_track("alice", pc, pc.addTrack(track).track)
+    try:
+        before = directory.snapshot(verbose=True)
+        await pc.setLocalDescription(await pc.createOffer())  # signaling and gathering states
+        negotiated = directory.snapshot(verbose=True)
+        assert negotiated.etag != before.etag
+        assert b'"signalingState":"have-local-offer"' in negotiated.body
+
+        version = directory.manager.version
+        track.emit("renditionchange")  # AdaptiveVideoTrack after a switch
+        assert directory.manager.version == version + 1
+        assert directory.snapshot(verbose=True) is not negotiated  # rebuilt, not served from cache
+    finally:
+        await directory.manager.clean_up()
+
+
+async def test_admission_limit_is_shared_by_all_workers(cluster):
+    coordinator, join = cluster
+    first, second = await join(0), await join(1)
+
+    async with first.admission():
+        await first.manager.add_peer("alice", RTCPeerConnection(), "feeder")
+        # alice is still negotiating, and her slot is held.
+        async with second.admission():
+            with pytest.raises(PeerLimitError):
+                async with first.admission():
+                    pass
+    await eventually(lambda: not any(worker.reservations for worker in coordinator.workers.values()))
+    async with second.admission():
+        pass
+
+
+async def test_topics_reach_other_workers_and_retained_ones_late_joiners(cluster):
+    coordinator, join = cluster
+    first, second = await join(0), await join(1)
+    received: list[tuple[int, dict]] = []
+    for worker, client in ((0, first), (1, second)):
+        client.subscribe("chat", lambda data, worker=worker: received.append((worker, data)))
+
+    first.publish("chat", {"text": "hi"})
+    first.publish("weather", {"city": "Utrecht"}, retain=True)
+    await eventually(lambda: received)
+    assert received == [(1, {"text": "hi"})]
+
+    weather: list[dict] = []
+    late = ClusterClient(ConnectionManager(), worker=2, path=coordinator.path)
+    late.subscribe("weather", weather.append)
+    await late.start()
+    await eventually(lambda: weather)
+    assert weather == [{"city": "Utrecht"}]
+    await late.stop()
+
+
+async def test_forward_to_primary_replays_the_request(tmp_path):
+    @get("/hls/{name:str}", sync_to_thread=False)
+    def segment(name: FromPath[str], part: FromQuery[int] = 0) -> dict:
+        return {"name": name, "part": part}
+
+    path = str(tmp_path / "primary.sock")
+    server = Server(Config(Litestar([segment]), uds=path, log_level="warning", lifespan="off"))
+    serving = asyncio.create_task(server.serve())
+    await eventually(lambda: server.started)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/hls/live.m3u8",
+        "raw_path": b"/hls/live.m3u8",
+        "query_string": b"part=3",
+        "headers": [(b"host", b"birds.local"), (b"connection", b"keep-alive")],
+    }
+    sent: list[dict] = []
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    await forward_to_primary(scope, receive, send, path=path)
+    server.should_exit = True
+    await serving
+
+    assert sent[0]["status"] == 200
+    assert (b"content-type", b"application/json") in sent[0]["headers"]
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b'{"name":"live.m3u8","part":3}'
+
+
+async def test_forward_to_primary_without_primary_is_unavailable(tmp_path):
+    sent: list[dict] = []
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b""}
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/snapshot.jpg", "query_string": b"", "headers": []}
+    await forward_to_primary(scope, receive, send, path=str(tmp_path / "missing.sock"))
+    assert sent[0]["status"] == 503
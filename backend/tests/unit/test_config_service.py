@@ -0,0 +1,71 @@
+import os
+
+from services import webrtc_service
+from services.config_service import Settings, SettingsStore
+
+
+def _write(path, text: str, mtime_ns: int) -> None:
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_settings_are_parsed_once_until_the_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / ".secrets.yaml"
+    _write(path, "WEATHER_API_KEY: abc\nMQTT_PORT: '8883'\n", 1_000_000_000)
+    store = SettingsStore(path, interval=0)
+    changes: list[Settings] = []
+    store.on_change(changes.append)
+
+    assert store.get() == Settings(weather_api_key="abc", mqtt_port=8883)
+    parses = []
+    monkeypatch.setattr("services.config_service.yaml.safe_load", lambda file: parses.append(1) or {})
+    store.get()
+    store.get()
+    assert parses == []
+
+    _write(path, "WEATHER_API_KEY: xyz\n", 2_000_000_000)
+    monkeypatch.undo()
+    assert store.get().weather_api_key == "xyz"
+    assert [s.weather_api_key for s in changes] == ["abc", "xyz"]
+
+
+def test_reload_is_rate_limited_by_interval(tmp_path):
+    path = tmp_path / ".secrets.yaml"
+    _write(path, "WEATHER_API_KEY: abc\n", 1_000_000_000)
+    store = SettingsStore(path, interval=3600)
+    assert store.get().weather_api_key == "abc"
+    _write(path, "WEATHER_API_KEY: xyz\n", 2_000_000_000)
+    assert store.get().weather_api_key == "abc"
+    assert store.reload()
+    assert store.get().weather_api_key == "xyz"
+
+
+def test_broken_or_missing_file(tmp_path):
+    path = tmp_path / ".secrets.yaml"
+    store = SettingsStore(path, interval=0)
+    assert store.get() == Settings()
+
+    _write(path, "OPENRELAY_TURN_USERNAME: robin\n", 1_000_000_000)
+    assert store.get().turn_username == "robin"
+    _write(path, "OPENRELAY_TURN_USERNAME: [unclosed\n", 2_000_000_000)
+    assert store.get().turn_username == "robin"
+    path.unlink()
+    assert store.get() == Settings()
+
+
+def test_rtc_configuration_is_shared_until_settings_change(tmp_path, monkeypatch):
+    path = tmp_path / ".secrets.yaml"
+    _write(path, "OPENRELAY_TURN_USERNAME: robin\n", 1_000_000_000)
+    store = SettingsStore(path, interval=0)
+    monkeypatch.setattr(webrtc_service, "settings", store)
+    monkeypatch.setattr(webrtc_service, "_rtc_configuration", None)
+    store.on_change(webrtc_service._invalidate_rtc_configuration)
+
+    config = webrtc_service.get_rtc_configuration()
+    assert webrtc_service.get_rtc_configuration() is config
+    assert config.iceServers[1].username == "robin"
+
+    _write(path, "OPENRELAY_TURN_USERNAME: wren\n", 2_000_000_000)
+    rebuilt = webrtc_service.get_rtc_configuration()
+    assert rebuilt is not config
+    assert rebuilt.iceServers[1].username == "wren"
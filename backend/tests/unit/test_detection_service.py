@@ -0,0 +1,167 @@
+import asyncio
+import itertools
+import time
+
+import numpy as np
+import pytest
+from aiortc import VideoStreamTrack
+from av import VideoFrame
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from models.orm import Base, BirdDetection
+from services import detection_service
+from services.connection_manager import ConnectionManager
+from services.detection_service import (
+    AdaptiveSampler,
+    DetectionService,
+    MotionDetector,
+    crop,
+    run_detector,
+)
+from services.encoder_service import EncodingFanout
+from services.frame_bus_service import FrameBus
+from services.source_service import MediaSource
+
+
+def fake_detector(image: np.ndarray) -> list[tuple[str, float]]:
+    return [("great tit", 0.9), ("shadow", 0.1)]
+
+
+def _frame(x: int) -> np.ndarray:
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    frame[100:140, x : x + 40] = 255
+    return frame
+
+
+class _MovingTrack(VideoStreamTrack):
+    def __init__(self):
+        super().__init__()
+        self.frames = 0
+
+    async def recv(self) -> VideoFrame:
+        pts, time_base = await self.next_timestamp()
+        self.frames += 1
+        frame = VideoFrame.from_ndarray(_frame(20 + (self.frames * 7) % 240), format="bgr24")
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+
+async def _stored(db_factory) -> list[BirdDetection]:
+    for _ in range(100):
+        await asyncio.sleep(0.1)
+        with db_factory() as session:
+            rows = session.execute(select(BirdDetection)).scalars().all()
+        if rows:
+            return rows
+    return []
+
+
+def test_motion_detector_finds_the_moving_region():
+    motion = MotionDetector()
+    assert motion.regions(_frame(20)) == []  # first frame only seeds the background
+    assert motion.regions(_frame(20)) == []
+
+    boxes = motion.regions(_frame(200))
+    assert len(boxes) >= 1
+    x, y, w, h = boxes[0]
+    assert x <= 200 and x + w >= 240
+    assert y <= 100 and y + h >= 140
+    assert crop(_frame(200), boxes[0]).shape[2] == 3
+
+
+def test_sampler_paces_to_the_pool_and_backs_off():
+    sampler = AdaptiveSampler(workers=2, min_interval=0.1, max_interval=5, max_delay=2, max_depth=8)
+    assert sampler.due(0.0) and not sampler.due(0.05) and sampler.due(0.1)
+    assert sampler.depth == 8
+
+    sampler.observe(1.0)  # two workers at 1 s per job
+    assert sampler.interval == pytest.approx(0.625)
+    assert sampler.depth == 3
+
+    sampler.backoff()
+    assert sampler.interval == pytest.approx(1.25)
+    sampler.observe(0.01)
+    assert sampler.interval < 1.25
+
+
+@pytest.mark.parametrize(
+    "video", [lambda: EncodingFanout(_MovingTrack()), _MovingTrack], ids=["shared", "per-peer"]
+)
+async def test_detections_are_batched_into_the_database(monkeypatch, tmp_path, video):
+    monkeypatch.setattr(detection_service, "DETECTION_FLUSH_INTERVAL", 0.2)
+    engine = create_engine(f"sqlite:///{tmp_path / 'detections.db'}")
+    Base.metadata.create_all(engine)
+    db_factory = sessionmaker(bind=engine)
+
+    source = MediaSource(lambda: (None, video()), ConnectionManager())
+    service = DetectionService(
+        source, db_factory, detector=f"{__name__}:fake_detector", workers=1, bus_name="birdstream-test-detection"
+    )
+    await service.start()
+    try:
+        assert service.running
+        assert {row.species for row in await _stored(db_factory)} == {"great tit"}
+    finally:
+        await service.stop()
+        await source.stop()
+        engine.dispose()
+
+
+async def test_detection_reads_the_capture_frame_bus(monkeypatch, tmp_path):
+    monkeypatch.setattr(detection_service, "DETECTION_FLUSH_INTERVAL", 0.2)
+    monkeypatch.setattr(DetectionService, "_decode", None)  # nothing may be decoded
+    engine = create_engine(f"sqlite:///{tmp_path / 'detections.db'}")
+    Base.metadata.create_all(engine)
+    db_factory = sessionmaker(bind=engine)
+    capture = FrameBus(slots=4, slot_size=_frame(0).nbytes, name="birdstream-test-capture")
+
+    async def publish():
+        for i in itertools.count():
+            capture.publish(_frame(20 + (i * 7) % 240), 0, time.time())
+            await asyncio.sleep(1 / 30)
+
+    publisher = asyncio.create_task(publish())
+    # The encoded stream never moves; only the capture bus does.
+    source = MediaSource(lambda: (None, EncodingFanout(VideoStreamTrack())), ConnectionManager())
+    service = DetectionService(
+        source,
+        db_factory,
+        detector=f"{__name__}:fake_detector",
+        workers=1,
+        bus_name="birdstream-test-detection",
+        capture_bus="birdstream-test-capture",
+    )
+    await service.start()
+    try:
+        assert await _stored(db_factory)
+    finally:
+        await service.stop()
+        await source.stop()
+        publisher.cancel()
+        capture.close()
+        engine.dispose()
+
+
+def test_worker_crops_from_the_frame_bus(monkeypatch):
+    monkeypatch.setattr(detection_service, "_detector", lambda image: [("robin", float(image.shape[1]))])
+    monkeypatch.setattr(detection_service, "_frames", None)
+    bus = FrameBus(slots=3, slot_size=_frame(0).nbytes, name="birdstream-test-detection")
+    try:
+        sequence = bus.publish(_frame(0), 0, 0.0)
+        assert run_detector(bus.name, sequence, [(0, 0, 40, 20)]) == [("robin", 50.0)]
+        for x in range(3):
+            bus.publish(_frame(x), 0, 0.0)
+        assert run_detector(bus.name, sequence, [(0, 0, 40, 20)]) is None  # overwritten
+    finally:
+        detection_service._frames.close()
+        bus.close()
+
+
+async def test_detection_is_disabled_without_a_detector():
+    source = MediaSource(lambda: (None, None), ConnectionManager())
+    service = DetectionService(source, lambda: None, detector="")
+    await service.start()
+    assert not service.running
+    assert not source.active
+    await service.stop()
@@ -0,0 +1,133 @@
+import asyncio
+
+import av
+from aiortc import VideoStreamTrack
+
+from services import encoder_service
+from services.encoder_service import TIME_TO_FIRST_FRAME, EncodingFanout, VideoFanout, sender_hooks
+
+
+class _ScriptedFanout(VideoFanout):
+    """Emits numbered packets with a keyframe every `gop` packets, like a passthrough source."""
+
+    def __init__(self, gop: int):
+        super().__init__()
+        self.gop = gop
+        self.sent = 0
+
+    async def _next_packets(self) -> list[av.Packet]:
+        await asyncio.sleep(0.001)
+        packet = av.Packet(b"\x00\x00\x00\x01")
+        packet.pts = self.sent
+        packet.is_keyframe = self.sent % self.gop == 0
+        self.sent += 1
+        return [packet]
+
+
+async def test_subscribers_share_the_same_encoded_packets():
+    fanout = EncodingFanout(VideoStreamTrack())
+    first = fanout.subscribe()
+    second = fanout.subscribe()
+    try:
+        a = await asyncio.wait_for(first.recv(), timeout=5)
+        b = await asyncio.wait_for(second.recv(), timeout=5)
+        assert a is b
+        assert a.is_keyframe
+    finally:
+        await fanout.stop()
+
+
+async def test_running_encoders_report_their_load():
+    fanout = EncodingFanout(VideoStreamTrack())
+    track = fanout.subscribe()
+    try:
+        await asyncio.wait_for(track.recv(), timeout=5)
+        assert fanout.load > 0
+        assert encoder_service.encoder_load() >= fanout.load
+    finally:
+        await fanout.stop()
+    assert encoder_service.encoder_load() == 0
+
+
+async def test_late_subscriber_starts_on_a_keyframe():
+    fanout = EncodingFanout(VideoStreamTrack())
+    early = fanout.subscribe()
+    try:
+        for _ in range(5):
+            await asyncio.wait_for(early.recv(), timeout=5)
+        late = fanout.subscribe()
+        packet = await asyncio.wait_for(late.recv(), timeout=5)
+        assert packet.is_keyframe
+    finally:
+        await fanout.stop()
+
+
+async def test_stopped_subscriber_is_released():
+    fanout = EncodingFanout(VideoStreamTrack())
+    track = fanout.subscribe()
+    assert fanout.subscriber_count == 1
+    track.stop()
+    assert fanout.subscriber_count == 0
+    await fanout.stop()
+
+
+async def test_joining_subscriber_replays_cached_gop():
+    fanout = _ScriptedFanout(gop=10)
+    early = fanout.subscribe()
+    try:
+        while fanout.sent < 14:
+            await asyncio.wait_for(early.recv(), timeout=5)
+        before = TIME_TO_FIRST_FRAME.get(source="cache")
+
+        late = fanout.subscribe()
+        packets = [await asyncio.wait_for(late.recv(), timeout=5) for _ in range(8)]
+        assert packets[0].is_keyframe and packets[0].pts == 10
+        assert [p.pts for p in packets] == list(range(10, 18))
+        assert TIME_TO_FIRST_FRAME.get(source="cache") == before + 1
+    finally:
+        await fanout.stop()
+
+
+async def test_gop_longer_than_cache_waits_for_next_keyframe(monkeypatch):
+    monkeypatch.setattr(encoder_service, "KEYFRAME_CACHE_SIZE", 5)
+    fanout = _ScriptedFanout(gop=10)
+    early = fanout.subscribe()
+    try:
+        while fanout.sent < 17:
+            await asyncio.wait_for(early.recv(), timeout=5)
+        late = fanout.subscribe()
+        packet = await asyncio.wait_for(late.recv(), timeout=5)
+        assert packet.is_keyframe and packet.pts == 20
+    finally:
+        await fanout.stop()
+
+
+async def test_unprimed_subscriber_does_not_replay_the_cache():
+    fanout = _ScriptedFanout(gop=10)
+    early = fanout.subscribe()
+    try:
+        while fanout.sent < 12:
+            await asyncio.wait_for(early.recv(), timeout=5)
+        switch = fanout.subscribe(prime=False)
+        packet = await asyncio.wait_for(switch.recv(), timeout=5)
+        assert packet.pts == 20
+    finally:
+        await fanout.stop()
+
+
+class _Sender:
+    def __init__(self):
+        self.handled = []
+
+    async def _handle_rtcp_packet(self, packet) -> None:
+        self.handled.append(packet)
+
+
+async def test_sender_rtcp_is_wrapped_once_for_all_observers():
+    sender, seen = _Sender(), []
+    sender_hooks(sender).on_rtcp(seen.append)
+    sender_hooks(sender).on_rtcp(lambda packet: seen.append(packet * 10))
+    sender_hooks(sender).route_keyframes(lambda: None)
+    await sender._handle_rtcp_packet(1)
+    assert seen == [1, 10]
+    assert sender.handled == [1]
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from services import video_service
+from services.frame_bus_service import FrameBus, FrameBusReader
+from services.video_service import VIDEO_FRAME_BUS_NAME, VideoTrack
+from tests.unit.helpers import FakeCamera
+
+
+def _image(value: int) -> np.ndarray:
+    return np.full((4, 6, 3), value, dtype=np.uint8)
+
+
+@pytest.fixture
+def bus():
+    bus = FrameBus(slots=4, slot_size=_image(0).nbytes)
+    yield bus
+    bus.close()
+
+
+def _read_in_child(name: str) -> tuple[int, int, int]:
+    reader = FrameBusReader(name)
+    frame = reader.read_latest()
+    result = frame.sequence, frame.pts, int(frame.image.sum())
+    del frame
+    reader.close()
+    return result
+
+
+def test_readers_have_their_own_cursors(bus):
+    first, second = FrameBusReader(bus.name), FrameBusReader(bus.name)
+    bus.publish(_image(1), pts=900, captured_at=10.0)
+    bus.publish(_image(2), pts=1800, captured_at=10.01)
+
+    frame = first.read()
+    assert (frame.sequence, frame.pts, frame.captured_at) == (1, 900, 10.0)
+    assert (frame.width, frame.height, frame.image.shape) == (6, 4, (4, 6, 3))
+    assert not frame.image.flags.owndata  # a view, not a copy
+    assert first.read().image[0, 0, 0] == 2
+    assert first.read() is None
+
+    assert second.read().sequence == 1
+    del frame
+    first.close()
+    second.close()
+
+
+def test_slow_reader_detects_overruns_and_overwrites(bus):
+    reader = FrameBusReader(bus.name)
+    bus.publish(_image(1), 0, 0.0)
+    held = reader.get(1)
+    for value in range(2, 9):
+        bus.publish(_image(value), 0, 0.0)
+
+    assert not reader.intact(held)
+    # Slots hold 4 frames and the oldest may be mid-rewrite, so 6..8 remain.
+    frame = reader.read()
+    assert frame.sequence == 6
+    assert reader.overruns == 5  # 1..5
+    del held, frame
+    reader.close()
+
+
+def test_oversized_frame_is_skipped(bus):
+    assert bus.publish(np.zeros((10, 10, 3), np.uint8), 0, 0.0) is None
+    assert bus.latest == 0
+
+
+def test_reader_attaches_from_another_process(bus):
+    bus.publish(_image(3), pts=4500, captured_at=1.0)
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        sequence, pts, total = pool.submit(_read_in_child, bus.name).result(timeout=30)
+    assert (sequence, pts, total) == (1, 4500, 3 * 4 * 6 * 3)
+    # The child detaching must not have unlinked the segment.
+    bus.publish(_image(4), 0, 0.0)
+    reader = FrameBusReader(bus.name)
+    assert reader.latest == 2
+    reader.close()
+
+
+def test_named_bus_replaces_a_stale_segment():
+    stale = FrameBus(slots=2, slot_size=8, name="birdstream-test-bus")
+    stale.shm.close()  # as if its publisher had crashed
+    bus = FrameBus(slots=4, slot_size=_image(0).nbytes, name="birdstream-test-bus")
+    try:
+        bus.publish(_image(5), 0, 0.0)
+        reader = FrameBusReader("birdstream-test-bus")
+        assert reader.slots == 4
+        assert reader.read_latest().image[0, 0, 0] == 5
+        reader.close()
+    finally:
+        bus.close()
+
+
+async def test_capture_publishes_frames_to_the_bus(monkeypatch):
+    monkeypatch.setattr(video_service.cv2, "VideoCapture", FakeCamera)
+    track = VideoTrack(frame_bus=True)
+    try:
+        await asyncio.wait_for(track._next_frame(), timeout=2)
+        reader = FrameBusReader(VIDEO_FRAME_BUS_NAME)
+        await asyncio.sleep(0.1)
+        frame = reader.read_latest()
+        assert frame.image.shape == (48, 64, 3)
+        assert frame.pts > 0
+        del frame
+        reader.close()
+    finally:
+        track.stop()
+    assert track.frame_bus is None
+
+
+class _BlockedCamera(FakeCamera):
+    def __init__(self, *args):
+        super().__init__()
+        self.reading = threading.Event()
+        self.unblock = threading.Event()
+
+    def read(self):
+        if self.reads:
+            self.reading.set()
+            self.unblock.wait()
+        return super().read()
+
+
+async def test_a_read_finishing_after_stop_does_not_recreate_the_bus(monkeypatch):
+    monkeypatch.setattr(video_service.cv2, "VideoCapture", _BlockedCamera)
+    track = VideoTrack(frame_bus=True)
+    await asyncio.wait_for(track._next_frame(), timeout=2)
+    assert await asyncio.to_thread(track.camera.reading.wait, 2)
+    track.stop()
+    track.camera.unblock.set()
+    await asyncio.gather(*video_service._teardowns)
+    assert track.frame_bus is None
+    with pytest.raises(FileNotFoundError):
+        FrameBusReader(VIDEO_FRAME_BUS_NAME)
@@ -0,0 +1,95 @@
+import fractions
+import io
+import re
+
+import av
+import pytest
+from aiortc import VideoStreamTrack
+
+from services.connection_manager import ConnectionManager
+from services.encoder_service import EncodingFanout
+from services.hls_service import HlsPackager, HlsRequestError, HlsUnavailableError, split_annex_b, sps_dimensions
+from services.source_service import MediaSource
+
+
+def _decode(data: bytes) -> list[av.VideoFrame]:
+    with av.open(io.BytesIO(data), format="mp4") as container:
+        return list(container.decode(video=0))
+
+
+@pytest.fixture
+async def packager():
+    source = MediaSource(lambda: (None, EncodingFanout(VideoStreamTrack())), ConnectionManager())
+    packager = HlsPackager(source, segment_target=1.0, part_target=0.25, window=3)
+    yield packager
+    await packager.stop()
+    await source.stop()
+
+
+async def test_playlist_lists_parts_and_preload_hint(packager):
+    playlist = await packager.playlist()
+    assert playlist.startswith("#EXTM3U\n")
+    assert "#EXT-X-PART-INF:PART-TARGET=0.250" in playlist
+    assert re.search(r'#EXT-X-MAP:URI="init-\d+\.mp4"', playlist)
+    assert re.search(r'#EXT-X-PART:DURATION=[\d.]+,URI="part-\d+\.0\.m4s",INDEPENDENT=YES', playlist)
+    assert "#EXT-X-PRELOAD-HINT:TYPE=PART" in playlist
+    for duration in re.findall(r"#EXT-X-PART:DURATION=([\d.]+)", playlist):
+        assert float(duration) <= 0.25
+
+
+async def test_segments_and_parts_decode_with_the_init_segment(packager):
+    playlist = await packager.playlist()
+    msn = int(re.search(r"#EXT-X-MEDIA-SEQUENCE:(\d+)", playlist).group(1))
+    init = await packager.media(re.search(r'URI="(init-\d+\.mp4)"', playlist).group(1))
+
+    part = await packager.media(f"part-{msn}.0.m4s")
+    assert len(_decode(init + part)) >= 1
+
+    # Blocks until the segment is complete.
+    segment = await packager.media(f"seg-{msn}.m4s")
+    frames = _decode(init + segment)
+    assert 15 <= len(frames) <= 45
+    assert (frames[0].width, frames[0].height) == (640, 480)
+
+
+async def test_blocking_reload_waits_for_the_requested_part(packager):
+    playlist = await packager.playlist()
+    msn = int(re.search(r"#EXT-X-MEDIA-SEQUENCE:(\d+)", playlist).group(1))
+    playlist = await packager.playlist(msn + 1, 0)
+    assert f'URI="part-{msn + 1}.0.m4s"' in playlist
+
+    with pytest.raises(HlsRequestError):
+        await packager.playlist(msn + 10, 0)
+    assert await packager.media(f"seg-{msn - 100}.m4s") is None
+    assert await packager.media("bogus.m4s") is None
+
+
+async def test_unavailable_without_a_shared_encoder():
+    source = MediaSource(lambda: (None, None), ConnectionManager())
+    packager = HlsPackager(source)
+    with pytest.raises(HlsUnavailableError):
+        await packager.playlist()
+    await source.stop()
+
+
+@pytest.mark.parametrize(
+    "width, height, profile, pix_fmt, options",
+    [
+        (640, 480, "Baseline", "yuv420p", {}),
+        (1920, 1080, "High", "yuv420p", {}),  # cropped from 1088
+        (322, 242, "High", "yuv420p", {"cqm": "jvt"}),  # scaling matrices
+        (720, 576, "High", "yuv420p", {"x264-params": "interlaced=1"}),
+        (322, 242, "High 4:4:4 Predictive", "yuv444p", {}),
+    ],
+)
+def test_sps_dimensions_match_the_encoded_size(width, height, profile, pix_fmt, options):
+    codec = av.CodecContext.create("libx264", "w")
+    codec.width, codec.height, codec.pix_fmt = width, height, pix_fmt
+    codec.time_base = fractions.Fraction(1, 30)
+    codec.profile = profile
+    codec.options = options
+    frame = av.VideoFrame(width, height, pix_fmt)
+    frame.pts = 0
+    packets = codec.encode(frame) + codec.encode()
+    sps = next(nal for nal in split_annex_b(bytes(packets[0])) if nal[0] & 0x1F == 7)
+    assert sps_dimensions(sps) == (width, height)
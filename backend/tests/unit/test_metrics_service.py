@@ -0,0 +1,45 @@
+import pytest
+
+from services.metrics_service import MetricsRegistry
+
+
+def test_counter_and_gauge_render_prometheus_text():
+    registry = MetricsRegistry()
+    frames = registry.counter("test_frames_total", "Frames seen", ("reason",))
+    fill = registry.gauge("test_fill", "Buffer fill")
+    frames.inc(reason="overflow")
+    frames.inc(2, reason="overflow")
+    fill.set(3)
+
+    text = registry.render()
+    assert "# TYPE test_frames_total counter" in text
+    assert 'test_frames_total{reason="overflow"} 3' in text
+    assert "test_fill 3" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    text = registry.render()
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "test_latency_seconds_count 3" in text
+
+
+def test_registering_twice_returns_the_same_metric():
+    registry = MetricsRegistry()
+    assert registry.counter("test_total", "x") is registry.counter("test_total", "x")
+    with pytest.raises(ValueError):
+        registry.gauge("test_total", "x")
+
+
+def test_wrong_labels_are_rejected():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_labelled_total", "x", ("reason",))
+    with pytest.raises(ValueError):
+        counter.inc(other="x")
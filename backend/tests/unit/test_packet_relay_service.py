@@ -0,0 +1,62 @@
+import asyncio
+import fractions
+
+import av
+from aiortc import MediaStreamTrack
+
+from services.camera_service import Camera, CameraConfig
+from services.connection_manager import ConnectionManager
+from services.encoder_service import PassthroughFanout
+from services.packet_relay_service import PacketRelayServer, RemotePacketTrack
+from services.source_service import MediaSource
+
+
+class FakeEncodedTrack(MediaStreamTrack):
+    kind = "video"
+    passthrough = True
+
+    def __init__(self):
+        super().__init__()
+        self.pts = 0
+
+    async def recv(self) -> av.Packet:
+        await asyncio.sleep(0.001)
+        packet = av.Packet(b"\x00\x00\x00\x01" + bytes([self.pts % 256]) * 16)
+        packet.pts = self.pts
+        packet.time_base = fractions.Fraction(1, 90000)
+        packet.is_keyframe = self.pts % 3000 == 0
+        self.pts += 3000
+        return packet
+
+
+async def test_relay_streams_packets_and_keyframe_requests(tmp_path):
+    fanouts: list[PassthroughFanout] = []
+
+    def factory():
+        fanouts.append(PassthroughFanout(FakeEncodedTrack()))
+        return None, fanouts[-1]
+
+    source = MediaSource(factory, ConnectionManager(), grace=0)
+    relay = PacketRelayServer(Camera(CameraConfig("feeder", "", "Feeder"), source), path=str(tmp_path / "feeder.sock"))
+    await relay.start()
+
+    remote = RemotePacketTrack(relay.path)
+    packet = await remote.recv()
+    assert (packet.pts, packet.time_base, packet.is_keyframe) == (0, fractions.Fraction(1, 90000), True)
+    assert bytes(packet) == b"\x00\x00\x00\x01" + b"\x00" * 16
+    assert source.active
+
+    requested = asyncio.Event()
+    fanouts[0].request_keyframe = requested.set
+    remote.request_keyframe()
+    await asyncio.wait_for(requested.wait(), 1)
+
+    # The worker hanging up releases the camera.
+    remote.stop()
+    for _ in range(100):
+        if not source.active:
+            break
+        await asyncio.sleep(0.01)
+    assert not source.active
+    await relay.stop()
+    await source.stop()
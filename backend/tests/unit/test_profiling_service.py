@@ -0,0 +1,46 @@
+import asyncio
+import logging
+import threading
+import time
+
+from services.profiling_service import LOOP_STALLS, LoopMonitor, sample_stacks
+
+
+def _spin(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sample_stacks_returns_collapsed_stacks():
+    stop = threading.Event()
+    spinner = threading.Thread(target=_spin, args=(stop,), name="spinner")
+    spinner.start()
+    try:
+        folded = sample_stacks(0.2, 200)
+    finally:
+        stop.set()
+        spinner.join()
+    lines = folded.splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+    spinning = [line for line in lines if line.startswith("spinner;")]
+    assert any("_spin (tests/unit/test_profiling_service.py:" in line for line in spinning)
+
+
+async def test_blocked_loop_is_logged_with_the_blocking_stack(caplog):
+    monitor = LoopMonitor(interval=0.02, threshold=0.1)
+    await monitor.start()
+    before = LOOP_STALLS.get()
+    try:
+        await asyncio.sleep(0.05)
+        with caplog.at_level(logging.WARNING, logger="profiling_service"):
+            time.sleep(0.3)  # a blocking call on the loop
+            await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+    assert LOOP_STALLS.get() == before + 1
+    blocked, unblocked = [r.getMessage() for r in caplog.records]
+    assert "Event loop blocked" in blocked and "test_blocked_loop_is_logged_with_the_blocking_stack" in blocked
+    assert "unblocked after" in unblocked
@@ -0,0 +1,42 @@
+from aiortc import RTCPeerConnection, VideoStreamTrack
+
+from services.connection_manager import ConnectionManager
+from services.reaper_service import PEER_STATE_DEADLINES, PEERS_REAPED, SOCKETS_REAPED, PeerReaper
+
+
+async def _gathering_peer() -> RTCPeerConnection:
+    pc = RTCPeerConnection()
+    pc.addTrack(VideoStreamTrack())
+    await pc.setLocalDescription(await pc.createOffer())  # binds the ICE sockets
+    return pc
+
+
+async def test_peers_past_their_state_deadline_are_reaped():
+    manager = ConnectionManager()
+    stuck = await _gathering_peer()
+    await manager.add_peer("stuck", stuck)
+    await manager.add_peer("other", await _gathering_peer())
+    reaper = PeerReaper(manager, deadlines={"new": 0.0})
+    reaped_before, sockets_before = PEERS_REAPED.get(state="new"), SOCKETS_REAPED.get()
+    try:
+        assert await reaper.sweep() == 2
+        assert manager.pcs == {} and stuck.connectionState == "closed"
+        assert PEERS_REAPED.get(state="new") == reaped_before + 2
+        assert SOCKETS_REAPED.get() > sockets_before
+    finally:
+        await manager.clean_up()
+
+
+async def test_peers_within_their_deadline_are_kept():
+    manager = ConnectionManager()
+    pc = await _gathering_peer()
+    await manager.add_peer("viewer", pc)
+    try:
+        assert await PeerReaper(manager, deadlines={"new": 60.0, "connecting": 0.0}).sweep() == 0
+        assert manager.get_peer("viewer") is pc
+    finally:
+        await manager.clean_up()
+
+
+def test_deadlines_only_name_states_aiortc_reaches():
+    assert set(PEER_STATE_DEADLINES) <= {"new", "connecting", "connected", "failed", "closed"}
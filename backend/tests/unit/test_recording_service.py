@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import av
+import pytest
+from aiortc import VideoStreamTrack
+
+from services.connection_manager import ConnectionManager
+from services.encoder_service import EncodingFanout
+from services.recording_service import INDEX_FILE, RecordedSegment, Recorder, SegmentIndex
+from services.source_service import MediaSource
+
+
+def _segments(*starts: float) -> list[RecordedSegment]:
+    return [RecordedSegment(start, 10.0, 100, f"{int(start * 1000)}.mp4") for start in starts]
+
+
+def test_index_finds_overlapping_segments():
+    index = SegmentIndex(_segments(30, 0, 10, 20))
+    assert [s.start for s in index.between(5, 15)] == [0, 10]
+    assert [s.start for s in index.between(10, 10.5)] == [10]
+    assert [s.start for s in index.between(45, 50)] == []
+
+
+def test_index_prunes_by_age_and_size(tmp_path):
+    index = SegmentIndex(_segments(0, 10, 20, 30))
+    assert [s.start for s in index.prune(now=45, max_age=30, max_bytes=1000)] == [0]
+    assert [s.start for s in index.prune(now=45, max_age=30, max_bytes=150)] == [10, 20]
+
+    index.dump(tmp_path / INDEX_FILE)
+    assert SegmentIndex.load(tmp_path / INDEX_FILE).segments == index.segments
+
+
+@pytest.fixture
+async def recorder(tmp_path):
+    source = MediaSource(lambda: (None, EncodingFanout(VideoStreamTrack())), ConnectionManager())
+    recorder = Recorder(source, str(tmp_path), segment_seconds=1.0, flush_seconds=0.25)
+    await recorder.start()
+    yield recorder
+    await recorder.stop()
+    await source.stop()
+
+
+async def test_recorder_writes_segments_and_exports_clips(recorder, tmp_path):
+    started = time.time()
+    await asyncio.sleep(3.5)
+    assert len(recorder.index.segments) >= 2
+    assert (tmp_path / INDEX_FILE).read_text().count("\n") == len(recorder.index.segments)
+    first, second = recorder.index.segments[:2]
+    assert second.start == pytest.approx(first.end, abs=0.001)
+
+    path = await recorder.export_clip(started + 0.5, started + 3.0)
+    try:
+        with av.open(str(path)) as container:
+            frames = list(container.decode(video=0))
+        assert frames[0].key_frame
+        assert (frames[0].width, frames[0].height) == (640, 480)
+        # 2.5 s requested, plus up to one segment of lead-in from the keyframe.
+        assert 70 <= len(frames) <= 110
+    finally:
+        path.unlink()
+
+    assert await recorder.export_clip(started - 100, started - 50) is None
+
+
+async def test_recorder_recovers_the_open_segment(tmp_path):
+    source = MediaSource(lambda: (None, EncodingFanout(VideoStreamTrack())), ConnectionManager())
+    recorder = Recorder(source, str(tmp_path), segment_seconds=10.0, flush_seconds=0.25)
+    await recorder.start()
+    await asyncio.sleep(1.5)
+    # Simulate a crash: the open segment never gets its index line.
+    recorder._task.cancel()
+    await asyncio.gather(recorder._task, return_exceptions=True)
+    await recorder.stop()
+    (tmp_path / INDEX_FILE).write_text("")
+
+    restarted = Recorder(source, str(tmp_path))
+    await restarted.start()
+    try:
+        assert len(restarted.index.segments) == 1
+        assert restarted.index.segments[0].duration > 1.0
+    finally:
+        await restarted.stop()
+        await source.stop()
@@ -0,0 +1,105 @@
+import asyncio
+
+from aiortc import VideoStreamTrack
+
+from services.rendition_service import (
+    RENDITIONS,
+    RenditionLadder,
+    RenditionSelector,
+    UPSWITCH_HOLD,
+    parse_renditions,
+)
+
+LADDER = parse_renditions("1080p,720p,360p")
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_renditions_orders_highest_first():
+    assert [r.name for r in parse_renditions("360p, 1080p,720p")] == ["1080p", "720p", "360p"]
+    assert parse_renditions("") == []
+
+
+def test_selector_starts_within_initial_estimate():
+    selector = RenditionSelector(LADDER, clock=_Clock())
+    assert selector.rendition == RENDITIONS["360p"]
+
+
+def test_remb_estimate_moves_up_and_down():
+    clock = _Clock()
+    selector = RenditionSelector(LADDER, clock=clock)
+
+    assert selector.on_estimate(6_000_000) is None  # ceiling is higher, but still holding
+    clock.now += UPSWITCH_HOLD
+    assert selector.on_estimate(6_000_000) == RENDITIONS["720p"]
+
+    clock.now += 5
+    assert selector.on_estimate(800_000) == RENDITIONS["360p"]
+
+
+def test_heavy_loss_steps_down_and_resets_hold():
+    clock = _Clock()
+    selector = RenditionSelector(LADDER, clock=clock)
+    selector.index = 0
+
+    clock.now += 5
+    assert selector.on_loss(0.2) == RENDITIONS["720p"]
+    clock.now += UPSWITCH_HOLD - 1
+    assert selector.on_loss(0.0) is None
+    clock.now += 1
+    assert selector.on_loss(0.0) == RENDITIONS["1080p"]
+
+
+def test_switches_are_rate_limited():
+    clock = _Clock()
+    selector = RenditionSelector(LADDER, clock=clock)
+    selector.index = 0
+    clock.now += 5
+    assert selector.on_loss(0.5) is not None
+    assert selector.on_loss(0.5) is None
+
+
+async def test_adaptive_track_switches_rendition_on_a_keyframe():
+    ladder = RenditionLadder(VideoStreamTrack(), parse_renditions("480p,240p"))
+    track = ladder.subscribe()
+    try:
+        first = await asyncio.wait_for(track.recv(), timeout=5)
+        assert first.is_keyframe
+        assert track.rendition.name == "240p"
+
+        track.switch_to(RENDITIONS["480p"])
+        while track.rendition.name != "480p":
+            packet = await asyncio.wait_for(track.recv(), timeout=5)
+        assert packet.is_keyframe
+        assert ladder.fanouts["240p"].subscriber_count == 0
+        assert ladder.fanouts["480p"].subscriber_count == 1
+    finally:
+        track.stop()
+        await ladder.stop()
+
+
+async def test_rungs_at_or_above_the_source_height_are_merged():
+    ladder = RenditionLadder(VideoStreamTrack(), parse_renditions("720p,480p,240p"))
+    assert [r.name for r in ladder.usable_renditions()] == ["720p", "480p", "240p"]  # height unknown
+    track = ladder.subscribe()
+    try:
+        await asyncio.wait_for(track.recv(), timeout=5)  # the 640x480 test source
+        assert [r.name for r in ladder.usable_renditions()] == ["480p", "240p"]
+    finally:
+        track.stop()
+        await ladder.stop()
+
+
+def test_selector_keeps_its_place_when_rungs_are_merged():
+    selector = RenditionSelector(LADDER, clock=_Clock())
+    selector.index = 0  # 1080p
+    selector.set_renditions(parse_renditions("720p,360p"))
+    assert selector.rendition == RENDITIONS["720p"]
+    selector.set_renditions(parse_renditions("360p"))
+    assert selector.rendition == RENDITIONS["360p"]
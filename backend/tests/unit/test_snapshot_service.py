@@ -0,0 +1,75 @@
+import asyncio
+
+import cv2
+import numpy as np
+import pytest
+from aiortc import VideoStreamTrack
+
+from services.connection_manager import ConnectionManager
+from services.encoder_service import EncodingFanout
+from services.snapshot_service import (
+    SnapshotService,
+    SnapshotUnavailableError,
+    quantize_quality,
+)
+from services.source_service import MediaSource
+
+
+def _image(data: bytes) -> np.ndarray:
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+@pytest.fixture
+async def snapshots():
+    source = MediaSource(lambda: (None, EncodingFanout(VideoStreamTrack())), ConnectionManager())
+    service = SnapshotService(source, max_fps=2)
+    yield service
+    await service.stop()
+    await source.stop()
+
+
+async def test_snapshot_decodes_the_shared_stream(snapshots):
+    snapshot = await snapshots.snapshot()
+    assert snapshot.data.startswith(b"\xff\xd8")
+    assert _image(snapshot.data).shape == (480, 640, 3)
+
+    small = await snapshots.snapshot(width=320, quality=50)
+    assert _image(small.data).shape == (240, 320, 3)
+    assert small.etag != snapshot.etag
+
+
+async def test_snapshot_is_encoded_at_most_max_fps(snapshots):
+    first = await snapshots.snapshot()
+    results = await asyncio.gather(*(snapshots.snapshot() for _ in range(20)))
+    assert all(result is first for result in results)
+
+    await asyncio.sleep(0.6)
+    fresh = await snapshots.snapshot()
+    assert fresh.created > first.created
+    assert fresh.sequence > first.sequence
+
+
+async def test_snapshot_follows_raw_frames_in_per_peer_mode():
+    source = MediaSource(lambda: (None, VideoStreamTrack()), ConnectionManager())
+    service = SnapshotService(source)
+    try:
+        snapshot = await service.snapshot(width=160)
+        assert _image(snapshot.data).shape == (120, 160, 3)
+    finally:
+        await service.stop()
+        await source.stop()
+
+
+async def test_snapshot_without_video_is_unavailable():
+    source = MediaSource(lambda: (None, None), ConnectionManager())
+    service = SnapshotService(source)
+    with pytest.raises(SnapshotUnavailableError):
+        await service.snapshot()
+    await service.stop()
+    await source.stop()
+
+
+def test_quality_is_quantized():
+    assert quantize_quality(1) == 5
+    assert quantize_quality(83) == 85
+    assert quantize_quality(100) == 100
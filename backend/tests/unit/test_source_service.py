@@ -0,0 +1,59 @@
+import asyncio
+
+from aiortc import VideoStreamTrack
+
+from services.connection_manager import ConnectionManager
+from services.source_service import MediaSource
+
+
+class _Factory:
+    def __init__(self):
+        self.opened: list[VideoStreamTrack] = []
+
+    def __call__(self):
+        track = VideoStreamTrack()
+        self.opened.append(track)
+        return None, track
+
+
+async def test_suspends_after_grace_and_resumes_on_acquire():
+    manager, factory = ConnectionManager(), _Factory()
+    source = MediaSource(factory, manager, grace=0.05)
+    await source.start()
+    first = factory.opened[0]
+
+    await asyncio.sleep(0.1)
+    assert not source.active
+    assert first.readyState == "ended"
+
+    _, video = await source.acquire()
+    assert video is factory.opened[1] and video.readyState == "live"
+    await source.stop()
+
+
+async def test_stays_open_while_a_peer_is_connected():
+    manager, factory = ConnectionManager(), _Factory()
+    source = MediaSource(factory, manager, grace=0.05)
+    await source.start()
+
+    manager.pcs["viewer"] = object()
+    manager._notify_change()
+    await asyncio.sleep(0.1)
+    assert source.active
+
+    manager.pcs.clear()
+    manager._notify_change()
+    await asyncio.sleep(0.1)
+    assert not source.active
+    assert len(factory.opened) == 1
+    await source.stop()
+
+
+async def test_negative_grace_never_suspends():
+    manager, factory = ConnectionManager(), _Factory()
+    source = MediaSource(factory, manager, grace=-1)
+    await source.start()
+    await asyncio.sleep(0.05)
+    assert source.active
+    await source.stop()
+    assert factory.opened[0].readyState == "ended"
@@ -0,0 +1,57 @@
+import asyncio
+
+from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
+from aiortc.rtp import RTCP_PSFB_PLI, RtcpPsfbPacket
+
+from models.datastructures import ClientModel, OfferModel
+from services.stats_service import RTCP_FEEDBACK, PeerStatsCollector
+from services.webrtc_service import handle_offer, pcs_manager
+from tests.unit.helpers import eventually
+
+
+async def _connect(peer_id: str) -> RTCPeerConnection:
+    client = RTCPeerConnection()
+    client.addTransceiver("video", direction="recvonly")
+    await client.setLocalDescription(await client.createOffer())
+    offer = OfferModel(sdp=client.localDescription.sdp, type="offer")
+    answer = await handle_offer(ClientModel(id=peer_id, offer=offer), None, VideoStreamTrack())
+    await client.setRemoteDescription(RTCSessionDescription(**answer))
+    await eventually(lambda: pcs_manager.get_peer(peer_id).connectionState == "connected", timeout=10)
+    return client
+
+
+async def test_collector_samples_peers_in_bounded_batches():
+    clients = [await _connect("robin"), await _connect("wren")]
+    collector = PeerStatsCollector(pcs_manager, batch=1)
+    try:
+        assert await collector.collect() == 1
+        assert await collector.collect() == 1
+        assert set(pcs_manager.stats) == {"robin", "wren"}
+
+        # Later samples have a bitrate, and RTT once receiver reports arrive.
+        for _ in range(40):
+            await collector.collect()
+            if all("rtt" in pcs_manager.stats[p]["video"] for p in ("robin", "wren")):
+                break
+            await asyncio.sleep(0.25)
+        video = pcs_manager.stats["robin"]["video"]
+        assert video["packets_sent"] > 0 and video["bitrate_bps"] > 0 and video["rtt"] >= 0
+        assert pcs_manager.get_peers(verbose=True)["robin"]["stats"] is pcs_manager.stats["robin"]
+    finally:
+        for client in clients:
+            await client.close()
+        await pcs_manager.clean_up()
+    assert pcs_manager.stats == {}
+
+
+async def test_instrumented_sender_counts_keyframe_requests():
+    client = await _connect("finch")
+    try:
+        sender = pcs_manager.get_peer("finch").getSenders()[0]
+        before = RTCP_FEEDBACK.get(kind="video", type="pli")
+        await sender._handle_rtcp_packet(RtcpPsfbPacket(fmt=RTCP_PSFB_PLI, ssrc=1, media_ssrc=sender._ssrc))
+        assert sender.feedback_counts["pli"] == 1
+        assert RTCP_FEEDBACK.get(kind="video", type="pli") == before + 1
+    finally:
+        await client.close()
+        await pcs_manager.clean_up()
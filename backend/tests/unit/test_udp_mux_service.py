@@ -0,0 +1,67 @@
+import asyncio
+import socket
+
+from aiortc import RTCPeerConnection, VideoStreamTrack
+
+from services.udp_mux_service import MUX_UNMATCHED, UdpMux
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def _viewer() -> tuple[RTCPeerConnection, asyncio.Future]:
+    client = RTCPeerConnection()
+    client.addTransceiver("video", direction="recvonly")
+    received = asyncio.get_running_loop().create_future()
+
+    @client.on("track")
+    def on_track(track):
+        async def read():
+            await track.recv()
+            if not received.done():
+                received.set_result(True)
+
+        asyncio.ensure_future(read())
+
+    await client.setLocalDescription(await client.createOffer())
+    return client, received
+
+
+async def test_peers_share_the_mux_port():
+    # The clients gather their own sockets before the mux is installed.
+    viewers = [await _viewer(), await _viewer()]
+    mux = UdpMux(port=_free_port())
+    await mux.start()
+    servers = []
+    try:
+        assert mux.enabled
+        for client, _ in viewers:
+            pc = RTCPeerConnection()
+            pc.addTrack(VideoStreamTrack())
+            servers.append(pc)
+            await pc.setRemoteDescription(client.localDescription)
+            await pc.setLocalDescription(await pc.createAnswer())
+            ports = {line.split()[5] for line in pc.localDescription.sdp.splitlines() if line.startswith("a=candidate")}
+            assert ports == {str(mux.port)}
+            await client.setRemoteDescription(pc.localDescription)
+        await asyncio.wait_for(asyncio.gather(*(received for _, received in viewers)), 10)
+        assert all(pc.connectionState == "connected" for pc in servers)
+    finally:
+        for pc in servers + [client for client, _ in viewers]:
+            await pc.close()
+        await mux.stop()
+    assert mux._routes == {}
+
+
+async def test_unknown_datagrams_are_dropped():
+    mux = UdpMux(port=_free_port())
+    await mux.start()
+    before = MUX_UNMATCHED.get()
+    try:
+        mux._sockets[0].datagram_received(b"\x80\x60not rtp for anyone", ("198.51.100.7", 4000))
+        assert MUX_UNMATCHED.get() == before + 1
+    finally:
+        await mux.stop()
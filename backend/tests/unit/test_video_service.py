@@ -0,0 +1,284 @@
+import asyncio
+import io
+import threading
+import time
+
+import av
+import numpy as np
+import pytest
+import pytz
+from aiortc.mediastreams import VIDEO_TIME_BASE
+
+from services import video_service
+from services.encoder_service import PassthroughFanout, encoder_load
+from services.video_service import (
+    INGEST_CONNECTIONS,
+    FrameRingBuffer,
+    IngestTrack,
+    JitterBuffer,
+    PassthroughTrack,
+    TimestampOverlay,
+    TsMonitor,
+    VideoTrack,
+    ingest_url,
+    open_passthrough,
+)
+from tests.unit.helpers import FakeCamera
+
+
+def _write_h264(path, profile: str, bframes: int, frames: int = 15) -> None:
+    with av.open(str(path), "w") as container:
+        stream = container.add_stream("libx264", rate=30)
+        stream.width, stream.height, stream.pix_fmt = 160, 120, "yuv420p"
+        stream.codec_context.profile = profile
+        stream.codec_context.options = {"bf": str(bframes)}
+        for i in range(frames):
+            frame = av.VideoFrame(160, 120, "rgb24")
+            frame.pts = i
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+@pytest.fixture
+def baseline_mp4(tmp_path):
+    path = tmp_path / "baseline.mp4"
+    _write_h264(path, "Baseline", bframes=0)
+    return path
+
+
+async def test_passthrough_accepts_baseline_h264(baseline_mp4):
+    track = open_passthrough(str(baseline_mp4))
+    assert isinstance(track, PassthroughTrack)
+    track.stop()
+
+
+async def test_passthrough_rejects_b_frames(tmp_path):
+    path = tmp_path / "high.mp4"
+    _write_h264(path, "High", bframes=3)
+    assert open_passthrough(str(path)) is None
+
+
+async def test_passthrough_rejects_profiles_above_the_negotiated_one(tmp_path):
+    path = tmp_path / "main.mp4"
+    _write_h264(path, "Main", bframes=0)
+    assert open_passthrough(str(path)) is None
+
+
+async def test_passthrough_emits_annex_b_with_increasing_pts_across_loops(baseline_mp4):
+    track = open_passthrough(str(baseline_mp4), loop=True)
+    track._throttle_playback = False
+    try:
+        packets = [await asyncio.wait_for(track.recv(), timeout=5) for _ in range(40)]
+    finally:
+        track.stop()
+
+    assert packets[0].is_keyframe
+    assert all(bytes(p).startswith((b"\x00\x00\x00\x01", b"\x00\x00\x01")) for p in packets)
+    pts = [p.pts for p in packets]
+    assert pts == sorted(set(pts))
+
+
+def test_ring_buffer_drop_oldest_keeps_latest_frames():
+    buffer = FrameRingBuffer(depth=2, drop_oldest=True)
+    assert buffer.put(np.full(1, 1), 1.0)
+    assert buffer.put(np.full(1, 2), 2.0)
+    assert not buffer.put(np.full(1, 3), 3.0)
+    assert [buffer.get()[1], buffer.get()[1]] == [2.0, 3.0]
+    assert buffer.get() is None
+
+
+def test_ring_buffer_drop_newest_keeps_continuity():
+    buffer = FrameRingBuffer(depth=2, drop_oldest=False)
+    buffer.put(np.full(1, 1), 1.0)
+    buffer.put(np.full(1, 2), 2.0)
+    assert not buffer.put(np.full(1, 3), 3.0)
+    assert [buffer.get()[1], buffer.get()[1]] == [1.0, 2.0]
+
+
+async def test_capture_runs_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(video_service.cv2, "VideoCapture", FakeCamera)
+    track = VideoTrack(buffer_depth=2)
+    try:
+        frame = await asyncio.wait_for(track._next_frame(), timeout=2)
+        assert frame.shape == (48, 64, 3)
+        assert track._capture_thread is not None
+        assert track._capture_thread is not threading.current_thread()
+    finally:
+        track.stop()
+
+
+class _SlowCamera(FakeCamera):
+    released = False
+
+    def read(self):
+        time.sleep(0.3)
+        return super().read()
+
+    def release(self):
+        self.released = True
+
+
+async def test_stop_does_not_block_the_event_loop(monkeypatch):
+    monkeypatch.setattr(video_service.cv2, "VideoCapture", _SlowCamera)
+    track = VideoTrack()
+    await asyncio.wait_for(track._next_frame(), timeout=2)
+    started = time.monotonic()
+    track.stop()
+    assert time.monotonic() - started < 0.1  # the capture thread is joined off the loop
+    await asyncio.gather(*video_service._teardowns)
+    assert track.camera.released
+
+
+def test_overlay_only_touches_bottom_left_roi():
+    overlay = TimestampOverlay(pytz.timezone("Europe/Amsterdam"))
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    overlay.apply(frame)
+
+    rows, cols = np.nonzero(frame.any(axis=2))
+    assert rows.size > 0
+    assert rows.min() > 240 - 40 and rows.max() < 240
+    assert cols.min() >= overlay.margin and cols.max() < 320
+
+
+def test_overlay_rasterizes_once_per_second(monkeypatch):
+    clock = [1_700_000_000.2]
+    monkeypatch.setattr(video_service.time, "time", lambda: clock[0])
+    overlay = TimestampOverlay(pytz.timezone("Europe/Amsterdam"))
+    frame = np.zeros((120, 320, 3), dtype=np.uint8)
+
+    for _ in range(10):
+        overlay.apply(frame)
+    assert overlay.renders == 1
+
+    clock[0] += 1
+    overlay.apply(frame)
+    assert overlay.renders == 2
+
+
+async def test_recv_yields_increasing_pts(monkeypatch):
+    monkeypatch.setattr(video_service.cv2, "VideoCapture", FakeCamera)
+    track = VideoTrack()
+    try:
+        frames = [await asyncio.wait_for(track.recv(), timeout=2) for _ in range(3)]
+    finally:
+        track.stop()
+
+    pts = [frame.pts for frame in frames]
+    assert pts == sorted(set(pts))
+    assert all(frame.time_base == VIDEO_TIME_BASE for frame in frames)
+
+
+def _mpegts(frames: int = 10, profile: str = "Baseline", bframes: int = 0) -> bytes:
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="mpegts") as container:
+        stream = container.add_stream("libx264", rate=30)
+        stream.width, stream.height, stream.pix_fmt = 160, 120, "yuv420p"
+        stream.codec_context.profile = profile
+        stream.codec_context.options = {"bf": str(bframes)}
+        for i in range(frames):
+            frame = av.VideoFrame(160, 120, "yuv420p")
+            frame.pts = i
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def test_ts_monitor_counts_continuity_gaps():
+    data = _mpegts(30)
+    packets = [data[i : i + 188] for i in range(0, len(data), 188)]
+    pids = [((p[1] & 0x1F) << 8) | p[2] for p in packets]
+    video_pid = max(set(pids), key=pids.count)
+    drop = [i for i, pid in enumerate(pids) if pid == video_pid][10]
+
+    intact, lossy = TsMonitor(), TsMonitor()
+    intact.feed(data)
+    stream = b"".join(p for i, p in enumerate(packets) if i != drop)
+    for i in range(0, len(stream), 1000):  # arbitrary read boundaries
+        lossy.feed(stream[i : i + 1000])
+    assert intact.lost == 0 and intact.packets == len(packets)
+    assert lossy.lost == 1
+
+
+def test_jitter_buffer_paces_and_rebuffers_after_underrun():
+    clock = [100.0]
+    buffer = JitterBuffer(delay=0.2, clock=lambda: clock[0])
+    buffer.put("a", 0.0)
+    buffer.put("b", 0.1)
+    assert buffer.pop() == (None, pytest.approx(0.2))
+    clock[0] += 0.2
+    assert buffer.pop() == ("a", 0.0)
+    assert buffer.pop() == (None, pytest.approx(0.1))
+    clock[0] += 0.1
+    assert buffer.pop() == ("b", 0.0)
+
+    # The sender stalls for a second: the next packet is held for the delay again.
+    clock[0] += 1.0
+    buffer.put("c", 0.2)
+    assert buffer.pop() == (None, pytest.approx(0.2))
+
+
+def test_jitter_buffer_overflow_skips_to_latest_keyframe():
+    clock = [0.0]
+    buffer = JitterBuffer(delay=0, max_items=4, clock=lambda: clock[0])
+    for i, key in enumerate([True, False, True, False]):
+        buffer.put(i, i / 30, keyframe=key)
+    assert not buffer.put(4, 4 / 30, keyframe=False)
+    released = []
+    while buffer:
+        clock[0] += 1 / 30
+        released.append(buffer.pop()[0])
+    assert [item for item in released if item is not None] == [2, 3, 4]
+
+
+def test_ingest_url_defaults_srt_to_listener():
+    assert ingest_url("srt://0.0.0.0:9000", latency_ms=120) == (
+        "srt://0.0.0.0:9000?mode=listener&latency=120000"
+    )
+    assert "mode=caller" in ingest_url("srt://host:9000?mode=caller")
+    assert ingest_url("udp://0.0.0.0:1234") == "udp://0.0.0.0:1234"
+
+
+async def test_ingest_passthrough_survives_reconnects(monkeypatch):
+    monkeypatch.setattr(video_service, "INGEST_RECONNECT_DELAY", 0.01)
+    sessions = []
+
+    def open_input(self):
+        sessions.append(1)
+        return io.BytesIO(_mpegts(10))
+
+    monkeypatch.setattr(IngestTrack, "_open_input", open_input)
+    track = IngestTrack("srt://0.0.0.0:9000", jitter_delay=0)
+    try:
+        packets = [await asyncio.wait_for(track.recv(), timeout=5) for _ in range(15)]
+    finally:
+        track.stop()
+
+    assert len(sessions) >= 2
+    assert packets[0].is_keyframe and packets[10].is_keyframe
+    assert all(bytes(p).startswith((b"\x00\x00\x00\x01", b"\x00\x00\x01")) for p in packets)
+    pts = [p.pts for p in packets]
+    assert pts == sorted(set(pts))
+
+
+async def test_ingest_transcodes_streams_it_cannot_pass_through(monkeypatch):
+    monkeypatch.setattr(video_service, "INGEST_RECONNECT_DELAY", 0.01)
+    monkeypatch.setattr(IngestTrack, "_open_input", lambda self: io.BytesIO(_mpegts(10, "High", bframes=2)))
+    track = IngestTrack("srt://0.0.0.0:9000", jitter_delay=0, camera="nestbox")
+    before = INGEST_CONNECTIONS.get(camera="nestbox", mode="decode")
+    fanout = PassthroughFanout(track, bitrate=200_000, height=60)
+    try:
+        packet = await asyncio.wait_for(fanout.subscribe().recv(), timeout=5)
+        assert encoder_load() >= fanout._encoder.load > 0
+    finally:
+        await fanout.stop()
+        track.stop()
+
+    assert isinstance(packet, av.Packet) and packet.is_keyframe  # re-encoded, not a reconnect loop
+    assert (fanout._encoder.bitrate, fanout._encoder.source_height) == (200_000, 120)
+    assert fanout._encoder._codec.height == 60
+    assert encoder_load() == 0
+    assert INGEST_CONNECTIONS.get(camera="nestbox", mode="decode") > before
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+from aioice.utils import random_string
+from aiortc import RTCConfiguration, RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
+from aiortc.mediastreams import MediaStreamError
+from aiortc.rtcicetransport import candidate_to_aioice
+from aiortc.sdp import SessionDescription
+
+from models.datastructures import ClientModel, IceCandidateModel, OfferModel
+from services import webrtc_service
+from services.webrtc_service import WarmPeerPool, add_ice_candidate, handle_offer, offer_kinds, restart_ice
+from tests.unit.helpers import eventually
+
+
+@pytest.fixture
+async def pool(monkeypatch):
+    pool = WarmPeerPool(size=1, max_age=60)
+    monkeypatch.setattr(webrtc_service, "warm_pool", pool)
+    yield pool
+    await pool.stop()
+    await webrtc_service.pcs_manager.clean_up()
+
+
+def test_offer_kinds():
+    sdp = "v=0\r\nm=audio 9 UDP/TLS/RTP/SAVPF 111\r\na=mid:0\r\nm=video 9 UDP/TLS/RTP/SAVPF 96\r\n"
+    assert offer_kinds(sdp) == ("audio", "video")
+    assert offer_kinds("v=0\r\n") == ()
+
+
+async def test_pool_only_hands_out_connections_matching_the_offer(pool):
+    assert pool.take(("audio", "video")) is None  # not started
+    await pool.start()
+    await eventually(lambda: pool.ready == 1)
+    assert pool.take(("video",)) is None
+    # It now also prepares connections for video-only offers.
+    await eventually(lambda: pool.ready == 2)
+    pc = pool.take(("video",))
+    assert [t.kind for t in pc.getTransceivers()] == ["video"]
+    assert pc.getTransceivers()[0].receiver.transport.transport.iceGatherer.state == "completed"
+    await pc.close()
+    # Alternating offers do not discard each other's connections.
+    await eventually(lambda: pool.ready == 2)
+    for kinds in [("audio", "video"), ("video",)]:
+        pc = pool.take(kinds)
+        assert [t.kind for t in pc.getTransceivers()] == list(kinds)
+        await pc.close()
+
+
+async def test_pool_stops_warming_kinds_no_longer_offered(pool):
+    pool.max_age = 0.5
+    await pool.start()
+    assert pool.take(("video",)) is None
+    await eventually(lambda: pool.ready == 2)
+    await eventually(lambda: [entry[1] for entry in pool._ready] == [("audio", "video")])
+
+
+async def test_prewarmed_answer_connects_and_accepts_trickled_candidates(pool):
+    pool.kinds = {("video",): float("inf")}
+    await pool.start()
+    await eventually(lambda: pool.ready == 1)
+    client = RTCPeerConnection()
+    client.addTransceiver("video", direction="recvonly")
+    await client.setLocalDescription(await client.createOffer())
+    offer = OfferModel(sdp=client.localDescription.sdp, type="offer")
+
+    answer = await handle_offer(ClientModel(id="robin", offer=offer), None, VideoStreamTrack())
+    assert webrtc_service.OFFER_ANSWER_SECONDS.get(ice="warm") == 1
+    await client.setRemoteDescription(RTCSessionDescription(**answer))
+
+    host = next(line for line in client.localDescription.sdp.splitlines() if line.startswith("a=candidate:"))
+    assert await add_ice_candidate(IceCandidateModel(id="robin", candidate=host[2:], sdpMLineIndex=0))
+    assert await add_ice_candidate(IceCandidateModel(id="robin", candidate=""))
+    assert not await add_ice_candidate(IceCandidateModel(id="wren", candidate=host[2:]))
+    with pytest.raises(ValueError):
+        await add_ice_candidate(IceCandidateModel(id="robin", candidate="candidate:bogus"))
+
+    server = webrtc_service.pcs_manager.get_peer("robin")
+    await eventually(lambda: server.connectionState == "connected" and client.connectionState == "connected")
+    await client.close()
+
+
+async def test_ice_restart_moves_the_session_to_the_clients_new_address(pool):
+    client = RTCPeerConnection(RTCConfiguration(iceServers=[]))
+    client.addTransceiver("video", direction="recvonly")
+    frames = []
+
+    @client.on("track")
+    def on_track(track):
+        async def read():
+            try:
+                while True:
+                    frames.append(await track.recv())
+            except MediaStreamError:
+                pass
+
+        asyncio.ensure_future(read())
+
+    await client.setLocalDescription(await client.createOffer())
+    offer = OfferModel(sdp=client.localDescription.sdp, type="offer")
+    answer = await handle_offer(ClientModel(id="robin", offer=offer), None, VideoStreamTrack())
+    await client.setRemoteDescription(RTCSessionDescription(**answer))
+    server = webrtc_service.pcs_manager.get_peer("robin")
+    await eventually(lambda: server.connectionState == "connected" and frames)
+    dtls = server.getTransceivers()[0].sender.transport
+    server_ice = dtls.transport.iceGatherer._connection
+
+    # The client's network changes: it gathers a new socket and restarts ICE.
+    gatherer = client.getTransceivers()[0].receiver.transport.transport.iceGatherer
+    ice = gatherer._connection
+    ice._protocols.clear()
+    ice._local_candidates = await ice.get_component_candidates(1, [server_ice._nominated[1].remote_addr[0]])
+    new_port = ice._local_candidates[0].port
+    ice._local_username, ice._local_password = random_string(4), random_string(22)
+    description = SessionDescription.parse(client.localDescription.sdp)
+    for media in description.media:
+        media.ice, media.ice_candidates = gatherer.getLocalParameters(), gatherer.getLocalCandidates()
+    restart = ClientModel(id="robin", offer=OfferModel(sdp=str(description), type="offer"))
+    answer = await restart_ice(restart)
+    media = SessionDescription.parse(answer["sdp"]).media[0]
+    ice.remote_username, ice.remote_password = media.ice.usernameFragment, media.ice.password
+    ice._remote_candidates, ice._check_list, ice._remote_candidates_end = [], [], False
+    for candidate in media.ice_candidates:
+        await ice.add_remote_candidate(candidate_to_aioice(candidate))
+    await webrtc_service._check_restarted(ice, time.monotonic() + 5)
+
+    try:
+        await eventually(lambda: server_ice._nominated[1].remote_addr[1] == new_port)
+        received = len(frames)
+        await eventually(lambda: len(frames) > received + 5)
+        assert server.connectionState == "connected"
+        assert server.getTransceivers()[0].sender.transport is dtls  # no new DTLS handshake
+
+        with pytest.raises(ValueError):
+            await restart_ice(restart)  # same credentials again: not a restart
+        assert await restart_ice(ClientModel(id="wren", offer=restart.offer)) is None
+    finally:
+        await client.close()
@@ -134,6 +134,7 @@ def start_stream(cmd_args):
                 "-f", "dshow",
                 "-i", f"video={device}",
                 "-c:v", "libx264",
+                "-profile:v", "baseline",
                 "-preset", "ultrafast",
                 "-tune", "zerolatency",
                 "-b:v", bitrate,
@@ -148,6 +149,7 @@ def start_stream(cmd_args):
                 "-framerate", str(fps),
                 "-i", f"{device}:none",
                 "-c:v", "libx264",
+                "-profile:v", "baseline",
                 "-preset", "ultrafast",
                 "-tune", "zerolatency",
                 "-b:v", bitrate,
@@ -180,6 +182,7 @@ def start_stream(cmd_args):
                     "-framerate", str(fps),
                     "-i", device,
                     "-c:v", "libx264",
+                    "-profile:v", "baseline",
                     "-preset", "ultrafast",
                     "-tune", "zerolatency",
                     "-b:v", bitrate,